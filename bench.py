@@ -0,0 +1,778 @@
+#!/usr/bin/env python3
+"""
+Windows MCP Benchmarks - load and latency suite for server.py and bridge.py
+Usage: python bench.py [--quick | --full] [--only NAME] [--output FILE] [--baseline FILE]
+Starts server.py on a free local port (on Linux /exec runs /bin/sh), drives its endpoints
+over raw HTTP and through the bridge's stdio JSON-RPC loop, and writes JSON results.
+"""
+
+import argparse
+import base64
+import fnmatch
+import http.client
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.join(HERE, "server.py")
+BRIDGE = os.path.join(HERE, "bridge.py")
+
+# Per mode: concurrency levels, requests per run, seconds per run and the size axes
+MODES = {
+    "quick": {
+        "concurrency": (1, 4),
+        "requests": 20,
+        "seconds": 5,
+        "payload": (1 << 10, 1 << 20),
+        "stdout": (64 << 10,),
+        "files": (100,),
+    },
+    "default": {
+        "concurrency": (1, 4, 16),
+        "requests": 200,
+        "seconds": 20,
+        "payload": (1 << 10, 1 << 20, 64 << 20),
+        "stdout": (64 << 10, 16 << 20),
+        "files": (100, 10000),
+    },
+    "full": {
+        "concurrency": (1, 4, 16),
+        "requests": 1000,
+        "seconds": 60,
+        "payload": (1 << 10, 1 << 20, 64 << 20, 1 << 30),
+        "stdout": (64 << 10, 16 << 20, 256 << 20),
+        "files": (100, 10000, 100000),
+    },
+}
+
+MAX_INFLIGHT_BYTES = 1 << 30  # payload runs skip concurrency levels that would move more than this at once
+READ_MAX_BYTES = 64 << 20     # the server's /read limit; bigger files go through /raw or uploads
+UPLOAD_CHUNK = 4 << 20
+REGRESSION_THRESHOLD = 10     # percent change in throughput or p95 latency reported by --baseline
+COMPARE_MIN_MS = 0.5          # p95 changes smaller than this are noise, whatever the percentage
+STARTUP_TIMEOUT = 30
+
+
+class BenchError(Exception):
+    pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, -(-len(values) * pct // 100) - 1))]
+
+
+def reset_peak_rss(pid):
+    # Linux only: writing 5 to clear_refs resets VmHWM, so each run reports its own peak
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss(pid):
+    """Peak resident set size of a process in bytes, where /proc provides it"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class HttpClient:
+    """Keep-alive HTTP client with one connection per thread"""
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None, keep=True):
+        """Returns (status, body bytes, byte count); with keep=False the body is counted and dropped"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+        try:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            pieces, count = [], 0
+            while True:
+                piece = response.read(1 << 20)
+                if not piece:
+                    break
+                count += len(piece)
+                if keep:
+                    pieces.append(piece)
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+        if response.will_close:
+            conn.close()
+            self.local.conn = None
+        return response.status, b"".join(pieces), count
+
+    def post(self, path, data):
+        """POST JSON and return (result, reply bytes); raises BenchError on a failed reply"""
+        body = json.dumps(data).encode()
+        status, payload, count = self.request("POST", path, body, {"Content-Type": "application/json"})
+        result = json.loads(payload.decode() or "{}")
+        if status >= 400 or result.get("success") is False:
+            raise BenchError(f"{path}: HTTP {status}: {result.get('error')}")
+        return result, len(body) + count
+
+    def get(self, path, keep=False):
+        status, _, count = self.request("GET", path, keep=keep)
+        if status >= 400:
+            raise BenchError(f"{path}: HTTP {status}")
+        return count
+
+
+class BridgeClient:
+    """Drives bridge.py over its stdio JSON-RPC loop, with many calls in flight"""
+
+    def __init__(self, port):
+        env = dict(os.environ, WINDOWS_MCP_HOSTS=f"default=127.0.0.1:{port}")
+        self.proc = subprocess.Popen([sys.executable, BRIDGE], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, env=env)
+        self.lock = threading.Lock()
+        self.pending = {}  # JSON-RPC id -> [event, response]
+        self.ids = itertools.count(1)
+        threading.Thread(target=self._read, daemon=True).start()
+        self.rpc("initialize", {"protocolVersion": "2024-11-05", "capabilities": {},
+                                "clientInfo": {"name": "bench", "version": "1"}})
+
+    def _read(self):
+        for line in self.proc.stdout:
+            message = json.loads(line)
+            waiter = self.pending.pop(message.get("id"), None)
+            if waiter is not None:  # progress notifications have no id
+                waiter[1] = message
+                waiter[0].set()
+        for waiter in list(self.pending.values()):
+            waiter[0].set()
+
+    def rpc(self, method, params):
+        waiter = [threading.Event(), None]
+        with self.lock:
+            req_id = next(self.ids)
+            self.pending[req_id] = waiter
+            self.proc.stdin.write(json.dumps({"jsonrpc": "2.0", "id": req_id, "method": method,
+                                              "params": params}).encode() + b"\n")
+            self.proc.stdin.flush()
+        waiter[0].wait()
+        if waiter[1] is None:
+            raise BenchError("bridge exited")
+        return waiter[1]
+
+    def call(self, tool, arguments):
+        """Run a tool and return (result, reply bytes); raises BenchError on a failed call"""
+        message = self.rpc("tools/call", {"name": tool, "arguments": arguments})
+        if "error" in message:
+            raise BenchError(f"{tool}: {message['error']['message']}")
+        text = message["result"]["content"][0]["text"]
+        result = json.loads(text)
+        if isinstance(result, dict) and result.get("success") is False:
+            raise BenchError(f"{tool}: {result.get('error')}")
+        return result, len(text)
+
+    def close(self):
+        self.proc.stdin.close()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class Bench:
+    """The running server and bridge, plus the files the scenarios work on"""
+
+    def __init__(self, workdir, server_args=(), powershell=None):
+        self.workdir = workdir
+        self.port = free_port()
+        self.powershell = powershell
+        args = [sys.executable, SERVER, str(self.port), "--hash-cache", os.path.join(workdir, "hash-cache.sqlite3")]
+        if powershell:
+            args += ["--powershell", powershell]
+        self.log = open(os.path.join(workdir, "server.log"), "wb")
+        self.server = subprocess.Popen(args + list(server_args), cwd=workdir, stdout=self.log,
+                                       stderr=subprocess.STDOUT)
+        self.http = HttpClient(self.port)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                self.http.get("/health")
+                break
+            except (OSError, BenchError):
+                if self.server.poll() is not None or time.monotonic() > deadline:
+                    raise BenchError(f"server.py did not start, see {self.log.name}")
+                time.sleep(0.1)
+        self.bridge = BridgeClient(self.port)
+        self.requests = 0
+
+    def close(self):
+        self.bridge.close()
+        self.server.terminate()
+        try:
+            self.server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.server.kill()
+            self.server.wait()
+        self.log.close()
+
+    def path(self, *parts):
+        path = os.path.join(self.workdir, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def fixture_file(self, size):
+        """A file of size bytes, created on first use"""
+        path = self.path("files", f"{size}.bin")
+        if not os.path.exists(path):
+            block = os.urandom(min(size, 1 << 20))
+            with open(path, "wb") as f:
+                remaining = size
+                while remaining:
+                    f.write(block[:remaining])
+                    remaining -= min(remaining, len(block))
+        return path
+
+    def fixture_tree(self, count):
+        """A tree of count small text files, 100 per directory, created on first use"""
+        root = os.path.join(self.workdir, "trees", str(count))
+        if not os.path.isdir(root):
+            for i in range(count):
+                path = self.path("trees", str(count), f"d{i // 100:04d}", f"f{i:06d}.txt")
+                with open(path, "w") as f:
+                    f.write("".join(f"line {n} of file {i}{' needle' if n == 7 else ''}\n" for n in range(40)))
+        return root
+
+
+# Scenarios take (bench, transport, size) and return op(worker, index) -> bytes moved,
+# or None when the transport or size doesn't apply
+
+
+def bench_health(b, transport, size):
+    if transport == "http":
+        return lambda w, i: b.http.get("/health")
+    return lambda w, i: b.bridge.call("win_shell_status", {})[1]
+
+
+def bench_info(b, transport, size):
+    if transport == "http":
+        return lambda w, i: b.http.get("/info")
+    return lambda w, i: b.bridge.call("win_server_info", {})[1]
+
+
+def bench_metrics(b, transport, size):
+    if transport == "http":
+        return lambda w, i: b.http.get("/metrics")
+
+
+def bench_exec(b, transport, size):
+    if transport == "http":
+        return lambda w, i: b.http.post("/exec", {"cmd": "echo hello"})[1]
+    return lambda w, i: b.bridge.call("win_exec", {"command": "echo hello"})[1]
+
+
+def bench_stdout(b, transport, size):
+    # The interpreter running this script exists on every platform, unlike head or tr
+    cmd = f'"{sys.executable}" -c "import sys; sys.stdout.write(chr(120) * {size})"'
+    if transport == "http":
+        return lambda w, i: b.http.post("/exec", {"cmd": cmd})[1]
+    return lambda w, i: b.bridge.call("win_exec", {"command": cmd})[1]
+
+
+def bench_powershell(b, transport, size):
+    if not b.powershell:
+        return None
+    if transport == "http":
+        return lambda w, i: b.http.post("/powershell", {"cmd": "Write-Output hello"})[1]
+    return lambda w, i: b.bridge.call("win_powershell", {"command": "Write-Output hello"})[1]
+
+
+def bench_read(b, transport, size):
+    if size > READ_MAX_BYTES:
+        return None
+    path = b.fixture_file(size)
+    if transport == "http":
+        return lambda w, i: b.http.post("/read", {"path": path, "binary": True})[1]
+    return lambda w, i: b.bridge.call("win_read_file_b64", {"path": path})[1]
+
+
+def bench_raw(b, transport, size):
+    path = b.fixture_file(size)
+    if transport == "http":
+        url = "/raw?" + urllib.parse.urlencode({"path": path})
+        return lambda w, i: b.http.get(url)
+
+    def op(w, i):
+        b.bridge.call("win_pull_file", {"path": path, "local_path": b.path("pulled", f"{size}-{w}.bin"),
+                                        "delta": False})
+        return size
+    return op
+
+
+def bench_write(b, transport, size):
+    source = b.fixture_file(size)
+    if transport == "http":
+        if size > READ_MAX_BYTES:
+            return None
+        with open(source, "rb") as f:
+            content = base64.b64encode(f.read()).decode()
+        return lambda w, i: b.http.post("/write", {
+            "path": b.path("written", f"{size}-{w}.bin"), "content": content, "binary": True})[1]
+    if size <= 1 << 20:
+        content = "x" * size
+        return lambda w, i: b.bridge.call("win_write_file", {
+            "path": b.path("written", f"{size}-{w}.txt"), "content": content, "delta": False})[1] + size
+    return lambda w, i: b.bridge.call("win_write_file", {
+        "path": b.path("written", f"{size}-{w}.bin"), "local_path": source, "delta": False})[1] + size
+
+
+def bench_upload(b, transport, size):
+    if transport != "http":
+        return None
+    source = b.fixture_file(size)
+
+    def op(w, i):
+        result, _ = b.http.post("/upload/open", {"path": b.path("uploaded", f"{size}-{w}.bin")})
+        upload_id, offset = result["upload_id"], 0
+        with open(source, "rb") as f:
+            while True:
+                chunk = f.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                query = urllib.parse.urlencode({"id": upload_id, "offset": offset})
+                status, _, _ = b.http.request("POST", f"/upload/chunk?{query}", chunk,
+                                              {"Content-Type": "application/octet-stream"})
+                if status != 200:
+                    raise BenchError(f"/upload/chunk: HTTP {status}")
+                offset += len(chunk)
+        b.http.post("/upload/commit", {"upload_id": upload_id, "size": size})
+        return size
+    return op
+
+
+def bench_delta(b, transport, size):
+    if size < 1 << 20:
+        return None
+    source = b.fixture_file(size)
+    if transport == "http":
+        return lambda w, i: b.http.post("/delta/signature", {"path": source})[1]
+    copies = {}
+
+    def op(w, i):
+        # One byte changes per call, so every push sends a small delta
+        local = copies.get(w)
+        if local is None:
+            local = copies[w] = b.path("delta", f"{size}-{w}.local")
+            shutil.copyfile(source, local)
+            b.bridge.call("win_write_file", {"path": local + ".remote", "local_path": local, "delta": False})
+        with open(local, "r+b") as f:
+            f.seek(i * 7919 % size)
+            f.write(bytes([i % 256]))
+        return b.bridge.call("win_write_file", {"path": local + ".remote", "local_path": local})[1]
+    return op
+
+
+def bench_download(b, transport, size):
+    # The server downloads from its own /raw, so no network outside this machine is involved
+    url = f"http://127.0.0.1:{b.port}/raw?" + urllib.parse.urlencode({"path": b.fixture_file(size)})
+
+    def op(w, i):
+        args = {"url": url, "dst": b.path("downloaded", f"{transport}-{size}-{w}.bin")}
+        if transport == "http":
+            b.http.post("/download", args)
+        else:
+            b.bridge.call("win_download_file", args)
+        return size
+    return op
+
+
+def bench_readmany(b, transport, size):
+    root = b.fixture_tree(size)
+    args = {"directory": root, "pattern": "*.txt", "recursive": True, "max_files": size,
+            "max_total_bytes": 1 << 30}
+    if transport == "http":
+        return lambda w, i: b.http.post("/readmany", args)[1]
+    return lambda w, i: b.bridge.call("win_read", args)[1]
+
+
+def bench_ls(b, transport, size):
+    root = b.fixture_tree(size)
+    if transport == "http":
+        return lambda w, i: b.http.post("/ls", {"path": root, "recursive": True})[1]
+    return lambda w, i: b.bridge.call("win_list_directory", {"path": root, "recursive": True})[1]
+
+
+def bench_search(b, transport, size):
+    root = b.fixture_tree(size)
+    args = {"path": root, "query": "needle", "max_matches": size}
+    if transport == "http":
+        return lambda w, i: b.http.post("/search", args)[1]
+    return lambda w, i: b.bridge.call("win_search", args)[1]
+
+
+def bench_hash(b, transport, size):
+    root = b.fixture_tree(size)
+    if transport == "http":
+        return lambda w, i: b.http.post("/hash", {"path": root})[1]
+    return lambda w, i: b.bridge.call("win_hash", {"path": root})[1]
+
+
+def bench_copy(b, transport, size):
+    root = b.fixture_tree(size)
+    if transport == "http":
+        return lambda w, i: b.http.post("/copy", {"src": root, "dst": b.path("copies", f"{size}-{w}"), "merge": True})[1]
+    return lambda w, i: b.bridge.call("win_copy", {"src": root, "dst": b.path("copies", f"{size}-{w}"), "merge": True})[1]
+
+
+def bench_pack(b, transport, size):
+    root = b.fixture_tree(size)
+    if transport == "http":
+        body = json.dumps({"path": root, "format": "tar"}).encode()
+
+        def op(w, i):
+            status, _, count = b.http.request("POST", "/pack", body, {"Content-Type": "application/json"}, keep=False)
+            if status != 200:
+                raise BenchError(f"/pack: HTTP {status}")
+            return len(body) + count
+        return op
+    return lambda w, i: b.bridge.call("win_pull_dir", {"path": root, "local_path": b.path("packs", f"{size}-{w}")})[1]
+
+
+def bench_unpack(b, transport, size):
+    root = b.fixture_tree(size)
+    if transport == "http":
+        archive = b.path("archives", f"{size}.tgz")
+        if not os.path.exists(archive):
+            with tarfile.open(archive, "w:gz") as tar:
+                tar.add(root, ".")
+        with open(archive, "rb") as f:
+            body = f.read()
+
+        def op(w, i):
+            query = urllib.parse.urlencode({"path": b.path("unpacked", f"{size}-{w}"), "format": "tar"})
+            status, _, count = b.http.request("POST", f"/unpack?{query}", body, {"Content-Type": "application/gzip"})
+            if status != 200:
+                raise BenchError(f"/unpack: HTTP {status}")
+            return len(body) + count
+        return op
+    return lambda w, i: b.bridge.call("win_push_dir", {"local_path": root, "path": b.path("unpacked", f"{size}-{w}")})[1]
+
+
+def bench_move(b, transport, size):
+    where = {}
+
+    def op(w, i):
+        # Each worker moves its own file back and forth
+        names = (b.path("moved", f"{transport}-{w}.a"), b.path("moved", f"{transport}-{w}.b"))
+        if w not in where:
+            with open(names[0], "w") as f:
+                f.write("move me")
+            where[w] = 0
+        src, dst = names[where[w]], names[1 - where[w]]
+        if transport == "http":
+            moved = b.http.post("/move", {"src": src, "dst": dst})[1]
+        else:
+            moved = b.bridge.call("win_move", {"src": src, "dst": dst})[1]
+        where[w] = 1 - where[w]
+        return moved
+    return op
+
+
+def bench_delete(b, transport, size):
+    for i in range(b.requests):
+        with open(b.path("deleted", transport, f"{i}.txt"), "w") as f:
+            f.write("delete me")
+    if transport == "http":
+        return lambda w, i: b.http.post("/delete", {"path": b.path("deleted", transport, f"{i}.txt")})[1]
+    return lambda w, i: b.bridge.call("win_delete", {"path": b.path("deleted", transport, f"{i}.txt")})[1]
+
+
+def bench_exists(b, transport, size):
+    path = b.fixture_file(1 << 10)
+    if transport == "http":
+        return lambda w, i: b.http.post("/exists", {"path": path})[1]
+    return lambda w, i: b.bridge.call("win_exists", {"path": path})[1]
+
+
+def bench_batch(b, transport, size):
+    ops = [{"op": "exists", "args": {"path": b.fixture_file(1 << 10)}}] * 10
+    if transport == "http":
+        return lambda w, i: b.http.post("/batch", {"ops": ops})[1]
+    return lambda w, i: b.bridge.call("win_batch", {"operations": ops})[1]
+
+
+def bench_jobs(b, transport, size):
+    def op(w, i):
+        if transport == "http":
+            job, sent = b.http.post("/jobs/start", {"cmd": "echo hello"})
+            return sent + b.http.post("/jobs/wait", {"id": job["id"], "timeout": 60})[1]
+        job, sent = b.bridge.call("win_job_start", {"command": "echo hello"})
+        return sent + b.bridge.call("win_job_wait", {"id": job["id"], "timeout": 60})[1]
+    return op
+
+
+def bench_cancel(b, transport, size):
+    if transport == "http":
+        return lambda w, i: b.http.post("/cancel", {"request_id": uuid.uuid4().hex})[1]
+
+
+# name -> (scenario, size axis from MODES or None)
+SCENARIOS = {
+    "health": (bench_health, None),
+    "info": (bench_info, None),
+    "metrics": (bench_metrics, None),
+    "exec": (bench_exec, None),
+    "stdout": (bench_stdout, "stdout"),
+    "powershell": (bench_powershell, None),
+    "read": (bench_read, "payload"),
+    "raw": (bench_raw, "payload"),
+    "write": (bench_write, "payload"),
+    "upload": (bench_upload, "payload"),
+    "delta": (bench_delta, "payload"),
+    "download": (bench_download, "payload"),
+    "readmany": (bench_readmany, "files"),
+    "ls": (bench_ls, "files"),
+    "search": (bench_search, "files"),
+    "hash": (bench_hash, "files"),
+    "copy": (bench_copy, "files"),
+    "pack": (bench_pack, "files"),
+    "unpack": (bench_unpack, "files"),
+    "move": (bench_move, None),
+    "delete": (bench_delete, None),
+    "exists": (bench_exists, None),
+    "batch": (bench_batch, None),
+    "jobs": (bench_jobs, None),
+    "cancel": (bench_cancel, None),
+}
+
+
+def run_load(op, concurrency, requests, seconds):
+    """Call op from concurrency threads until requests are done or seconds pass"""
+    latencies, errors = [], []
+    moved = [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+    deadline = time.monotonic() + seconds
+
+    def worker(w):
+        while True:
+            i = next(counter)
+            if i >= requests or time.monotonic() > deadline:
+                return
+            started = time.perf_counter()
+            try:
+                count = op(w, i)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                moved[0] += count or 0
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(w,), daemon=True) for w in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "ops_per_sec": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mb_per_sec": round(moved[0] / elapsed / (1 << 20), 2) if elapsed else None,
+        "latency_ms": {
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def result_key(result):
+    return (result["scenario"], result["transport"], result["size"], result["concurrency"])
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Changes in throughput and p95 latency against a previous run beyond threshold percent"""
+    previous = {result_key(r): r for r in baseline.get("results", [])}
+    regressions, improvements = [], []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or result["errors"] or old["errors"]:
+            continue
+        for metric, new_value, old_value, higher_is_better in (
+                ("ops_per_sec", result["ops_per_sec"], old["ops_per_sec"], True),
+                ("p95_ms", result["latency_ms"]["p95"], old["latency_ms"]["p95"], False)):
+            if not new_value or not old_value:
+                continue
+            if metric == "p95_ms" and abs(new_value - old_value) < COMPARE_MIN_MS:
+                continue
+            change = (new_value - old_value) * 100 / old_value
+            if abs(change) < threshold:
+                continue
+            entry = {"scenario": result["scenario"], "transport": result["transport"],
+                     "axis": result.get("axis"), "size": result["size"],
+                     "concurrency": result["concurrency"], "metric": metric, "baseline": old_value,
+                     "current": new_value, "change_pct": round(change, 1)}
+            (improvements if (change > 0) == higher_is_better else regressions).append(entry)
+    return {"threshold_pct": threshold, "regressions": regressions, "improvements": improvements}
+
+
+def format_size(size, axis=None):
+    if size is None:
+        return "-"
+    if axis == "files":
+        return f"{size}f"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:g}{unit}"
+        size /= 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark server.py and bridge.py on this machine")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--quick", dest="mode", action="store_const", const="quick", help="Small sizes, few requests")
+    mode.add_argument("--full", dest="mode", action="store_const", const="full",
+                      help="Up to 1 GB payloads, 256 MB stdout and 100000-file trees")
+    parser.add_argument("--only", action="append", default=[], metavar="NAME",
+                        help=f"Run matching scenarios (globs allowed; repeatable): {', '.join(SCENARIOS)}")
+    parser.add_argument("--transport", choices=("http", "bridge", "both"), default="both")
+    parser.add_argument("--concurrency", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, help="Requests per run")
+    parser.add_argument("--seconds", type=float, help="Time limit per run")
+    parser.add_argument("--output", "-o", metavar="FILE", help="Write JSON results here instead of stdout")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against the JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, metavar="PCT",
+                        help="Percent change reported as a regression or improvement")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    parser.add_argument("--powershell", default=shutil.which("powershell") or shutil.which("pwsh"),
+                        help="PowerShell binary for the powershell scenario (skipped if not found)")
+    parser.add_argument("--server-arg", action="append", default=[], metavar="ARG",
+                        help="Extra server.py argument, e.g. --server-arg=--shell-pool=4 (repeatable)")
+    parser.add_argument("--workdir", help="Directory for fixtures and the server log (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    args = parser.parse_args(argv)
+    args.mode = args.mode or "default"
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = MODES[args.mode]
+    levels = [int(c) for c in args.concurrency.split(",")] if args.concurrency else list(settings["concurrency"])
+    transports = ("http", "bridge") if args.transport == "both" else (args.transport,)
+    names = [name for name in SCENARIOS if not args.only or any(fnmatch.fnmatch(name, p) for p in args.only)]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mcp-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    bench = Bench(workdir, args.server_arg, args.powershell)
+    bench.requests = args.requests or settings["requests"]
+    seconds = args.seconds or settings["seconds"]
+    results = []
+    try:
+        for name in names:
+            scenario, axis = SCENARIOS[name]
+            for size in (settings[axis] if axis else (None,)):
+                for transport in transports:
+                    for concurrency in levels:
+                        if axis == "payload" and concurrency > 1 and size * concurrency > MAX_INFLIGHT_BYTES:
+                            continue
+                        op = scenario(bench, transport, size)
+                        if op is None:
+                            break
+                        for pid in (bench.server.pid, bench.bridge.proc.pid):
+                            reset_peak_rss(pid)
+                        result = dict({"scenario": name, "transport": transport, "axis": axis, "size": size,
+                                       "concurrency": concurrency},
+                                      **run_load(op, concurrency, bench.requests, seconds))
+                        result["peak_rss_bytes"] = {"server": peak_rss(bench.server.pid),
+                                                    "bridge": peak_rss(bench.bridge.proc.pid)}
+                        results.append(result)
+                        latency = result["latency_ms"]
+                        print(f"{name:<10} {transport:<6} {format_size(size, axis):>6} x{concurrency:<3} "
+                              f"{result['ops_per_sec'] or 0:>9.1f} ops/s {result['mb_per_sec'] or 0:>9.1f} MB/s  "
+                              f"p50 {latency['p50'] or 0:>9.2f} ms  p95 {latency['p95'] or 0:>9.2f} ms  "
+                              f"p99 {latency['p99'] or 0:>9.2f} ms  errors {result['errors']}",
+                              file=sys.stderr)
+    finally:
+        bench.close()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "mode": args.mode,
+        "commit": git_commit(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {"concurrency": levels, "requests": bench.requests, "seconds": seconds,
+                     "server_args": args.server_arg},
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = dict(compare(results, json.load(f), args.threshold), baseline=args.baseline)
+        for entry in report["comparison"]["regressions"]:
+            print(f"REGRESSION {entry['scenario']} {entry['transport']} {format_size(entry['size'], entry['axis'])} "
+                  f"x{entry['concurrency']} {entry['metric']}: {entry['baseline']} -> {entry['current']} "
+                  f"({entry['change_pct']:+}%)", file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.fail_on_regression and report.get("comparison", {}).get("regressions"):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,42 +4,1672 @@ Windows MCP Bridge - Stdio MCP client that forwards to Windows HTTP server
 This runs on Mac and communicates with Claude Code via stdio MCP protocol.
 """
 
+import base64
+import copy
 import json
+import os
+import gzip
+import fnmatch
+import hashlib
 import sys
-import urllib.request
-import urllib.error
+import time
+import select
+import queue
+import struct
+import tarfile
+import mmap
+import socket
+import threading
+import uuid
+import zlib
+import http.client
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 
 # ============== CONFIGURATION ==============
 WINDOWS_IP = "192.168.2.205"
 WINDOWS_PORT = 8000
 TIMEOUT = 300  # seconds
+COMMAND_TIMEOUT_MARGIN = 10  # seconds a command's request outlives its timeout, so the server reports it
+POOL_SIZE = 4  # idle keep-alive connections kept open to the server
+POOL_IDLE_TIMEOUT = 20  # seconds; keep below the server's keep-alive timeout
+BUSY_RETRIES = 3  # retries when the server answers 503 busy
+MAX_CONCURRENT_CALLS = 16  # tool calls run in parallel
+COMPRESS_REQUESTS = True  # gzip request bodies of COMPRESS_MIN_BYTES or more
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+COMPACT_RESULTS = False  # serialize tool results without indentation
+PULL_CHUNK = 1 << 20  # read size when streaming files to local disk
+UPLOAD_CHUNK = 4 << 20  # bytes per chunk when pushing local files
+UPLOAD_RETRIES = 5  # attempts per chunk before giving up
+ARCHIVE_CHUNK = 256 << 10  # bytes per piece of a pushed directory archive
+ARCHIVE_MAX_ERRORS = 1000  # unreadable or unsafe entries listed in a pull/push result
+ARCHIVE_ERRORS_NAME = ".mcp-pack-errors.json"  # /pack's report of files it could not read
+RESPONSE_CACHE_ENTRIES = 256  # /ls, /exists, /info and /read replies revalidated with If-None-Match
+RESPONSE_CACHE_BYTES = 64 << 20  # approximate size of all cached replies
+DELTA_MIN_BYTES = 64 << 10  # smaller files are always sent whole
+DELTA_MIN_BLOCK = 2048  # delta block sizes grow with the file, between these bounds
+DELTA_MAX_BLOCK = 1 << 17
+DELTA_MAX_LITERAL = 16 << 20  # send the whole file when a delta would carry more than this
+# Named hosts and groups: a JSON file, or name=host[:port],... in the environment variable
+HOSTS_FILE = os.path.expanduser("~/.windows-mcp-hosts.json")
+HOSTS_ENV = "WINDOWS_MCP_HOSTS"
+FANOUT_MAX_HOSTS = 32  # hosts a fan-out call talks to at once
+MUX = os.environ.get("WINDOWS_MCP_MUX", "1") != "0"  # one multiplexed /mux connection per host; "0" for plain HTTP
+MUX_WINDOW = 4 << 20  # body bytes the server may send on a stream before we grant more
+MUX_MAX_FRAME = 256 << 10  # request bodies are split into frames this big so streams interleave
+METRICS_LOG = ""  # append one JSON line of timings per tool call to this file; "" disables
+METRICS_SAMPLES = 1000  # recent durations kept per tool for win_bridge_metrics percentiles
 # ===========================================
 
-WINDOWS_SERVER = f"http://{WINDOWS_IP}:{WINDOWS_PORT}"
+# Errors that mean a reused keep-alive connection was closed by the server
+STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
 
 
-def send_request(endpoint, method="GET", data=None):
-    """Send HTTP request to Windows server"""
-    url = f"{WINDOWS_SERVER}{endpoint}"
-    try:
-        if method == "POST" and data is not None:
-            req = urllib.request.Request(
-                url,
-                data=json.dumps(data).encode(),
-                headers={"Content-Type": "application/json"},
-                method="POST"
-            )
+class CallContext:
+    """State of one in-flight tools/call, used to cancel it"""
+
+    def __init__(self, req_id, progress_token=None, pool=None):
+        self.req_id = req_id
+        self.progress_token = progress_token  # from params._meta; enables streamed output
+        self.pool = pool  # connection pool of the target host; None means the default host
+        self.request_id = uuid.uuid4().hex  # sent to the server as X-Request-Id
+        self.cancelled = threading.Event()
+        self.connections = set()
+        self.children = []  # per-host calls of a fan-out
+        self.parent = None
+        self.timings = {}  # phase -> seconds, see add_timing()
+        self.lock = threading.Lock()
+
+    def child(self, pool):
+        """A call to run on one host of a fan-out, cancelled along with this one"""
+        child = CallContext(self.req_id, pool=pool)
+        child.parent = self
+        with self.lock:
+            self.children.append(child)
+        if self.cancelled.is_set():
+            child.cancel()
+        return child
+
+    def attach(self, conn):
+        with self.lock:
+            self.connections.add(conn)
+        if self.cancelled.is_set():
+            self.abort(conn)
+
+    def detach(self, conn):
+        with self.lock:
+            self.connections.discard(conn)
+
+    @staticmethod
+    def abort(conn):
+        if isinstance(conn, MuxStream):
+            conn.reset()  # just this stream; the connection carries other calls
+            return
+        # shutdown() wakes a thread blocked reading the response, close() alone may not
+        sock = conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            connections = list(self.connections)
+            children = list(self.children)
+        for conn in connections:
+            self.abort(conn)
+        for child in children:
+            child.cancel()
+
+    def add_timing(self, phase, seconds):
+        """Charge seconds to one phase of this call, and of the fan-out it belongs to"""
+        with self.lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        if self.parent is not None:
+            self.parent.add_timing(phase, seconds)
+
+    def targets(self):
+        """(pool, request id) of every host this call may have started work on"""
+        with self.lock:
+            children = list(self.children)
+        if not children:
+            return [(self.pool or HOSTS.pool(), self.request_id)]
+        return [target for child in children for target in child.targets()]
+
+
+# The CallContext of the tool call running on this thread, if any
+_local = threading.local()
+
+
+def current_call():
+    return getattr(_local, "call", None)
+
+
+def add_timing(call, phase, started):
+    """Charge the time since started to a phase of call; returns the current time"""
+    now = time.monotonic()
+    if call is not None:
+        call.add_timing(phase, now - started)
+    return now
+
+
+def current_pool():
+    """Connection pool for the host the current tool call targets"""
+    call = current_call()
+    if call is not None and call.pool is not None:
+        return call.pool
+    return HOSTS.pool()
+
+
+# Frame layout and types of the server's /mux transport (see MuxSession in server.py)
+MUX_PROTOCOL = "mcp-mux/1"
+MUX_HEADER = struct.Struct(">IBBI")  # payload length, type, flags, stream id
+MUX_OPEN, MUX_REPLY, MUX_DATA, MUX_WINDOW_UPDATE, MUX_RESET, MUX_PING = range(1, 7)
+MUX_END = 1
+MUX_FRAME_LIMIT = 16 << 20
+MUX_INCREMENT = struct.Struct(">I")
+
+
+def read_frame(rfile):
+    """Read one frame as (type, flags, stream id, payload), or None at end of input"""
+    header = rfile.read(MUX_HEADER.size)
+    if len(header) < MUX_HEADER.size:
+        return None
+    length, kind, flags, stream_id = MUX_HEADER.unpack(header)
+    if length > MUX_FRAME_LIMIT:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MUX_FRAME_LIMIT} byte limit")
+    payload = rfile.read(length) if length else b""
+    if len(payload) < length:
+        raise ConnectionError("Connection closed inside a frame")
+    return kind, flags, stream_id, payload
+
+
+class MuxWindow:
+    """Bytes a stream may still send before the peer grants more"""
+
+    def __init__(self, size):
+        self.size = size
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def take(self, wanted):
+        with self.cond:
+            while self.size <= 0 and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                raise ConnectionAbortedError("Stream reset")
+            taken = min(wanted, self.size)
+            self.size -= taken
+            return taken
+
+    def grant(self, size):
+        with self.cond:
+            self.size += size
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class MuxUnsupported(Exception):
+    """The server answered GET /mux with something other than 101 (it predates the transport)"""
+
+
+class MuxStream:
+    """One request on a MuxConnection, standing in for both the HTTPConnection and the HTTPResponse"""
+
+    will_close = True  # never pooled: finishing a request just closes its stream
+
+    def __init__(self, mux, stream_id, timeout):
+        self.mux = mux
+        self.id = stream_id
+        self.timeout = timeout
+        self.window = MuxWindow(mux.peer_window)
+        self.replied = threading.Event()
+        self.inbound = queue.Queue()  # body pieces; None at the end, an exception if reset
+        self.buffer = b""
+        self.consumed = 0  # body bytes read but not yet granted back to the server
+        self.eof = False
+        self.error = None
+        self.status = None
+        self.reason = ""
+        self.headers = http.client.HTTPMessage()
+
+    def on_reply(self, payload):
+        reply = json.loads(payload)
+        for name, value in reply.get("headers", {}).items():
+            self.headers[name] = value
+        self.reason = reply.get("reason", "")
+        self.status = reply["status"]
+        self.replied.set()
+
+    def on_data(self, data, end):
+        if data:
+            self.inbound.put(data)
+        if end:
+            self.inbound.put(None)
+
+    def on_reset(self, error):
+        self.error = error
+        self.window.close()
+        self.inbound.put(error)
+        self.replied.set()
+
+    def send_body(self, body):
+        if isinstance(body, (bytes, bytearray)):
+            self.send_data(body, True)
+            return
+        # An iterable body is sent as it is produced; END goes out on an empty frame after it
+        for piece in body:
+            self.send_data(piece, False)
+        self.mux.send(MUX_DATA, self.id, b"", MUX_END)
+
+    def send_data(self, data, end):
+        view = memoryview(data)
+        while view:
+            count = self.window.take(min(len(view), MUX_MAX_FRAME))
+            self.mux.send(MUX_DATA, self.id, view[:count], MUX_END if end and count == len(view) else 0)
+            view = view[count:]
+
+    def wait_reply(self):
+        if not self.replied.wait(self.timeout):
+            raise socket.timeout("timed out")
+        if self.status is None:
+            raise self.error
+
+    def _next(self):
+        if self.eof:
+            return b""
+        try:
+            piece = self.inbound.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+        if piece is None:
+            self.eof = True
+            return b""
+        if isinstance(piece, Exception):
+            self.eof = True
+            raise piece
+        # Grants are batched; a quarter of the window keeps the server from stalling
+        self.consumed += len(piece)
+        if self.consumed >= MUX_WINDOW // 4:
+            self.mux.send(MUX_WINDOW_UPDATE, self.id, MUX_INCREMENT.pack(self.consumed))
+            self.consumed = 0
+        return piece
+
+    def read(self, amt=None):
+        if amt is None:
+            pieces = [self.buffer]
+            self.buffer = b""
+            while True:
+                piece = self._next()
+                if not piece:
+                    return b"".join(pieces)
+                pieces.append(piece)
+        while not self.buffer and not self.eof:
+            self.buffer = self._next()
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+    read1 = read
+
+    def isclosed(self):
+        return self.eof and not self.buffer
+
+    def reset(self):
+        """Abandon the request; the server stops it and kills any process it started"""
+        if not self.eof:
+            try:
+                self.mux.send(MUX_RESET, self.id)
+            except OSError:
+                pass
+        self.on_reset(ConnectionAbortedError("Cancelled by client"))
+
+    def close(self):
+        if not self.eof:
+            self.reset()
+        self.mux.forget(self.id)
+
+
+class MuxConnection:
+    """One upgraded connection to the server carrying many requests at once as framed streams"""
+
+    def __init__(self, host, port, timeout=TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.sendall(
+                f"GET /mux HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: Upgrade\r\n"
+                f"Upgrade: {MUX_PROTOCOL}\r\nMux-Window: {MUX_WINDOW}\r\n\r\n".encode())
+            self.rfile = self.sock.makefile("rb")
+            status = self.rfile.readline().split(None, 2)
+            headers = http.client.parse_headers(self.rfile)
+            if len(status) < 2 or status[1] != b"101":
+                raise MuxUnsupported(f"GET /mux answered {b' '.join(status[1:]).decode(errors='replace').strip()}")
+            self.peer_window = max(int(headers.get("Mux-Window", MUX_WINDOW)), 1)
+        except BaseException:
+            self.sock.close()
+            raise
+        self.sock.settimeout(None)  # streams time out on their own; the connection may idle
+        self.streams = {}
+        self.next_id = 1
+        self.closed = False
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, kind, stream_id, payload=b"", flags=0):
+        header = MUX_HEADER.pack(len(payload), kind, flags, stream_id)
+        with self.write_lock:
+            if self.closed:
+                raise ConnectionResetError("Connection to server lost")
+            self.sock.sendall(header + bytes(payload))
+
+    def open(self, method, path, body=None, headers=None, timeout=TIMEOUT, call=None):
+        """Start a request and return its MuxStream once the reply headers have arrived"""
+        with self.lock:
+            stream = MuxStream(self, self.next_id, timeout)
+            self.streams[stream.id] = stream
+            self.next_id += 1
+        if call is not None:
+            call.attach(stream)
+        try:
+            request = {"method": method, "path": path, "headers": headers or {}}
+            self.send(MUX_OPEN, stream.id, json.dumps(request).encode(), 0 if body else MUX_END)
+            if body:
+                try:
+                    stream.send_body(body)
+                except ConnectionAbortedError:
+                    if stream.status is None:
+                        raise
+                    # The server answered (e.g. 503 busy) and reset the stream before reading the whole body
+            stream.wait_reply()
+        except BaseException:
+            if call is not None:
+                call.detach(stream)
+            stream.close()
+            raise
+        return stream
+
+    def forget(self, stream_id):
+        with self.lock:
+            self.streams.pop(stream_id, None)
+
+    def _read(self):
+        try:
+            while True:
+                frame = read_frame(self.rfile)
+                if frame is None:
+                    break
+                kind, flags, stream_id, payload = frame
+                with self.lock:
+                    stream = self.streams.get(stream_id)
+                if stream is None:
+                    continue  # pings, and frames racing a stream we already closed
+                if kind == MUX_REPLY:
+                    stream.on_reply(payload)
+                elif kind == MUX_DATA:
+                    stream.on_data(payload, flags & MUX_END)
+                elif kind == MUX_WINDOW_UPDATE:
+                    stream.window.grant(MUX_INCREMENT.unpack(payload)[0])
+                elif kind == MUX_RESET:
+                    stream.on_reset(ConnectionResetError("Stream reset by server"))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.write_lock:
+                self.closed = True
+            with self.lock:
+                streams, self.streams = list(self.streams.values()), {}
+            for stream in streams:
+                stream.on_reset(ConnectionResetError("Connection to server lost"))
+            self.sock.close()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """Keeps HTTP/1.1 connections to the Windows server open between tool calls"""
+
+    def __init__(self, host, port, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle = []  # (connection, last used)
+        self.lock = threading.Lock()
+        self.mux = None
+        self.mux_supported = MUX
+        self.mux_lock = threading.Lock()
+
+    def get_mux(self, timeout=TIMEOUT):
+        """The host's shared MuxConnection, connecting as needed; None means use plain HTTP"""
+        if not self.mux_supported:
+            return None
+        with self.mux_lock:
+            if self.mux is None or self.mux.closed:
+                try:
+                    self.mux = MuxConnection(self.host, self.port, timeout)
+                except MuxUnsupported:
+                    self.mux_supported = False  # an older server; stay on HTTP
+                    return None
+                except OSError:
+                    return None  # let the plain HTTP attempt report the error
+            return self.mux
+
+    def _is_healthy(self, conn, last_used):
+        if conn.sock is None or time.monotonic() - last_used > self.idle_timeout:
+            return False
+        # An idle keep-alive socket has nothing to read; readable means the server closed it
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def acquire(self, timeout=TIMEOUT):
+        """Return (connection, reused)"""
+        with self.lock:
+            while self.idle:
+                conn, last_used = self.idle.pop()
+                if self._is_healthy(conn, last_used):
+                    conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout), False
+
+    def release(self, conn):
+        with self.lock:
+            if conn.sock is not None and len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
+        if self.mux is not None:
+            self.mux.close()
+
+    def open(self, method, path, body=None, headers=None, timeout=TIMEOUT, call=None):
+        """Send a request and return (connection, response) with the body still unread"""
+        headers = dict(headers or {})
+        if call is not None:
+            headers["X-Request-Id"] = call.request_id
+        mux = self.get_mux(timeout)
+        if mux is not None:
+            stream = mux.open(method, path, body, headers, timeout, call)
+            return stream, stream
+        while True:
+            conn, reused = self.acquire(timeout)
+            try:
+                if call is not None:
+                    if conn.sock is None:
+                        conn.connect()
+                    call.attach(conn)
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                except STALE_ERRORS:
+                    response = self.early_response(conn) if body is not None else None
+                    if response is None:
+                        raise
+                    return conn, response
+                return conn, conn.getresponse()
+            except STALE_ERRORS:
+                self.discard(conn, call)
+                if reused and not (call is not None and call.cancelled.is_set()):
+                    continue  # the server dropped an idle connection; retry on another
+                raise
+            except BaseException:
+                self.discard(conn, call)
+                raise
+
+    @staticmethod
+    def early_response(conn):
+        """The reply to a request whose body the server stopped reading (e.g. 503 busy), if it sent one"""
+        try:
+            return conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            return None
+
+    def finish(self, conn, response, call=None):
+        """Hand conn back once response has been read to the end"""
+        if call is not None:
+            call.detach(conn)
+        if response.will_close or not response.isclosed():
+            conn.close()
         else:
-            req = urllib.request.Request(url)
+            self.release(conn)
+
+    def discard(self, conn, call=None):
+        """Drop a connection whose request failed part way"""
+        if call is not None:
+            call.detach(conn)
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=TIMEOUT, call=None):
+        """Send one request and return (status, reason, headers, body)"""
+        conn, response = self.open(method, path, body, headers, timeout, call)
+        try:
+            payload = response.read()
+        except BaseException:
+            self.discard(conn, call)
+            raise
+        self.finish(conn, response, call)
+        return response.status, response.reason, response.headers, payload
+
+
+POOL = ConnectionPool(WINDOWS_IP, WINDOWS_PORT)
+
+
+class HostRegistry:
+    """Named Windows hosts and groups of them, each host with its own connection pool"""
+
+    def __init__(self):
+        self.hosts = OrderedDict()  # name -> (host, port)
+        self.groups = OrderedDict()  # name -> [host names]
+        self.default = "default"
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_address(address):
+        host, _, port = str(address).rpartition(":") if ":" in str(address) else (address, "", "")
+        return host, int(port) if port else WINDOWS_PORT
+
+    def load(self, spec=None, path=HOSTS_FILE):
+        """Read hosts from spec (a JSON file path or name=host[:port],...) or the hosts file
+
+        Without either, the only host is "default" at WINDOWS_IP:WINDOWS_PORT.
+        """
+        config = {}
+        if spec and os.path.isfile(os.path.expanduser(spec)):
+            path, spec = os.path.expanduser(spec), None
+        if spec:
+            for item in spec.split(","):
+                name, _, address = item.strip().partition("=")
+                if not address:
+                    raise ValueError(f"Invalid host {item!r} in ${HOSTS_ENV}, expected name=host[:port]")
+                config.setdefault("hosts", {})[name.strip()] = address.strip()
+        elif os.path.isfile(path):
+            with open(path) as f:
+                config = json.load(f)
+        for name, entry in config.get("hosts", {}).items():
+            if isinstance(entry, dict):
+                self.hosts[name] = (entry["host"], int(entry.get("port", WINDOWS_PORT)))
+            else:
+                self.hosts[name] = self.parse_address(entry)
+        for name, members in config.get("groups", {}).items():
+            unknown = [m for m in members if m not in self.hosts]
+            if unknown:
+                raise ValueError(f"Group {name!r} names unknown hosts: {', '.join(unknown)}")
+            self.groups[name] = list(members)
+        if not self.hosts:
+            self.hosts["default"] = (WINDOWS_IP, WINDOWS_PORT)
+            self.pools["default"] = POOL
+        self.default = config.get("default") or next(iter(self.hosts))
+        if self.default not in self.hosts:
+            raise ValueError(f"Default host {self.default!r} is not defined")
+
+    def resolve(self, target):
+        """Return (host names, fan_out) for a tool's target argument
+
+        target is a host name, a group, "all", a literal host[:port], a
+        comma-separated string or a list of these. Anything but a single host
+        fans out, so results for groups always have the same shape.
+        """
+        if not target:
+            return [self.default], False
+        items = target if isinstance(target, list) else [t.strip() for t in str(target).split(",")]
+        names = []
+        for item in items:
+            if item == "all":
+                members = list(self.hosts)
+            elif item in self.groups:
+                members = self.groups[item]
+            elif item in self.hosts or "." in item or ":" in item or item == "localhost":
+                members = [item]
+            else:
+                raise ValueError(f"Unknown target {item!r}; known hosts: {', '.join(self.hosts)}"
+                                 + (f"; groups: {', '.join(self.groups)}" if self.groups else ""))
+            names.extend(m for m in members if m not in names)
+        fan_out = isinstance(target, list) or len(items) > 1 or items[0] == "all" or items[0] in self.groups
+        return names, fan_out
+
+    def address(self, name):
+        return self.hosts[name] if name in self.hosts else self.parse_address(name)
+
+    def pool(self, name=None):
+        name = name or self.default
+        with self.lock:
+            if name not in self.pools:
+                self.pools[name] = ConnectionPool(*self.address(name))
+            return self.pools[name]
+
+    def describe(self):
+        return {
+            "default": self.default,
+            "hosts": [{"name": name, "host": host, "port": port} for name, (host, port) in self.hosts.items()],
+            "groups": dict(self.groups)
+        }
+
+
+HOSTS = HostRegistry()
+try:
+    HOSTS.load(os.environ.get(HOSTS_ENV))
+except (OSError, ValueError, KeyError) as e:
+    print(f"Ignoring host configuration: {e}", file=sys.stderr)
+    HOSTS = HostRegistry()
+    HOSTS.load(path="")
+
+
+CANCELLED = {"success": False, "cancelled": True, "error": "Cancelled by client"}
+
+CACHEABLE_ENDPOINTS = ("/ls", "/exists", "/info", "/read")
+
+
+class ResponseCache:
+    """Last reply and ETag per request, so an unchanged reply comes back as a bodiless 304"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_ENTRIES, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (etag, result, size)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint, method, data):
+        pool = current_pool()
+        return (pool.host, pool.port, method, endpoint, json.dumps(data, sort_keys=True))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, result):
+        size = len(json.dumps(result))
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self.entries[key] = (etag, copy.deepcopy(result), size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][2]
+
+    def discard(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[2]
 
-        with urllib.request.urlopen(req, timeout=TIMEOUT) as response:
-            return json.loads(response.read().decode())
-    except urllib.error.URLError as e:
+
+RESPONSE_CACHE = ResponseCache()
+
+
+class ToolMetrics:
+    """Call counts and per-phase timings of each tool, for win_bridge_metrics and METRICS_LOG
+
+    Phases: encode (request JSON and gzip), wait (sending until response headers),
+    server (the server's own Server-Timing), read/stream (response bodies), decode
+    (gunzip and JSON), busy (503 back-off), format and write (the tool result to stdout).
+    """
+
+    SERIALIZATION = ("encode", "decode", "format", "write")
+    NETWORK = ("wait", "read", "stream")
+
+    def __init__(self, samples=METRICS_SAMPLES, log_path=METRICS_LOG):
+        self.lock = threading.Lock()
+        self.samples = samples
+        self.log_path = log_path
+        self.tools = {}
+
+    def record(self, tool, seconds, timings, success):
+        with self.lock:
+            stats = self.tools.get(tool)
+            if stats is None:
+                stats = self.tools[tool] = {"calls": 0, "errors": 0, "seconds": 0.0, "max": 0.0, "phases": {},
+                                            "recent": deque(maxlen=self.samples)}
+            stats["calls"] += 1
+            stats["errors"] += not success
+            stats["seconds"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["recent"].append(seconds)
+            for phase, spent in timings.items():
+                stats["phases"][phase] = stats["phases"].get(phase, 0.0) + spent
+            if self.log_path:
+                line = {"time": round(time.time(), 3), "tool": tool, "success": success, "ms": round(seconds * 1000, 3),
+                        "phases_ms": {phase: round(spent * 1000, 3) for phase, spent in timings.items()}}
+                try:
+                    with open(self.log_path, "a") as f:
+                        f.write(json.dumps(line) + "\n")
+                except OSError:
+                    pass
+
+    def snapshot(self, reset=False):
+        """Per-tool summary with times in milliseconds; phase times are means per call"""
+        with self.lock:
+            tools = self.tools
+            if reset:
+                self.tools = {}
+        result = {}
+        for tool, stats in sorted(tools.items()):
+            calls = stats["calls"]
+            recent = sorted(stats["recent"])
+            phases = {phase: round(spent * 1000 / calls, 3) for phase, spent in sorted(stats["phases"].items())}
+            network = sum(phases.get(phase, 0) for phase in self.NETWORK) - phases.get("server", 0)
+            result[tool] = {
+                "calls": calls,
+                "errors": stats["errors"],
+                "mean_ms": round(stats["seconds"] * 1000 / calls, 3),
+                "p50_ms": round(recent[len(recent) // 2] * 1000, 3),
+                "p95_ms": round(recent[min(len(recent) - 1, len(recent) * 95 // 100)] * 1000, 3),
+                "max_ms": round(stats["max"] * 1000, 3),
+                "serialization_ms": round(sum(phases.get(phase, 0) for phase in self.SERIALIZATION), 3),
+                "network_ms": round(max(network, 0), 3),
+                "phases_ms": phases
+            }
+        return result
+
+
+TOOL_METRICS = ToolMetrics()
+
+
+def server_time(response):
+    """Seconds the server says it spent on a reply (its Server-Timing header), or None"""
+    for part in response.headers.get("Server-Timing", "").split(";"):
+        name, _, value = part.strip().partition("=")
+        if name == "dur":
+            try:
+                return float(value) / 1000
+            except ValueError:
+                return None
+    return None
+
+
+def open_request(endpoint, method="GET", data=None, call=None, headers=None, body=None, timeout=TIMEOUT):
+    """Open a request, retrying 503 busy answers; returns (connection, response)"""
+    headers = dict(headers or {})
+    headers.setdefault("Accept-Encoding", "gzip, deflate")
+    started = time.monotonic()
+    if method == "POST" and data is not None:
+        body = json.dumps(data).encode()
+        headers["Content-Type"] = "application/json"
+        if COMPRESS_REQUESTS and len(body) >= COMPRESS_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+        started = add_timing(call, "encode", started)
+    for attempt in range(BUSY_RETRIES + 1):
+        conn, response = current_pool().open(method, endpoint, body, headers, timeout, call)
+        started = add_timing(call, "wait", started)
+        spent = server_time(response)
+        if spent is not None and call is not None:
+            call.add_timing("server", spent)
+        if response.status != 503 or attempt == BUSY_RETRIES:
+            return conn, response
+        # Not pooled: the server may have answered before reading our body
+        response.read()
+        current_pool().discard(conn, call)
+        time.sleep(float(response.headers.get("Retry-After", 1)))
+        started = add_timing(call, "busy", started)
+        if call is not None and call.cancelled.is_set():
+            raise ConnectionAbortedError("Cancelled by client")
+
+
+def read_json(conn, response, call=None):
+    """Read a JSON response body and hand the connection back to the pool"""
+    started = time.monotonic()
+    try:
+        payload = response.read()
+    except BaseException:
+        current_pool().discard(conn, call)
+        raise
+    current_pool().finish(conn, response, call)
+    started = add_timing(call, "read", started)
+    try:
+        if response.headers.get("Content-Encoding", "").lower() in ("gzip", "deflate"):
+            payload = zlib.decompress(payload, 47)  # 32 + 15: zlib or gzip header
+        result = json.loads(payload.decode())
+    except (ValueError, zlib.error):
+        result = None
+    add_timing(call, "decode", started)
+    if not isinstance(result, dict):
+        if response.status >= 400:
+            return {"success": False, "error": f"HTTP {response.status}: {response.reason}"}
+        return {"success": False, "error": "Invalid response from server"}
+    return result
+
+
+class LineReader:
+    """Reads lines from a response body as it arrives, undoing gzip/deflate encoding"""
+
+    def __init__(self, response):
+        self.response = response
+        encoding = response.headers.get("Content-Encoding", "").lower()
+        self.decompressor = zlib.decompressobj(47) if encoding in ("gzip", "deflate") else None
+        self.buffer = b""
+        self.eof = False
+
+    def readline(self):
+        while b"\n" not in self.buffer and not self.eof:
+            chunk = self.response.read1(65536)
+            if not chunk:
+                self.eof = True
+                if self.decompressor:
+                    self.buffer += self.decompressor.flush()
+            elif self.decompressor:
+                self.buffer += self.decompressor.decompress(chunk)
+            else:
+                self.buffer += chunk
+        line, sep, self.buffer = self.buffer.partition(b"\n")
+        return line + sep
+
+
+def request_failed(e, call):
+    """Result for a request that raised e"""
+    if call is not None and call.cancelled.is_set():
+        return dict(CANCELLED)
+    if isinstance(e, (OSError, http.client.HTTPException)):
         return {"success": False, "error": f"Connection failed: {e}"}
-    except urllib.error.HTTPError as e:
-        return {"success": False, "error": f"HTTP {e.code}: {e.reason}"}
+    return {"success": False, "error": str(e)}
+
+
+def send_request(endpoint, method="GET", data=None, timeout=TIMEOUT):
+    """Send HTTP request to Windows server"""
+    call = current_call()
+    if call is not None and call.cancelled.is_set():
+        return dict(CANCELLED)
+    key = cached = None
+    headers = {}
+    if endpoint in CACHEABLE_ENDPOINTS:
+        key = ResponseCache.key(endpoint, method, data)
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+    try:
+        conn, response = open_request(endpoint, method, data, call, headers, timeout=timeout)
+        if response.status == 304 and cached is not None:
+            response.read()
+            current_pool().finish(conn, response, call)
+            return copy.deepcopy(cached[1])
+        result = read_json(conn, response, call)
+        if key is not None:
+            etag = response.headers.get("ETag")
+            if etag and response.status == 200:
+                RESPONSE_CACHE.put(key, etag, result)
+            else:
+                RESPONSE_CACHE.discard(key)
+        return result
+    except Exception as e:
+        return request_failed(e, call)
+
+
+def stream_request(endpoint, data, on_frame, timeout=TIMEOUT):
+    """POST to a streaming endpoint, calling on_frame for each NDJSON frame; returns the last frame"""
+    call = current_call()
+    if call is not None and call.cancelled.is_set():
+        return dict(CANCELLED)
+    try:
+        conn, response = open_request(endpoint, "POST", dict(data, stream=True), call, timeout=timeout)
+        if not response.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+            return read_json(conn, response, call)  # errors are sent as plain JSON
+        last = None
+        reader = LineReader(response)
+        started = time.monotonic()
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    break
+                last = json.loads(line.decode())
+                on_frame(last)
+        except BaseException:
+            current_pool().discard(conn, call)
+            raise
+        current_pool().finish(conn, response, call)
+        add_timing(call, "stream", started)
+        if last is None:
+            return {"success": False, "error": "Empty response from server"}
+        return last
+    except Exception as e:
+        return request_failed(e, call)
+
+
+def notify_progress(call, progress, message=None, total=None):
+    """Send an MCP progress notification for call, if the client asked for progress"""
+    if call is None or call.progress_token is None or call.cancelled.is_set():
+        return
+    params = {"progressToken": call.progress_token, "progress": progress}
+    if total is not None:
+        params["total"] = total
+    if message is not None:
+        params["message"] = message
+    write_message({"jsonrpc": "2.0", "method": "notifications/progress", "params": params})
+
+
+OUTPUT_OPTIONS = ("max_bytes", "lines", "include", "exclude", "collapse", "spill")
+
+
+def command_timeout(timeout):
+    """Socket timeout for a request the server may spend timeout seconds on
+
+    It outlasts the server's own deadline, so the server kills the process tree and
+    says why instead of the connection just timing out.
+    """
+    return max(TIMEOUT, timeout + COMMAND_TIMEOUT_MARGIN)
+
+
+def run_command(endpoint, cmd, timeout, arguments=None):
+    """Run cmd via /exec or /powershell, relaying output as progress when the client wants it"""
+    data = {"cmd": cmd, "timeout": timeout}
+    # Output shaping happens on the server, so cut output never crosses the wire
+    data.update((k, v) for k, v in (arguments or {}).items() if k in OUTPUT_OPTIONS and v is not None)
+    call = current_call()
+    if call is None or call.progress_token is None:
+        return send_request(endpoint, "POST", data, command_timeout(timeout))
+
+    output = {"stdout": [], "stderr": []}
+
+    def on_frame(frame):
+        if frame.get("type") == "output":
+            output[frame["stream"]].append(frame["data"])
+            notify_progress(call, frame["seq"], frame["data"])
+
+    last = stream_request(endpoint, data, on_frame, command_timeout(timeout))
+    if last.get("type") != "exit":
+        return last
+    # Same shape as the non-streamed result
+    result = {k: v for k, v in last.items() if k not in ("type", "seq")}
+    if "shaped" not in result:
+        # A shaped exit frame already carries the final output
+        result["stdout"] = "".join(output["stdout"])
+        result["stderr"] = "".join(output["stderr"])
+    return result
+
+
+def pull_file(path, local_path, offset=0, length=None, resume=False, delta=True):
+    """Stream a remote file, or a byte range of it, into local_path via GET /raw"""
+    call = current_call()
+    if delta and not resume and not offset and length is None and os.path.isfile(local_path):
+        try:
+            result = delta_pull(path, local_path)
+        except OSError as e:
+            return {"success": False, "error": str(e)}
+        if result is not None:
+            return result
+    mode = "wb"
+    if resume and os.path.exists(local_path):
+        # Continue after the bytes we already have
+        have = os.path.getsize(local_path)
+        offset += have
+        if length is not None:
+            length -= have
+            if length <= 0:
+                return {"success": True, "path": path, "local_path": local_path, "bytes": 0, "complete": True}
+        mode = "ab"
+    headers = {}
+    if offset or length is not None:
+        last = "" if length is None else str(offset + length - 1)
+        headers["Range"] = f"bytes={offset}-{last}"
+    try:
+        conn, response = open_request("/raw?path=" + urllib.parse.quote(path), "GET", call=call, headers=headers)
+        if response.status == 416 and mode == "ab":
+            read_json(conn, response, call)
+            return {"success": True, "path": path, "local_path": local_path, "bytes": 0, "complete": True}
+        if response.status not in (200, 206):
+            return read_json(conn, response, call)
+        if response.status == 200:
+            mode, offset = "wb", 0  # the server sent the whole file
+        total = int(response.headers.get("Content-Length", 0))
+        written = 0
+        try:
+            parent = os.path.dirname(local_path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            with open(local_path, mode) as f:
+                while True:
+                    chunk = response.read(PULL_CHUNK)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    written += len(chunk)
+                    notify_progress(call, written, total=total)
+        except BaseException:
+            current_pool().discard(conn, call)
+            raise
+        current_pool().finish(conn, response, call)
+        content_range = response.headers.get("Content-Range", "")
+        size = int(content_range.rpartition("/")[2]) if content_range else total
+        return {
+            "success": written == total,
+            "path": path,
+            "local_path": local_path,
+            "offset": offset,
+            "bytes": written,
+            "size": size,
+            "complete": offset + written >= size
+        }
     except Exception as e:
+        return request_failed(e, call)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def push_file(local_path, path, chunk_size=UPLOAD_CHUNK, compress=False, delta=True):
+    """Upload a local file in resumable chunks, verified by sha256 and renamed into place"""
+    call = current_call()
+    try:
+        st = os.stat(local_path)
+        sha256 = file_sha256(local_path)
+        if delta:
+            with open(local_path, "rb") as f:
+                view = map_file(f)
+                try:
+                    result = delta_push(path, view, sha256)
+                finally:
+                    if isinstance(view, mmap.mmap):
+                        view.close()
+            if result is not None:
+                return result
+    except OSError as e:
         return {"success": False, "error": str(e)}
+    # Derived from the file, so re-running the same push resumes where it stopped
+    upload_id = hashlib.sha256(f"{path}|{st.st_size}|{sha256}".encode()).hexdigest()[:32]
+    opened = send_request("/upload/open", "POST", {"path": path, "upload_id": upload_id})
+    if not opened.get("success"):
+        return opened
+    offset = opened["offset"]
+    resumed_at = offset
+    failures = 0
+    with open(local_path, "rb") as f:
+        while offset < st.st_size:
+            if call is not None and call.cancelled.is_set():
+                return dict(CANCELLED)
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            headers = {"Content-Type": "application/octet-stream"}
+            if compress:
+                chunk = gzip.compress(chunk, compresslevel=6)
+                headers["Content-Encoding"] = "gzip"
+            try:
+                conn, response = open_request(f"/upload/chunk?id={upload_id}&offset={offset}", "POST",
+                                              call=call, headers=headers, body=chunk)
+                result = read_json(conn, response, call)
+            except Exception as e:
+                result = request_failed(e, call)
+            if result.get("success"):
+                offset = result["offset"]
+                failures = 0
+                notify_progress(call, offset, total=st.st_size)
+                continue
+            if result.get("cancelled"):
+                return result
+            failures += 1
+            if failures > UPLOAD_RETRIES:
+                return dict(result, upload_id=upload_id, offset=offset)
+            if "offset" in result:
+                offset = result["offset"]  # the server told us where it is
+                continue
+            time.sleep(min(2 ** failures, 30))
+            # Ask the server where to continue; reopening also recovers after a server restart
+            state = send_request("/upload/open", "POST", {"path": path, "upload_id": upload_id})
+            if state.get("success"):
+                offset = state["offset"]
+    committed = send_request("/upload/commit", "POST", {"upload_id": upload_id, "sha256": sha256, "size": st.st_size})
+    if committed.get("success"):
+        committed["resumed_at"] = resumed_at
+    return committed
+
+
+def matches_any(name, rel, patterns):
+    return any(fnmatch.fnmatch(rel if "/" in p or "\\" in p else name, p.replace("\\", "/")) for p in patterns)
+
+
+class TreeReport:
+    """Counts and a capped error list for a directory pull or push"""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = self.dirs = self.bytes = 0
+        self.errors = []
+        self.error_count = 0
+
+    def failed(self, name, error):
+        self.error_count += 1
+        if len(self.errors) < ARCHIVE_MAX_ERRORS:
+            self.errors.append({"path": name, "error": str(error)})
+
+    def summary(self):
+        return {"files": self.files, "dirs": self.dirs, "bytes": self.bytes,
+                "error_count": self.error_count, "errors": self.errors}
+
+
+def extract_tree(fileobj, root, call=None):
+    """Extract a tar stream under root as it is read; returns (TreeReport, the server's error report or None)"""
+    report = TreeReport(root)
+    remote_errors = None
+    dir_times = []
+    os.makedirs(root, exist_ok=True)
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if member.name == ARCHIVE_ERRORS_NAME:
+                    remote_errors = json.loads(archive.extractfile(member).read().decode())
+                    continue
+                parts = [p for p in member.name.replace("\\", "/").split("/") if p not in ("", ".")]
+                if not parts and member.isdir():
+                    continue  # the root itself, as in archives made with tar -C dir .
+                if not parts or member.name.startswith(("/", "\\")) or any(p == ".." or ":" in p for p in parts):
+                    report.failed(member.name, "Path escapes the destination")
+                    continue
+                full = os.path.join(root, *parts)
+                if member.isdir():
+                    os.makedirs(full, exist_ok=True)
+                    dir_times.append((full, member.mtime))
+                    report.dirs += 1
+                    continue
+                if not member.isfile():
+                    report.failed(member.name, "Not a regular file or directory")
+                    continue
+                os.makedirs(os.path.dirname(full), exist_ok=True)
+                # Each file appears whole or not at all
+                temp = f"{full}.{uuid.uuid4().hex[:8]}.part"
+                try:
+                    with archive.extractfile(member) as src, open(temp, "wb") as dst:
+                        for block in iter(lambda: src.read(PULL_CHUNK), b""):
+                            dst.write(block)
+                    os.utime(temp, (member.mtime, member.mtime))
+                    os.replace(temp, full)
+                except BaseException as e:
+                    try:
+                        os.remove(temp)
+                    except OSError:
+                        pass
+                    if not isinstance(e, OSError) or isinstance(e, ConnectionError):
+                        raise
+                    report.failed(member.name, e)
+                    continue
+                report.files += 1
+                report.bytes += member.size
+                notify_progress(call, report.bytes, f"{report.files} files")
+    finally:
+        # Deepest first, so setting a parent's mtime is not undone by its children
+        for full, mtime in sorted(dir_times, key=lambda item: -item[0].count(os.sep)):
+            try:
+                os.utime(full, (mtime, mtime))
+            except OSError:
+                pass
+    return report, remote_errors
+
+
+def pull_dir(path, local_path, compress=True, include=None, exclude=None):
+    """Fetch a remote directory tree as one streamed tar (POST /pack) and extract it under local_path"""
+    call = current_call()
+    try:
+        conn, response = open_request("/pack", "POST", {
+            "path": path, "format": "tar", "compress": compress, "include": include, "exclude": exclude
+        }, call)
+        if response.status != 200:
+            return read_json(conn, response, call)
+        started = time.monotonic()
+        try:
+            report, remote_errors = extract_tree(response, local_path, call)
+            while response.read(PULL_CHUNK):
+                pass  # tar padding after the last member
+        except BaseException:
+            current_pool().discard(conn, call)
+            raise
+        current_pool().finish(conn, response, call)
+        add_timing(call, "stream", started)
+    except (tarfile.TarError, EOFError, zlib.error, ValueError) as e:
+        if call is not None and call.cancelled.is_set():
+            return dict(CANCELLED)
+        return {"success": False, "error": f"Bad archive: {e}"}
+    except Exception as e:
+        return request_failed(e, call)
+    result = dict(report.summary(), path=path, local_path=local_path)
+    if remote_errors:
+        # Files the server could not read come first; they never reached the archive
+        result["errors"] = (remote_errors.get("errors", []) + result["errors"])[:ARCHIVE_MAX_ERRORS]
+        result["error_count"] += remote_errors.get("error_count", 0)
+    result["success"] = not result["error_count"]
+    return result
+
+
+class TreeBody:
+    """A local tree as an iterable tar(.gz) request body, packed by a thread as it is sent
+
+    Every iteration packs the tree afresh, so a request retried on a new connection sends it whole.
+    """
+
+    def __init__(self, root, compress=True, include=None, exclude=None, call=None):
+        self.root = root
+        self.compress = compress
+        self.include = include or []
+        self.exclude = exclude or []
+        self.call = call
+        self.report = TreeReport(root)
+
+    def entries(self):
+        """Yield (full path, member name, is_dir); directories only when no include filter is set"""
+        def walk_error(e):
+            self.report.failed(os.path.relpath(e.filename, self.root).replace(os.sep, "/"), e)
+
+        for root, dirs, files in os.walk(self.root, onerror=walk_error):
+            rel_root = os.path.relpath(root, self.root).replace(os.sep, "/")
+            rel_root = "" if rel_root == "." else rel_root + "/"
+            dirs.sort()
+            dirs[:] = [d for d in dirs if not matches_any(d, rel_root + d, self.exclude)]
+            if rel_root and not self.include:
+                yield root, rel_root.rstrip("/"), True
+            for name in sorted(files):
+                rel = rel_root + name
+                if matches_any(name, rel, self.exclude):
+                    continue
+                if self.include and not matches_any(name, rel, self.include):
+                    continue
+                yield os.path.join(root, name), rel, False
+
+    def pack(self, out):
+        with tarfile.open(fileobj=out, mode="w|gz" if self.compress else "w|", format=tarfile.PAX_FORMAT) as archive:
+            for full, rel, is_dir in self.entries():
+                if is_dir:
+                    archive.add(full, rel, recursive=False)
+                    self.report.dirs += 1
+                    continue
+                try:
+                    f = open(full, "rb")
+                except OSError as e:
+                    self.report.failed(rel, e)
+                    continue
+                with f:
+                    info = archive.gettarinfo(arcname=rel, fileobj=f)
+                    archive.addfile(info, f)
+                self.report.files += 1
+                self.report.bytes += info.size
+        out.flush()
+
+    def __iter__(self):
+        self.report = TreeReport(self.root)
+        pieces = queue.Queue(maxsize=8)
+        stop = threading.Event()
+        out = QueueWriter(pieces, stop)
+
+        def produce():
+            try:
+                try:
+                    self.pack(out)
+                    item = None
+                except BaseException as e:
+                    item = e
+                out.put(item)
+            except ConnectionAbortedError:
+                pass  # the request went away; nobody is reading
+
+        threading.Thread(target=produce, daemon=True).start()
+        sent = 0
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is None:
+                    return
+                if isinstance(piece, BaseException):
+                    raise piece
+                yield piece
+                sent += len(piece)
+                notify_progress(self.call, sent, f"{self.report.files} files")
+        finally:
+            stop.set()
+
+
+class QueueWriter:
+    """Write-only file object handing ARCHIVE_CHUNK pieces to a bounded queue; gives up once stop is set"""
+
+    def __init__(self, pieces, stop):
+        self.pieces = pieces
+        self.stop = stop
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= ARCHIVE_CHUNK:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, item):
+        while True:
+            if self.stop.is_set():
+                raise ConnectionAbortedError("Request abandoned")
+            try:
+                self.pieces.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+
+def push_dir(local_path, path, compress=True, include=None, exclude=None):
+    """Send a local directory tree as one streamed tar (POST /unpack), extracted on the server as it arrives"""
+    call = current_call()
+    if not os.path.isdir(local_path):
+        return {"success": False, "error": f"Not a directory: {local_path}"}
+    body = TreeBody(local_path, compress, include, exclude, call)
+    headers = {"Content-Type": "application/gzip" if compress else "application/x-tar"}
+    try:
+        conn, response = open_request("/unpack?path=" + urllib.parse.quote(path) + "&format=tar", "POST",
+                                      call=call, headers=headers, body=body)
+        result = read_json(conn, response, call)
+    except Exception as e:
+        return request_failed(e, call)
+    local = body.report
+    if local.error_count:
+        # Files that could not be read here were never sent
+        result["errors"] = (local.errors + result.get("errors", []))[:ARCHIVE_MAX_ERRORS]
+        result["error_count"] = result.get("error_count", 0) + local.error_count
+        result["success"] = False
+    result["local_path"] = local_path
+    return result
+
+
+# Delta sync helpers, kept identical to the copy in server.py; tests/test_delta.py checks both
+def delta_block_size(size):
+    """Block size for delta transfers of a size-byte file: about its square root, like rsync"""
+    block = DELTA_MIN_BLOCK
+    while block < DELTA_MAX_BLOCK and block * block < size:
+        block <<= 1
+    return block
+
+
+def block_digest(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def file_signature(f, block_size):
+    """Return (size, sha256, blocks) of an open binary file; blocks are [adler32, blake2b] pairs"""
+    digest = hashlib.sha256()
+    blocks = []
+    size = 0
+    for block in iter(lambda: f.read(block_size), b""):
+        digest.update(block)
+        size += len(block)
+        blocks.append([zlib.adler32(block), block_digest(block)])
+    return size, digest.hexdigest(), blocks
+
+
+def compute_delta(data, block_size, blocks, base_size, max_literal):
+    """Describe data as blocks copied from a base file plus literal bytes
+
+    data is bytes or an mmap; blocks and base_size come from the base file's
+    signature. Returns (ops, literal_bytes) where ops are ["copy", first_block,
+    count] and ["data", base64] in order, or None if more than max_literal bytes
+    would have to be sent.
+    """
+    tail = None
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        if index == len(blocks) - 1 and base_size % block_size:
+            tail = (base_size % block_size, strong, index)
+        else:
+            table.setdefault(weak, {})[strong] = index
+    ops = []
+    literal = 0
+
+    def emit_data(start, end):
+        if end > start:
+            ops.append(["data", base64.b64encode(data[start:end]).decode()])
+
+    def emit_copy(index):
+        if ops and ops[-1][0] == "copy" and ops[-1][1] + ops[-1][2] == index:
+            ops[-1][2] += 1
+        else:
+            ops.append(["copy", index, 1])
+
+    n = len(data)
+    pos = start = 0
+    weak = None
+    while pos + block_size <= n:
+        if weak is None:
+            weak = zlib.adler32(data[pos:pos + block_size])
+        candidates = table.get(weak)
+        if candidates:
+            index = candidates.get(block_digest(data[pos:pos + block_size]))
+            if index is not None:
+                literal += pos - start
+                emit_data(start, pos)
+                emit_copy(index)
+                pos = start = pos + block_size
+                weak = None
+                continue
+        if pos + block_size == n:
+            break
+        if literal + pos - start >= max_literal:
+            return None
+        # Slide the adler32 window one byte: drop data[pos], add data[pos + block_size]
+        out, new = data[pos], data[pos + block_size]
+        a = ((weak & 0xffff) - out + new) % 65521
+        b = ((weak >> 16) - block_size * out + a - 1) % 65521
+        weak = a | b << 16
+        pos += 1
+    end = n
+    if tail is not None and n - tail[0] >= start and block_digest(data[n - tail[0]:]) == tail[1]:
+        end = n - tail[0]
+    literal += end - start
+    if literal > max_literal:
+        return None
+    emit_data(start, end)
+    if end < n:
+        emit_copy(tail[2])
+    return ops, literal
+
+
+def apply_delta(base, ops, block_size, out):
+    """Write the file described by ops to out, copying blocks from the open base file; returns (size, sha256)"""
+    digest = hashlib.sha256()
+    size = 0
+    for op in ops:
+        if op[0] == "copy":
+            base.seek(op[1] * block_size)
+            remaining = op[2] * block_size
+            while remaining > 0:
+                chunk = base.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        elif op[0] == "data":
+            chunk = base64.b64decode(op[1])
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+        else:
+            raise ValueError(f"Unknown delta op: {op[0]}")
+    return size, digest.hexdigest()
+
+
+def map_file(f):
+    """Read-only view of an open file for compute_delta; empty files can't be mapped"""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def delta_push(path, data, sha256):
+    """Update a remote file to match data (bytes or mmap) by sending only the blocks that differ
+
+    Returns the tool result, or None when the whole file has to be sent instead.
+    """
+    signature = send_request("/delta/signature", "POST", {"path": path, "size": len(data), "sha256": sha256})
+    if not signature.get("success"):
+        return None
+    if signature.get("unchanged"):
+        return {"success": True, "path": path, "size": len(data), "sha256": sha256, "unchanged": True, "sent_bytes": 0}
+    if not signature.get("exists") or len(data) < DELTA_MIN_BYTES:
+        return None
+    delta = compute_delta(data, signature["block_size"], signature["blocks"], signature["size"],
+                          min(DELTA_MAX_LITERAL, len(data) * 3 // 4))
+    if delta is None:
+        return None
+    ops, literal = delta
+    result = send_request("/delta/apply", "POST", {
+        "path": path,
+        "block_size": signature["block_size"],
+        "ops": ops,
+        "size": len(data),
+        "sha256": sha256,
+        "base_size": signature["size"],
+        "base_mtime_ns": signature["mtime_ns"]
+    })
+    if not result.get("success"):
+        return None if not result.get("cancelled") else result
+    return dict(result, delta=True, sent_bytes=literal)
+
+
+def delta_pull(path, local_path):
+    """Bring local_path up to date with a remote file by fetching only the blocks that differ
+
+    Returns the tool result, or None when the whole file has to be fetched instead.
+    """
+    block_size = delta_block_size(os.path.getsize(local_path))
+    with open(local_path, "rb") as f:
+        size, sha256, blocks = file_signature(f, block_size)
+    result = send_request("/delta/compute", "POST", {
+        "path": path, "block_size": block_size, "blocks": blocks, "size": size, "sha256": sha256
+    })
+    if result.get("cancelled"):
+        return result
+    if not result.get("success"):
+        return None
+    if result.get("unchanged"):
+        return {"success": True, "path": path, "local_path": local_path, "size": size, "sha256": sha256,
+                "bytes": 0, "unchanged": True, "complete": True}
+    if not result.get("delta"):
+        return None
+    tmp = f"{local_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(local_path, "rb") as base, open(tmp, "wb") as out:
+            new_size, new_sha256 = apply_delta(base, result["ops"], block_size, out)
+        if new_size != result["size"] or new_sha256 != result["sha256"]:
+            os.remove(tmp)
+            return None
+        os.replace(tmp, local_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {"success": True, "path": path, "local_path": local_path, "size": new_size, "sha256": new_sha256,
+            "bytes": result["literal_bytes"], "delta": True, "complete": True}
+
+
+def server_platform():
+    """sys.platform of the server, which decides how /write encodes newlines"""
+    return send_request("/info").get("platform", "")
+
+
+def write_content(path, content, binary=False):
+    """Write inline content, skipping or delta-encoding it when the remote file is large and similar"""
+    if len(content) >= DELTA_MIN_BYTES:
+        if binary:
+            data = base64.b64decode(content)
+        else:
+            # Match /write, which opens the file in text mode on the server
+            data = content.encode("utf-8")
+            if server_platform() == "win32":
+                data = data.replace(b"\n", b"\r\n")
+        result = delta_push(path, data, hashlib.sha256(data).hexdigest())
+        if result is not None:
+            return result
+    return send_request("/write", "POST", {"path": path, "content": content, "binary": binary})
+
+
+def cancel_on_server(request_id, pool=None):
+    """Ask the server to kill whatever it started for request_id"""
+    try:
+        (pool or HOSTS.pool()).request("POST", "/cancel", json.dumps({"request_id": request_id}).encode(),
+                                       {"Content-Type": "application/json"}, timeout=10)
+    except Exception:
+        pass
+
+
+def substitute_target(value, name):
+    """Replace {target} in string arguments, e.g. to give each host its own local_path"""
+    if isinstance(value, str):
+        return value.replace("{target}", name)
+    if isinstance(value, list):
+        return [substitute_target(v, name) for v in value]
+    if isinstance(value, dict):
+        return {k: substitute_target(v, name) for k, v in value.items()}
+    return value
+
+
+def fan_out(call, names, tool_name, arguments, host_timeout=None):
+    """Run one tool on several hosts concurrently; results come back in host order"""
+    children = [call.child(HOSTS.pool(name)) for name in names]
+    results = [None] * len(names)
+
+    def run(index):
+        _local.call = children[index]
+        try:
+            return handle_tool_call(tool_name, substitute_target(arguments, names[index]))
+        finally:
+            _local.call = None
+
+    # Hosts beyond FANOUT_MAX_HOSTS wait for a slot, which counts against host_timeout
+    executor = ThreadPoolExecutor(max_workers=min(len(names), FANOUT_MAX_HOSTS), thread_name_prefix="host")
+    futures = {executor.submit(run, index): index for index in range(len(names))}
+    try:
+        for done, future in enumerate(as_completed(futures, timeout=host_timeout), 1):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = {"success": False, "error": str(e)}
+            notify_progress(call, done, names[index], total=len(names))
+    except FuturesTimeout:
+        for index, child in enumerate(children):
+            if results[index] is None:
+                child.cancel()
+                threading.Thread(target=cancel_on_server, args=(child.request_id, child.pool), daemon=True).start()
+                results[index] = {"success": False, "timeout": True, "error": f"No reply within {host_timeout}s"}
+    finally:
+        executor.shutdown(wait=False)
+    hosts = []
+    for name, result in zip(names, results):
+        host, port = HOSTS.address(name)
+        ok = isinstance(result, dict) and result.get("success", True) is not False
+        hosts.append({"target": name, "host": f"{host}:{port}", "success": ok, "result": result})
+    succeeded = sum(1 for item in hosts if item["success"])
+    return {"success": succeeded == len(hosts), "succeeded": succeeded, "failed": len(hosts) - succeeded,
+            "hosts": hosts}
 
 
 def handle_tool_call(tool_name, arguments):
@@ -48,7 +1678,7 @@ def handle_tool_call(tool_name, arguments):
     if tool_name == "win_exec":
         cmd = arguments.get("command", "")
         timeout = arguments.get("timeout", 300)
-        return send_request("/exec", "POST", {"cmd": cmd, "timeout": timeout})
+        return run_command("/exec", cmd, timeout, arguments)
 
     elif tool_name == "win_exec_b64":
         # Decode base64 command and execute
@@ -56,7 +1686,7 @@ def handle_tool_call(tool_name, arguments):
         try:
             cmd = base64.b64decode(arguments.get("command_b64", "")).decode("utf-8")
             timeout = arguments.get("timeout", 300)
-            return send_request("/exec", "POST", {"cmd": cmd, "timeout": timeout})
+            return run_command("/exec", cmd, timeout, arguments)
         except Exception as e:
             return {"success": False, "error": f"Base64 decode failed: {e}"}
 
@@ -64,75 +1694,256 @@ def handle_tool_call(tool_name, arguments):
         # Same as win_exec, for complex commands
         cmd = arguments.get("command", "")
         timeout = arguments.get("timeout", 300)
-        return send_request("/exec", "POST", {"cmd": cmd, "timeout": timeout})
+        return run_command("/exec", cmd, timeout, arguments)
 
     elif tool_name == "win_powershell":
         cmd = arguments.get("command", "")
         timeout = arguments.get("timeout", 300)
-        return send_request("/powershell", "POST", {"cmd": cmd, "timeout": timeout})
+        return run_command("/powershell", cmd, timeout, arguments)
+
+    elif tool_name == "win_job_start":
+        return send_request("/jobs/start", "POST", {
+            "cmd": arguments.get("command", ""),
+            "shell": arguments.get("shell", "cmd"),
+            "timeout": arguments.get("timeout"),
+            "spill": arguments.get("spill", False)
+        })
+
+    elif tool_name == "win_job_status":
+        return send_request("/jobs/status", "POST", {"id": arguments.get("id", "")})
+
+    elif tool_name == "win_job_output":
+        return send_request("/jobs/output", "POST", {
+            "id": arguments.get("id", ""),
+            "stdout_offset": arguments.get("stdout_offset", 0),
+            "stderr_offset": arguments.get("stderr_offset", 0),
+            "max_bytes": arguments.get("max_bytes", 65536)
+        })
+
+    elif tool_name == "win_job_wait":
+        timeout = arguments.get("timeout", 30)
+        return send_request("/jobs/wait", "POST", {"id": arguments.get("id", ""), "timeout": timeout},
+                            command_timeout(timeout))
+
+    elif tool_name == "win_job_list":
+        return send_request("/jobs/list", "POST", {})
+
+    elif tool_name == "win_job_kill":
+        return send_request("/jobs/kill", "POST", {"id": arguments.get("id", "")})
 
     elif tool_name == "win_read_file":
         path = arguments.get("path", "")
         binary = arguments.get("binary", False)
-        return send_request("/read", "POST", {"path": path, "binary": binary})
+        return send_request("/read", "POST", {
+            "path": path,
+            "binary": binary,
+            "offset": arguments.get("offset", 0),
+            "length": arguments.get("length")
+        })
 
     elif tool_name == "win_read_file_b64":
         path = arguments.get("path", "")
-        return send_request("/read", "POST", {"path": path, "binary": True})
+        return send_request("/read", "POST", {
+            "path": path,
+            "binary": True,
+            "offset": arguments.get("offset", 0),
+            "length": arguments.get("length")
+        })
+
+    elif tool_name == "win_pull_file":
+        return pull_file(
+            arguments.get("path", ""),
+            arguments.get("local_path", ""),
+            arguments.get("offset", 0),
+            arguments.get("length"),
+            arguments.get("resume", False),
+            arguments.get("delta", True)
+        )
+
+    elif tool_name == "win_pull_dir":
+        return pull_dir(
+            arguments.get("path", ""),
+            arguments.get("local_path", ""),
+            arguments.get("compress", True),
+            arguments.get("include"),
+            arguments.get("exclude")
+        )
+
+    elif tool_name == "win_push_dir":
+        return push_dir(
+            arguments.get("local_path", ""),
+            arguments.get("path", ""),
+            arguments.get("compress", True),
+            arguments.get("include"),
+            arguments.get("exclude")
+        )
 
     elif tool_name == "win_write_file":
         path = arguments.get("path", "")
-        content = arguments.get("content", "")
-        binary = arguments.get("binary", False)
-        return send_request("/write", "POST", {"path": path, "content": content, "binary": binary})
+        if arguments.get("local_path"):
+            return push_file(
+                arguments["local_path"],
+                path,
+                arguments.get("chunk_size", UPLOAD_CHUNK),
+                arguments.get("compress", False),
+                arguments.get("delta", True)
+            )
+        return write_content(path, arguments.get("content", ""), arguments.get("binary", False))
 
     elif tool_name == "win_read":
-        directory = arguments.get("directory", ".")
-        pattern = arguments.get("pattern", "*")
-        # List directory, then read matching files
-        ls_result = send_request("/ls", "POST", {"path": directory})
-        if not ls_result.get("success"):
-            return ls_result
-
-        import fnmatch
-        files = {}
-        for item in ls_result.get("items", []):
-            if item["type"] == "file" and fnmatch.fnmatch(item["name"], pattern):
-                file_path = f"{directory}\\{item['name']}"
-                read_result = send_request("/read", "POST", {"path": file_path})
-                if read_result.get("success"):
-                    files[file_path] = read_result.get("content", "")
-                else:
-                    files[file_path] = f"[Error: {read_result.get('error', 'unknown')}]"
-        return {"success": True, "files": files}
+        data = {
+            "directory": arguments.get("directory", "."),
+            "pattern": arguments.get("pattern", "*"),
+            "recursive": arguments.get("recursive", False),
+            "max_files": arguments.get("max_files", 1000),
+            "max_file_bytes": arguments.get("max_file_bytes", 1 << 20),
+            "max_total_bytes": arguments.get("max_total_bytes", 32 << 20)
+        }
+        call = current_call()
+        if call is None or call.progress_token is None:
+            return send_request("/readmany", "POST", data)
+
+        # Stream so the client sees progress per file
+        files, errors, truncated = {}, {}, []
+
+        def on_frame(frame):
+            if frame["type"] == "file":
+                files[frame["path"]] = frame["content"]
+                if frame["truncated"]:
+                    truncated.append(frame["path"])
+                notify_progress(call, len(files), frame["path"])
+            elif frame["type"] == "error":
+                errors[frame["path"]] = frame["error"]
+
+        last = stream_request("/readmany", data, on_frame)
+        if last.get("type") != "end":
+            return last
+        result = {k: v for k, v in last.items() if k not in ("type", "seq")}
+        return dict(result, directory=data["directory"], files=files, errors=errors, truncated=truncated)
 
     elif tool_name == "win_list_directory":
         path = arguments.get("path", ".")
-        return send_request("/ls", "POST", {"path": path})
+        data = {"path": path}
+        for key in ("recursive", "max_depth", "pattern", "type", "min_size", "max_size",
+                    "modified_after", "modified_before", "sort", "cursor", "limit", "details"):
+            if arguments.get(key) is not None:
+                data[key] = arguments[key]
+        return send_request("/ls", "POST", data)
+
+    elif tool_name == "win_search":
+        data = {"path": arguments.get("path", "."), "query": arguments.get("query", "")}
+        for key in ("regex", "ignore_case", "include", "exclude", "max_depth", "context",
+                    "max_matches", "max_matches_per_file", "max_file_bytes"):
+            if arguments.get(key) is not None:
+                data[key] = arguments[key]
+        call = current_call()
+        if call is None or call.progress_token is None:
+            return send_request("/search", "POST", data)
+
+        # Stream so the client sees matches as files finish
+        results, errors = [], {}
+
+        def on_frame(frame):
+            if frame["type"] == "matches":
+                results.extend(dict(match, path=frame["path"]) for match in frame["matches"])
+                notify_progress(call, len(results), frame["path"])
+            elif frame["type"] == "error":
+                errors[frame["path"]] = frame["error"]
+
+        last = stream_request("/search", data, on_frame)
+        if last.get("type") != "end":
+            return last
+        results.sort(key=lambda match: (match["path"], match["line"]))
+        result = {k: v for k, v in last.items() if k not in ("type", "seq")}
+        return dict(result, path=data["path"], results=results, errors=errors)
+
+    elif tool_name == "win_hash":
+        data = {}
+        for key in ("paths", "path", "pattern", "recursive", "algorithms", "use_cache"):
+            if arguments.get(key) is not None:
+                data[key] = arguments[key]
+        call = current_call()
+        if call is None or call.progress_token is None:
+            return send_request("/hash", "POST", data)
+
+        # Stream so the client sees progress per file
+        results, errors = [], {}
+
+        def on_frame(frame):
+            if frame["type"] == "file":
+                results.append({k: v for k, v in frame.items() if k not in ("type", "seq")})
+                notify_progress(call, len(results), frame["path"])
+            elif frame["type"] == "error":
+                errors[frame["path"]] = frame["error"]
+
+        last = stream_request("/hash", data, on_frame)
+        if last.get("type") != "end":
+            return last
+        results.sort(key=lambda item: item["path"])
+        result = {k: v for k, v in last.items() if k not in ("type", "seq")}
+        return dict(result, results=results, errors=errors)
 
     elif tool_name == "win_download_file":
-        url = arguments.get("url", "")
-        dst = arguments.get("dst", "")
-        return send_request("/download", "POST", {"url": url, "dst": dst})
+        if arguments.get("downloads"):
+            data = {"downloads": arguments["downloads"]}
+        else:
+            data = {"url": arguments.get("url", ""), "dst": arguments.get("dst", "")}
+            if arguments.get("sha256"):
+                data["sha256"] = arguments["sha256"]
+        if arguments.get("segments") is not None:
+            data["segments"] = arguments["segments"]
+        call = current_call()
+        if call is None or call.progress_token is None:
+            return send_request("/download", "POST", data)
+
+        # Stream so the client sees bytes downloaded so far
+        def on_frame(frame):
+            if frame["type"] == "progress":
+                notify_progress(call, frame["bytes"], total=frame["size"] or None)
+
+        last = stream_request("/download", data, on_frame)
+        if last.get("type") != "end":
+            return last
+        if "downloads" in data:
+            return {"success": last["success"], "results": last["results"]}
+        return last["results"][0]
 
     elif tool_name == "win_delete":
         path = arguments.get("path", "")
         return send_request("/delete", "POST", {"path": path})
 
-    elif tool_name == "win_copy":
-        src = arguments.get("src", "")
-        dst = arguments.get("dst", "")
-        return send_request("/copy", "POST", {"src": src, "dst": dst})
+    elif tool_name in ("win_copy", "win_move"):
+        endpoint = "/copy" if tool_name == "win_copy" else "/move"
+        data = {"src": arguments.get("src", ""), "dst": arguments.get("dst", "")}
+        for key in ("incremental", "merge", "workers"):
+            if arguments.get(key) is not None:
+                data[key] = arguments[key]
+        call = current_call()
+        if call is None or call.progress_token is None:
+            return send_request(endpoint, "POST", data)
+
+        # Stream so the client sees files/bytes done while a large tree is copied
+        def on_frame(frame):
+            if frame["type"] == "progress":
+                notify_progress(call, frame["files"], f"{frame['files']} files, {frame['bytes']} bytes")
 
-    elif tool_name == "win_move":
-        src = arguments.get("src", "")
-        dst = arguments.get("dst", "")
-        return send_request("/move", "POST", {"src": src, "dst": dst})
+        last = stream_request(endpoint, data, on_frame)
+        if last.get("type") != "end":
+            return last
+        return {k: v for k, v in last.items() if k not in ("type", "seq")}
 
     elif tool_name == "win_exists":
         path = arguments.get("path", "")
         return send_request("/exists", "POST", {"path": path})
 
+    elif tool_name == "win_batch":
+        return send_request("/batch", "POST", {
+            "ops": arguments.get("operations", []),
+            "stop_on_error": arguments.get("stop_on_error", True),
+            "parallel": arguments.get("parallel", False),
+            "max_workers": arguments.get("max_workers", 8)
+        })
+
     elif tool_name == "win_shell_status":
         return send_request("/health")
 
@@ -143,13 +1954,56 @@ def handle_tool_call(tool_name, arguments):
     elif tool_name == "win_server_info":
         return send_request("/info")
 
+    elif tool_name == "win_bridge_metrics":
+        return {"success": True, "tools": TOOL_METRICS.snapshot(arguments.get("reset", False))}
+
+    elif tool_name == "win_hosts":
+        result = dict(HOSTS.describe(), success=True)
+        if arguments.get("check"):
+            checked = fan_out(current_call() or CallContext(None), list(HOSTS.hosts), "win_shell_status", {},
+                              arguments.get("host_timeout", 5))
+            status = {item["target"]: item for item in checked["hosts"]}
+            for host in result["hosts"]:
+                item = status[host["name"]]
+                host["reachable"] = item["success"]
+                if not item["success"]:
+                    host["error"] = item["result"].get("error")
+        return result
+
     else:
         return {"success": False, "error": f"Unknown tool: {tool_name}"}
 
 
+LOCAL_TOOLS = ("win_hosts", "win_bridge_metrics")  # answered by the bridge itself, never fanned out
+
+TARGET_PROPERTIES = {
+    "target": {
+        "anyOf": [{"type": "string"}, {"type": "array", "items": {"type": "string"}}],
+        "description": "Host name, group, \"all\", host:port, or a list of them (default: the default host). "
+                       "Groups and lists run on every host concurrently; {target} in arguments becomes each host's name."
+    },
+    "host_timeout": {"type": "number", "description": "With several targets, seconds to wait for each host"}
+}
+
+OUTPUT_PROPERTIES = {
+    "max_bytes": {"type": "integer", "description": "Return at most about this many bytes of each stream, "
+                                                    "keeping the first and last halves"},
+    "lines": {"type": "array", "items": {"type": ["integer", "null"]}, "minItems": 2, "maxItems": 2,
+              "description": "[start, end] line range, 1-based and inclusive; negative counts from the end "
+                             "([-50, -1] is the last 50 lines), null leaves that side open"},
+    "include": {"type": "string", "description": "Only return lines matching this regex"},
+    "exclude": {"type": "string", "description": "Drop lines matching this regex"},
+    "collapse": {"type": "boolean", "description": "Collapse runs of identical lines into one plus a count",
+                 "default": False},
+    "spill": {"type": "boolean", "description": "When output is cut, save the full output on the server and "
+                                                "return its path in shaped.<stream>.spill", "default": False}
+}
+OUTPUT_TOOLS = ("win_exec", "win_exec_b64", "win_exec_complex", "win_powershell")
+
+
 def get_tools():
     """Return available MCP tools"""
-    return {
+    tools = {
         "tools": [
             {
                 "name": "win_exec",
@@ -199,6 +2053,76 @@ def get_tools():
                     "required": ["command"]
                 }
             },
+            {
+                "name": "win_job_start",
+                "description": "Start a long-running command on Windows in the background and return a job id",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "command": {"type": "string", "description": "Command to execute"},
+                        "shell": {"type": "string", "enum": ["cmd", "powershell"], "default": "cmd"},
+                        "timeout": {"type": "integer", "description": "Kill the job after this many seconds (default: never)"},
+                        "spill": {"type": "boolean", "description": "Keep the full output on disk, not just the last 1 MB", "default": False}
+                    },
+                    "required": ["command"]
+                }
+            },
+            {
+                "name": "win_job_status",
+                "description": "Get the state and exit code of a background job",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "Job id"}
+                    },
+                    "required": ["id"]
+                }
+            },
+            {
+                "name": "win_job_output",
+                "description": "Read a background job's output. Pass back the returned offsets to read only new output.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "Job id"},
+                        "stdout_offset": {"type": "integer", "description": "Byte offset into stdout", "default": 0},
+                        "stderr_offset": {"type": "integer", "description": "Byte offset into stderr", "default": 0},
+                        "max_bytes": {"type": "integer", "description": "Max bytes per stream", "default": 65536}
+                    },
+                    "required": ["id"]
+                }
+            },
+            {
+                "name": "win_job_wait",
+                "description": "Wait until a background job finishes or the timeout passes",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "Job id"},
+                        "timeout": {"type": "integer", "description": "Seconds to wait", "default": 30}
+                    },
+                    "required": ["id"]
+                }
+            },
+            {
+                "name": "win_job_list",
+                "description": "List background jobs on the Windows machine",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {}
+                }
+            },
+            {
+                "name": "win_job_kill",
+                "description": "Kill a background job",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "Job id"}
+                    },
+                    "required": ["id"]
+                }
+            },
             {
                 "name": "win_read_file",
                 "description": "Read a text file from the Windows machine",
@@ -206,7 +2130,9 @@ def get_tools():
                     "type": "object",
                     "properties": {
                         "path": {"type": "string", "description": "Full Windows path to the file"},
-                        "binary": {"type": "boolean", "description": "Read as binary (base64)", "default": False}
+                        "binary": {"type": "boolean", "description": "Read as binary (base64)", "default": False},
+                        "offset": {"type": "integer", "description": "Byte offset to start reading at", "default": 0},
+                        "length": {"type": "integer", "description": "Max bytes to read (default: to end of file)"}
                     },
                     "required": ["path"]
                 }
@@ -217,56 +2143,174 @@ def get_tools():
                 "inputSchema": {
                     "type": "object",
                     "properties": {
-                        "path": {"type": "string", "description": "Full Windows path to the file"}
+                        "path": {"type": "string", "description": "Full Windows path to the file"},
+                        "offset": {"type": "integer", "description": "Byte offset to start reading at", "default": 0},
+                        "length": {"type": "integer", "description": "Max bytes to read (default: to end of file)"}
                     },
                     "required": ["path"]
                 }
             },
+            {
+                "name": "win_pull_file",
+                "description": "Copy a file (or a byte range of it) from Windows to a local path as raw bytes. Use for large files.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string", "description": "Full Windows path to the file"},
+                        "local_path": {"type": "string", "description": "Local destination path"},
+                        "offset": {"type": "integer", "description": "Byte offset to start at", "default": 0},
+                        "length": {"type": "integer", "description": "Max bytes to copy (default: to end of file)"},
+                        "resume": {"type": "boolean", "description": "Append to an existing partial local file", "default": False},
+                        "delta": {"type": "boolean", "description": "If local_path exists, fetch only changed blocks (skipped entirely when identical)", "default": True}
+                    },
+                    "required": ["path", "local_path"]
+                }
+            },
             {
                 "name": "win_write_file",
-                "description": "Write content to a file on the Windows machine",
+                "description": "Write content to a file on the Windows machine, or upload a local file with local_path (chunked, resumable, sha256-verified)",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "path": {"type": "string", "description": "Full Windows path for the file"},
                         "content": {"type": "string", "description": "Content to write"},
-                        "binary": {"type": "boolean", "description": "Write as binary (content is base64)", "default": False}
+                        "binary": {"type": "boolean", "description": "Write as binary (content is base64)", "default": False},
+                        "local_path": {"type": "string", "description": "Upload this local file instead of content"},
+                        "chunk_size": {"type": "integer", "description": "Upload chunk size in bytes", "default": UPLOAD_CHUNK},
+                        "compress": {"type": "boolean", "description": "gzip chunks before sending", "default": False},
+                        "delta": {"type": "boolean", "description": "If the remote file exists, send only changed blocks (skipped entirely when identical)", "default": True}
                     },
-                    "required": ["path", "content"]
+                    "required": ["path"]
+                }
+            },
+            {
+                "name": "win_pull_dir",
+                "description": "Copy a whole Windows directory tree to a local directory in one streamed tar, extracted as it arrives. Use instead of many win_pull_file calls.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string", "description": "Windows directory to copy"},
+                        "local_path": {"type": "string", "description": "Local destination directory (created if missing)"},
+                        "compress": {"type": "boolean", "description": "gzip the archive on the wire", "default": True},
+                        "include": {"type": "array", "items": {"type": "string"}, "description": "Only files matching these globs (name, or relative path if the glob has a slash)"},
+                        "exclude": {"type": "array", "items": {"type": "string"}, "description": "Skip files and directories matching these globs, e.g. node_modules"}
+                    },
+                    "required": ["path", "local_path"]
+                }
+            },
+            {
+                "name": "win_push_dir",
+                "description": "Copy a whole local directory tree to Windows in one streamed tar, extracted on the server as it arrives. Use instead of many win_write_file calls.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "local_path": {"type": "string", "description": "Local directory to copy"},
+                        "path": {"type": "string", "description": "Windows destination directory (created if missing)"},
+                        "compress": {"type": "boolean", "description": "gzip the archive on the wire", "default": True},
+                        "include": {"type": "array", "items": {"type": "string"}, "description": "Only files matching these globs (name, or relative path if the glob has a slash)"},
+                        "exclude": {"type": "array", "items": {"type": "string"}, "description": "Skip files and directories matching these globs, e.g. node_modules"}
+                    },
+                    "required": ["local_path", "path"]
                 }
             },
             {
                 "name": "win_read",
-                "description": "Read multiple files from a Windows directory matching a pattern",
+                "description": "Read multiple files from a Windows directory matching a pattern, in one round trip",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "directory": {"type": "string", "description": "Directory path"},
-                        "pattern": {"type": "string", "description": "Glob pattern (e.g., *.txt)", "default": "*"}
+                        "pattern": {"type": "string", "description": "Glob pattern (e.g., *.txt, or conf/*.ini to match relative paths)", "default": "*"},
+                        "recursive": {"type": "boolean", "description": "Include subdirectories", "default": False},
+                        "max_files": {"type": "integer", "description": "Max files to read", "default": 1000},
+                        "max_file_bytes": {"type": "integer", "description": "Bytes read per file; longer files are truncated", "default": 1048576},
+                        "max_total_bytes": {"type": "integer", "description": "Total bytes read across all files", "default": 33554432}
                     },
                     "required": ["directory"]
                 }
             },
             {
                 "name": "win_list_directory",
-                "description": "List directory contents on the Windows machine",
+                "description": "List directory contents on the Windows machine. Large listings can be filtered and paged with limit/cursor.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
-                        "path": {"type": "string", "description": "Directory path", "default": "."}
+                        "path": {"type": "string", "description": "Directory path", "default": "."},
+                        "recursive": {"type": "boolean", "description": "Include subdirectories (names become relative paths)", "default": False},
+                        "max_depth": {"type": "integer", "description": "Levels below path to descend when recursive"},
+                        "pattern": {"type": "string", "description": "Glob on the name, or on the relative path if it contains a separator"},
+                        "type": {"type": "string", "enum": ["file", "dir"], "description": "Only files or only directories"},
+                        "min_size": {"type": "integer", "description": "Minimum size in bytes"},
+                        "max_size": {"type": "integer", "description": "Maximum size in bytes"},
+                        "modified_after": {"type": "number", "description": "Only entries modified after this Unix time"},
+                        "modified_before": {"type": "number", "description": "Only entries modified before this Unix time"},
+                        "sort": {"type": "string", "description": "name, size, mtime or type; prefix - for descending"},
+                        "limit": {"type": "integer", "description": "Max entries to return; pass next_cursor back for the next page"},
+                        "cursor": {"type": "string", "description": "next_cursor from the previous page"},
+                        "details": {"type": "boolean", "description": "Include modification times", "default": False}
+                    }
+                }
+            },
+            {
+                "name": "win_search",
+                "description": "Search file contents under a Windows directory (like grep -rn) and return matching lines. Much cheaper than reading files back.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string", "description": "Directory (searched recursively) or single file", "default": "."},
+                        "query": {"type": "string", "description": "Text to find, or a regular expression with regex=true"},
+                        "regex": {"type": "boolean", "description": "Treat query as a Python regular expression", "default": False},
+                        "ignore_case": {"type": "boolean", "description": "Case-insensitive match", "default": False},
+                        "include": {"type": "array", "items": {"type": "string"}, "description": "Only files matching these globs (e.g. *.cs, src/*.py)"},
+                        "exclude": {"type": "array", "items": {"type": "string"}, "description": "Skip files and directories matching these globs (e.g. .git, node_modules, *.min.js)"},
+                        "max_depth": {"type": "integer", "description": "Levels below path to descend"},
+                        "context": {"type": "integer", "description": "Lines of context before and after each match", "default": 0},
+                        "max_matches": {"type": "integer", "description": "Stop after this many matching lines", "default": 1000},
+                        "max_matches_per_file": {"type": "integer", "description": "Matching lines reported per file"},
+                        "max_file_bytes": {"type": "integer", "description": "Only search the first bytes of larger files"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "win_hash",
+                "description": "Hash files on the Windows machine in parallel (sha256 by default). Unchanged files are answered from a cache keyed by path, size and mtime.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "paths": {"type": "array", "items": {"type": "string"}, "description": "Files to hash"},
+                        "path": {"type": "string", "description": "Hash every file under this directory"},
+                        "pattern": {"type": "string", "description": "Glob for files under path", "default": "*"},
+                        "recursive": {"type": "boolean", "description": "Include subdirectories of path", "default": True},
+                        "algorithms": {"type": "array", "items": {"type": "string"}, "description": "e.g. sha256, sha1, md5, blake2b, sha512", "default": ["sha256"]},
+                        "use_cache": {"type": "boolean", "description": "Reuse cached digests of unchanged files", "default": True}
                     }
                 }
             },
             {
                 "name": "win_download_file",
-                "description": "Download a file from URL to the Windows machine",
+                "description": "Download files from URLs to the Windows machine, in parallel segments when the server supports Range. Interrupted downloads resume when repeated.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "url": {"type": "string", "description": "URL to download from"},
-                        "dst": {"type": "string", "description": "Destination path on Windows"}
-                    },
-                    "required": ["url", "dst"]
+                        "dst": {"type": "string", "description": "Destination path on Windows"},
+                        "sha256": {"type": "string", "description": "Expected sha256; the download fails if it differs and is skipped if dst already matches"},
+                        "downloads": {
+                            "type": "array",
+                            "description": "Several downloads to run concurrently instead of url/dst",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "url": {"type": "string"},
+                                    "dst": {"type": "string"},
+                                    "sha256": {"type": "string"}
+                                },
+                                "required": ["url", "dst"]
+                            }
+                        },
+                        "segments": {"type": "integer", "description": "Parallel Range requests per file", "default": 4}
+                    }
                 }
             },
             {
@@ -282,24 +2326,29 @@ def get_tools():
             },
             {
                 "name": "win_copy",
-                "description": "Copy a file or directory on the Windows machine",
+                "description": "Copy a file or directory on the Windows machine. Trees are copied in parallel; failed files are listed without stopping the rest.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "src": {"type": "string", "description": "Source path"},
-                        "dst": {"type": "string", "description": "Destination path"}
+                        "dst": {"type": "string", "description": "Destination path"},
+                        "incremental": {"type": "boolean", "description": "Skip files whose destination has the same size and mtime (implies merge)", "default": False},
+                        "merge": {"type": "boolean", "description": "Copy a directory into an existing destination directory instead of failing", "default": False},
+                        "workers": {"type": "integer", "description": "Files transferred in parallel", "default": 8}
                     },
                     "required": ["src", "dst"]
                 }
             },
             {
                 "name": "win_move",
-                "description": "Move a file or directory on the Windows machine",
+                "description": "Move a file or directory on the Windows machine. Trees are moved in parallel; failed files are listed without stopping the rest.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "src": {"type": "string", "description": "Source path"},
-                        "dst": {"type": "string", "description": "Destination path"}
+                        "dst": {"type": "string", "description": "Destination path"},
+                        "incremental": {"type": "boolean", "description": "Skip files whose destination has the same size and mtime", "default": False},
+                        "workers": {"type": "integer", "description": "Files transferred in parallel", "default": 8}
                     },
                     "required": ["src", "dst"]
                 }
@@ -315,6 +2364,31 @@ def get_tools():
                     "required": ["path"]
                 }
             },
+            {
+                "name": "win_batch",
+                "description": "Run several server operations (exists, ls, copy, move, delete, write, read, exec, ...) in one round trip",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "operations": {
+                            "type": "array",
+                            "description": "Operations in order, e.g. {\"op\": \"copy\", \"args\": {\"src\": \"C:\\\\a\", \"dst\": \"C:\\\\b\"}}. Args are the server endpoint's JSON fields.",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "op": {"type": "string", "description": "Endpoint name, e.g. exists, ls, copy, move, delete, write, read, exec, powershell"},
+                                    "args": {"type": "object", "description": "Endpoint arguments"}
+                                },
+                                "required": ["op"]
+                            }
+                        },
+                        "stop_on_error": {"type": "boolean", "description": "Skip remaining operations after a failure", "default": True},
+                        "parallel": {"type": "boolean", "description": "Operations are independent; run them concurrently", "default": False},
+                        "max_workers": {"type": "integer", "description": "Concurrency when parallel", "default": 8}
+                    },
+                    "required": ["operations"]
+                }
+            },
             {
                 "name": "win_shell_status",
                 "description": "Check the health of the Windows server connection",
@@ -338,13 +2412,123 @@ def get_tools():
                     "type": "object",
                     "properties": {}
                 }
+            },
+            {
+                "name": "win_hosts",
+                "description": "List the Windows hosts and groups this bridge can target; with check, report which are reachable",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "check": {"type": "boolean", "description": "Call /health on every host", "default": False},
+                        "host_timeout": {"type": "number", "description": "Seconds to wait for each host when checking", "default": 5}
+                    }
+                }
+            },
+            {
+                "name": "win_bridge_metrics",
+                "description": "Per-tool call counts and latency on this bridge (mean, p50, p95, max), split into "
+                               "network, server and serialization time",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "reset": {"type": "boolean", "description": "Clear the counters after reading them", "default": False}
+                    }
+                }
             }
         ]
     }
+    for tool in tools["tools"]:
+        if tool["name"] in OUTPUT_TOOLS:
+            tool["inputSchema"]["properties"].update(OUTPUT_PROPERTIES)
+        if tool["name"] not in LOCAL_TOOLS:
+            tool["inputSchema"]["properties"].update(TARGET_PROPERTIES)
+    return tools
+
+
+_stdout_lock = threading.Lock()
+
+
+def write_message(message):
+    """Write one JSON-RPC message to stdout; safe to call from any thread"""
+    line = json.dumps(message)
+    with _stdout_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+_calls = {}  # JSON-RPC id -> CallContext of in-flight tools/call requests
+_calls_lock = threading.Lock()
+
+
+def format_result(result):
+    """Serialize a tool result for the client"""
+    if COMPACT_RESULTS:
+        return json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+    return json.dumps(result, indent=2)
+
+
+def run_tool_call(call, params):
+    """Run one tools/call on a worker thread and write its response"""
+    _local.call = call
+    started = time.monotonic()
+    tool_name = params.get("name", "")
+    success = False
+    try:
+        arguments = dict(params.get("arguments", {}))
+        if tool_name in LOCAL_TOOLS:
+            result = handle_tool_call(tool_name, arguments)
+        else:
+            names, multiple = HOSTS.resolve(arguments.pop("target", None))
+            host_timeout = arguments.pop("host_timeout", None)
+            if multiple:
+                result = fan_out(call, names, tool_name, arguments, host_timeout)
+            else:
+                call.pool = HOSTS.pool(names[0])
+                result = handle_tool_call(tool_name, arguments)
+        success = not (isinstance(result, dict) and result.get("success") is False)
+        formatting = time.monotonic()
+        text = format_result(result)
+        add_timing(call, "format", formatting)
+        response = {
+            "jsonrpc": "2.0",
+            "id": call.req_id,
+            "result": {
+                "content": [{"type": "text", "text": text}]
+            }
+        }
+    except Exception as e:
+        response = {
+            "jsonrpc": "2.0",
+            "id": call.req_id,
+            "error": {"code": -32603, "message": str(e)}
+        }
+    finally:
+        _local.call = None
+        with _calls_lock:
+            _calls.pop(call.req_id, None)
+    # A cancelled request gets no response
+    if not call.cancelled.is_set():
+        writing = time.monotonic()
+        write_message(response)
+        add_timing(call, "write", writing)
+    TOOL_METRICS.record(tool_name, time.monotonic() - started, dict(call.timings), success)
+
+
+def cancel_call(req_id):
+    """Handle notifications/cancelled for an in-flight tools/call"""
+    with _calls_lock:
+        call = _calls.get(req_id)
+    if call is None:
+        return  # already finished, or never existed
+    call.cancel()
+    # Runs on its own thread: the worker pool may be full of the calls being cancelled
+    for pool, request_id in call.targets():
+        threading.Thread(target=cancel_on_server, args=(request_id, pool), daemon=True).start()
 
 
 def main():
     """Main MCP server loop using stdio"""
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS, thread_name_prefix="call")
     for line in sys.stdin:
         try:
             request = json.loads(line.strip())
@@ -371,16 +2555,16 @@ def main():
                 }
 
             elif method == "tools/call":
-                tool_name = params.get("name", "")
-                arguments = params.get("arguments", {})
-                result = handle_tool_call(tool_name, arguments)
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": req_id,
-                    "result": {
-                        "content": [{"type": "text", "text": json.dumps(result, indent=2)}]
-                    }
-                }
+                # Runs concurrently; the response is written when the call finishes
+                call = CallContext(req_id, params.get("_meta", {}).get("progressToken"))
+                with _calls_lock:
+                    _calls[req_id] = call
+                executor.submit(run_tool_call, call, params)
+                continue
+
+            elif method == "notifications/cancelled":
+                cancel_call(params.get("requestId"))
+                continue
 
             elif method == "notifications/initialized":
                 # No response needed for notifications
@@ -393,7 +2577,7 @@ def main():
                     "error": {"code": -32601, "message": f"Method not found: {method}"}
                 }
 
-            print(json.dumps(response), flush=True)
+            write_message(response)
 
         except json.JSONDecodeError:
             continue
@@ -403,7 +2587,10 @@ def main():
                 "id": None,
                 "error": {"code": -32603, "message": str(e)}
             }
-            print(json.dumps(error_response), flush=True)
+            write_message(error_response)
+
+    # stdin closed: let in-flight calls finish and write their responses
+    executor.shutdown(wait=True)
 
 
 if __name__ == "__main__":
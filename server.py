@@ -1,109 +1,3692 @@
 #!/usr/bin/env python3
 """
 Windows MCP Server - Run on Windows machine
-Usage: python server.py [port]
+Usage: python server.py [port] [--workers N] [--queue-size N] [--limit ENDPOINT=N]
 Default port: 8000
 """
 
 import subprocess
 import json
 import base64
+import io
 import os
 import sys
 import shutil
+import socket
+import struct
+import argparse
+import queue
+import threading
+import codecs
+import locale
+import time
+import re
+import tempfile
+import uuid
+import urllib.parse
+import urllib.request
+import urllib.error
+import http.client
+import hashlib
+import zlib
+import fnmatch
+import itertools
+import mmap
+import sqlite3
+import stat
+import bisect
+import select
+import signal
+import weakref
+import tarfile
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+if os.name == "nt":
+    import ctypes
+    from ctypes import wintypes
+
 HOST = "0.0.0.0"
-PORT = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+PORT = 8000
+WORKERS = 32      # requests handled concurrently
+QUEUE_SIZE = 64   # accepted connections waiting for a worker before we answer "busy"
+BUSY_LINGER = 2   # seconds a connection answered "busy" is drained, so the client reads the 503
+BUSY_LINGER_MAX = 256  # connections drained at once; beyond this they are closed straight away
+KEEPALIVE_TIMEOUT = 30  # seconds an idle keep-alive connection may hold a worker
+
+MUX_PROTOCOL = "mcp-mux/1"  # Upgrade token of GET /mux, the multiplexed binary transport
+MUX_WINDOW = 4 << 20        # body bytes a stream may send before the receiver grants more
+MUX_MAX_FRAME = 256 << 10   # larger bodies are split into frames this big so streams interleave
+MUX_MAX_STREAMS = 64        # requests served at once per connection (and --workers over all of them)
+MUX_MAX_QUEUED = 16         # requests waiting per connection; more are answered 503 busy
+
+# Max concurrent requests per endpoint, so slow calls can't take every worker
+ENDPOINT_LIMITS = {
+    "/exec": 8,
+    "/powershell": 8,
+    "/download": 4,
+    "/jobs/wait": 8,
+    "/raw": 8,
+    "/search": 4,
+    "/hash": 4,
+    "/copy": 4,
+    "/move": 4,
+    "/pack": 4,
+    "/unpack": 4,
+}
+
+COMPRESS_MIN_BYTES = 1024  # smaller replies are sent uncompressed
+COMPRESS_LEVEL = 6
+
+BATCH_MAX_OPS = 1000
+BATCH_GET_OPS = ("/health", "/info")
+BATCH_EXCLUDED_OPS = ("/batch", "/pack", "/unpack")
+
+METADATA_CACHE_ENTRIES = 512     # /ls replies kept for repeat listings
+METADATA_CACHE_BYTES = 32 << 20  # approximate JSON size of all cached replies
+METADATA_CACHE_TTL = 30          # seconds before a cached listing is rebuilt even if its mtime is unchanged
+
+DELTA_MIN_BLOCK = 2048        # delta block sizes grow with the file, between these bounds
+DELTA_MAX_BLOCK = 1 << 17
+DELTA_MAX_LITERAL = 16 << 20  # /delta/compute gives up and asks for a full fetch above this
+
+SEARCH_WORKERS = 8             # files searched concurrently by /search
+SEARCH_MMAP_BYTES = 4 << 20    # larger files are memory-mapped instead of read
+SEARCH_SNIFF_BYTES = 8192      # a NUL byte in this much of a file marks it as binary
+SEARCH_MAX_LINE = 1000         # longer matching lines are cut to this many bytes
+
+HASH_WORKERS = 8        # files hashed concurrently by /hash
+HASH_CHUNK = 1 << 20    # read size while hashing
+HASH_RACY_SECONDS = 2   # files modified more recently than this are hashed but not cached
+HASH_CACHE_PATH = os.path.join(tempfile.gettempdir(), "mcp-hash-cache.sqlite3")
+
+COPY_WORKERS = 8              # files copied concurrently by /copy and /move
+COPY_LARGE_BYTES = 16 << 20   # files this big are copied through COPY_BUFFER with byte progress
+COPY_BUFFER = 8 << 20
+COPY_MTIME_WINDOW = 2         # seconds; incremental copies treat closer mtimes as equal (FAT has 2 s)
+COPY_PROGRESS_INTERVAL = 0.5  # seconds between streamed progress frames
+COPY_MAX_ERRORS = 1000        # failed files listed in the summary
+
+ARCHIVE_CHUNK = 256 << 10  # /pack replies are sent in chunks of about this size
+ARCHIVE_MAX_ERRORS = 1000  # skipped entries listed per /pack or /unpack
+ARCHIVE_ERRORS_NAME = ".mcp-pack-errors.json"  # last /pack member, listing files that could not be read
+
+DOWNLOAD_SEGMENTS = 4              # parallel Range requests per file
+DOWNLOAD_MIN_SEGMENT = 4 << 20     # files are not split into segments smaller than this
+DOWNLOAD_CONNECTIONS = 8           # connections open at once across all downloads
+DOWNLOAD_RATE = 0                  # bytes per second across all downloads; 0 is unlimited
+DOWNLOAD_CHUNK = 256 << 10
+DOWNLOAD_RETRIES = 5               # attempts per segment without progress before giving up
+DOWNLOAD_TIMEOUT = 60              # seconds without data before a connection is retried
+
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # seconds
+METRICS_MAX_ENDPOINTS = 64  # distinct endpoint labels on /metrics; further paths count as "other"
+
+READ_MAX_BYTES = 64 << 20  # largest /read reply; bigger files must be paged or fetched via /raw
+
+SHELL_POOL_SIZE = 0  # warm interpreters per shell for /exec and /powershell; 0 disables
+SHELL_MAX_USES = 100  # commands an interpreter runs before it is recycled
+
+JOB_BUFFER_BYTES = 1 << 20  # output kept in memory per job stream
+MAX_FINISHED_JOBS = 100     # finished jobs remembered before the oldest are dropped
+JOB_SPILL_DIR = os.path.join(tempfile.gettempdir(), "mcp-jobs")
+
+OUTPUT_SPILL_DIR = os.path.join(tempfile.gettempdir(), "mcp-output")  # full output of shaped /exec results
+OUTPUT_SPILL_TTL = 24 * 3600  # seconds a spilled output is kept; older ones go when the next is written
+
+DISCONNECT_POLL = 1  # seconds between checks that the client of a running command is still connected
+
+POWERSHELL = ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command"]
+
+BUSY_RESPONSE = (
+    b"HTTP/1.0 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b'{"success": false, "busy": true, "error": "Server busy: request queue is full"}'
+)
+
+
+class EndpointLimiter:
+    """Caps how many requests may run at once for each endpoint"""
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self.slots = {path: threading.BoundedSemaphore(n) for path, n in self.limits.items()}
+
+    def acquire(self, path):
+        slot = self.slots.get(path)
+        return slot is None or slot.acquire(blocking=False)
+
+    def release(self, path):
+        slot = self.slots.get(path)
+        if slot is not None:
+            slot.release()
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands connections to a fixed pool of worker threads"""
+
+    def __init__(self, address, handler, workers=WORKERS, queue_size=QUEUE_SIZE, limits=None):
+        # Set before binding: a failed bind calls server_close()
+        self.pending = queue.Queue()
+        self.rejected = queue.Queue()
+        self.workers = []
+        super().__init__(address, handler)
+        self.limiter = EndpointLimiter(ENDPOINT_LIMITS if limits is None else limits)
+        # Connections being handled plus connections waiting for a worker
+        self.capacity = threading.BoundedSemaphore(workers + queue_size)
+        # Mux streams run on their connection's threads, so --workers caps them here instead
+        self.stream_slots = threading.BoundedSemaphore(workers)
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+        threading.Thread(target=self._linger, name="linger", daemon=True).start()
+
+    def process_request(self, request, client_address):
+        if self.capacity.acquire(blocking=False):
+            self.pending.put((request, client_address))
+            return
+        # Answer from the accept thread so the client fails fast instead of hanging
+        METRICS.inc("mcp_queue_rejected_total")
+        try:
+            request.settimeout(1)
+            request.sendall(BUSY_RESPONSE)
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            self.close_request(request)
+            return
+        # Closing with the request still unread would reset the connection and could
+        # destroy the 503 before the client reads it
+        self.rejected.put(request)
+
+    def _linger(self):
+        """Read and discard what clients answered "busy" still send, until they close or BUSY_LINGER passes"""
+        draining = {}  # socket -> deadline
+        while True:
+            try:
+                while True:
+                    request = self.rejected.get(timeout=None if not draining else 0.1)
+                    if request is None:
+                        return
+                    if len(draining) >= BUSY_LINGER_MAX:
+                        self.close_request(request)
+                    else:
+                        request.setblocking(False)
+                        draining[request] = time.monotonic() + BUSY_LINGER
+                    if self.rejected.empty():
+                        break
+            except queue.Empty:
+                pass
+            try:
+                readable, _, _ = select.select(list(draining), [], [], 0)
+            except (OSError, ValueError):
+                readable = list(draining)  # let recv() sort out which one went bad
+            now = time.monotonic()
+            for request in list(draining):
+                done = now >= draining[request]
+                if request in readable:
+                    try:
+                        done = done or not request.recv(65536)
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        done = True
+                if done:
+                    del draining[request]
+                    self.close_request(request)
+
+    def _worker(self):
+        while True:
+            request, client_address = self.pending.get()
+            if request is None:
+                break
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.capacity.release()
+
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            self.pending.put((None, None))
+        self.rejected.put(None)
+
+
+def format_labels(labels):
+    """Prometheus label set for a ((name, value), ...) tuple"""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """Counters, gauges and latency histograms, rendered for /metrics in Prometheus text format"""
+
+    def __init__(self, buckets=METRICS_BUCKETS, max_endpoints=METRICS_MAX_ENDPOINTS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.max_endpoints = max_endpoints
+        self.endpoints = set()
+        self.kinds = {}   # name -> (type, help), in the order they are rendered
+        self.series = {}  # name -> {sorted label tuple -> value}; histograms hold [bucket counts, sum, count]
+
+    def define(self, name, kind, text):
+        self.kinds[name] = (kind, text)
+        self.series[name] = {}
+
+    def endpoint(self, path, status=None):
+        """Label for a request path; unknown paths are folded together so the label set stays bounded"""
+        with self.lock:
+            if path in self.endpoints:
+                return path
+            if status == 404 or len(self.endpoints) >= self.max_endpoints:
+                return "other"
+            self.endpoints.add(path)
+            return path
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.series[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            value = series.get(key)
+            if value is None:
+                value = series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            value[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            value[1] += seconds
+            value[2] += 1
+
+    def render(self):
+        lines = []
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        with self.lock:
+            for name, (kind, text) in self.kinds.items():
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self.series[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{format_labels(key)} {value}")
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, n in zip(bounds, counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(key)} {round(total, 6)}")
+                    lines.append(f"{name}_count{format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+METRICS.define("mcp_requests_total", "counter", "Requests handled, by endpoint, method and status")
+METRICS.define("mcp_request_duration_seconds", "histogram", "Time from reading the request line to the end of the response")
+METRICS.define("mcp_encode_duration_seconds", "histogram", "Time spent encoding and compressing JSON replies")
+METRICS.define("mcp_request_bytes_total", "counter", "Request body bytes received, as sent on the wire")
+METRICS.define("mcp_response_bytes_total", "counter", "Response bytes sent, headers included")
+METRICS.define("mcp_requests_in_flight", "gauge", "Requests being handled by a worker")
+METRICS.define("mcp_requests_queued", "gauge", "Accepted connections waiting for a worker")
+METRICS.define("mcp_queue_rejected_total", "counter", "Connections answered busy because the queue was full")
+METRICS.define("mcp_mux_rejected_total", "counter", "Mux streams answered busy because their connection was full")
+METRICS.define("mcp_limit_rejected_total", "counter", "Requests answered busy by a per-endpoint limit")
+METRICS.define("mcp_errors_total", "counter", "Error replies and failed requests, by endpoint and exception type")
+METRICS.define("mcp_subprocess_spawn_seconds", "histogram", "Time to start a subprocess")
+METRICS.define("mcp_subprocess_run_seconds", "histogram", "Subprocess run time, from start to exit")
+METRICS.define("mcp_processes_killed_total", "counter",
+               "Processes killed with their command's tree, by reason (timeout, disconnect, cancel, kill)")
+METRICS.define("mcp_start_time_seconds", "gauge", "Unix time the server started")
+METRICS.set("mcp_start_time_seconds", round(time.time(), 3))
+METRICS.set("mcp_requests_in_flight", 0)
+
+
+# Windows job objects, through ctypes so the server stays a single stdlib file
+CREATE_SUSPENDED = 0x4
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+JOB_BASIC_ACCOUNTING = 1  # JOBOBJECTINFOCLASS values
+JOB_PROCESS_ID_LIST = 3
+JOB_EXTENDED_LIMITS = 9
+
+if os.name == "nt":
+    class JOBOBJECT_BASIC_ACCOUNTING_INFORMATION(ctypes.Structure):
+        _fields_ = [("TotalUserTime", ctypes.c_int64), ("TotalKernelTime", ctypes.c_int64),
+                    ("ThisPeriodTotalUserTime", ctypes.c_int64), ("ThisPeriodTotalKernelTime", ctypes.c_int64),
+                    ("TotalPageFaultCount", wintypes.DWORD), ("TotalProcesses", wintypes.DWORD),
+                    ("ActiveProcesses", wintypes.DWORD), ("TotalTerminatedProcesses", wintypes.DWORD)]
+
+    class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [("PerProcessUserTimeLimit", ctypes.c_int64), ("PerJobUserTimeLimit", ctypes.c_int64),
+                    ("LimitFlags", wintypes.DWORD), ("MinimumWorkingSetSize", ctypes.c_size_t),
+                    ("MaximumWorkingSetSize", ctypes.c_size_t), ("ActiveProcessLimit", wintypes.DWORD),
+                    ("Affinity", ctypes.c_size_t), ("PriorityClass", wintypes.DWORD),
+                    ("SchedulingClass", wintypes.DWORD)]
+
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_uint64) for name in (
+            "ReadOperationCount", "WriteOperationCount", "OtherOperationCount",
+            "ReadTransferCount", "WriteTransferCount", "OtherTransferCount")]
+
+    class JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [("BasicLimitInformation", JOBOBJECT_BASIC_LIMIT_INFORMATION), ("IoInfo", IO_COUNTERS),
+                    ("ProcessMemoryLimit", ctypes.c_size_t), ("JobMemoryLimit", ctypes.c_size_t),
+                    ("PeakProcessMemoryUsed", ctypes.c_size_t), ("PeakJobMemoryUsed", ctypes.c_size_t)]
+
+    class JOBOBJECT_BASIC_PROCESS_ID_LIST(ctypes.Structure):
+        _fields_ = [("NumberOfAssignedProcesses", wintypes.DWORD), ("NumberOfProcessIdsInList", wintypes.DWORD),
+                    ("ProcessIdList", ctypes.c_size_t * 1024)]
+
+    KERNEL32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    KERNEL32.CreateJobObjectW.restype = wintypes.HANDLE
+    KERNEL32.CreateJobObjectW.argtypes = (wintypes.LPVOID, wintypes.LPCWSTR)
+    KERNEL32.AssignProcessToJobObject.argtypes = (wintypes.HANDLE, wintypes.HANDLE)
+    KERNEL32.TerminateJobObject.argtypes = (wintypes.HANDLE, wintypes.UINT)
+    KERNEL32.QueryInformationJobObject.argtypes = (wintypes.HANDLE, ctypes.c_int, wintypes.LPVOID,
+                                                   wintypes.DWORD, wintypes.LPDWORD)
+    KERNEL32.OpenProcess.restype = wintypes.HANDLE
+    KERNEL32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    KERNEL32.QueryFullProcessImageNameW.argtypes = (wintypes.HANDLE, wintypes.DWORD, wintypes.LPWSTR,
+                                                    wintypes.PDWORD)
+    KERNEL32.CloseHandle.argtypes = (wintypes.HANDLE,)
+    NTDLL = ctypes.WinDLL("ntdll")
+    NTDLL.NtResumeProcess.argtypes = (wintypes.HANDLE,)
+
+
+class JobObject:
+    """A Windows job object: every process a command starts lands in it and can be killed at once"""
+
+    def __init__(self):
+        self.handle = KERNEL32.CreateJobObjectW(None, None)
+        if not self.handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def assign(self, process_handle):
+        if not KERNEL32.AssignProcessToJobObject(self.handle, int(process_handle)):
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def query(self, info_class, info):
+        # Fails with ERROR_MORE_DATA when the pid list is full, but what fits is filled in
+        KERNEL32.QueryInformationJobObject(self.handle, info_class, ctypes.byref(info), ctypes.sizeof(info), None)
+        return info
+
+    def pids(self):
+        info = self.query(JOB_PROCESS_ID_LIST, JOBOBJECT_BASIC_PROCESS_ID_LIST())
+        return list(info.ProcessIdList[:info.NumberOfProcessIdsInList])
+
+    def terminate(self):
+        KERNEL32.TerminateJobObject(self.handle, 1)
+
+    def usage(self):
+        basic = self.query(JOB_BASIC_ACCOUNTING, JOBOBJECT_BASIC_ACCOUNTING_INFORMATION())
+        limits = self.query(JOB_EXTENDED_LIMITS, JOBOBJECT_EXTENDED_LIMIT_INFORMATION())
+        return {
+            "cpu_user": round(basic.TotalUserTime / 1e7, 3),  # 100 ns units
+            "cpu_system": round(basic.TotalKernelTime / 1e7, 3),
+            "peak_memory_bytes": limits.PeakJobMemoryUsed,
+            "processes": basic.TotalProcesses,
+        }
+
+    def close(self):
+        if self.handle:
+            KERNEL32.CloseHandle(self.handle)
+            self.handle = None
+
+
+def windows_process_name(pid):
+    handle = KERNEL32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        return None
+    try:
+        size = wintypes.DWORD(1024)
+        buf = ctypes.create_unicode_buffer(size.value)
+        if KERNEL32.QueryFullProcessImageNameW(handle, 0, buf, ctypes.byref(size)):
+            return os.path.basename(buf.value)
+        return None
+    finally:
+        KERNEL32.CloseHandle(handle)
+
+
+def group_members(pgid):
+    """[{"pid", "name"}] of the live processes in process group pgid; None where there is no /proc"""
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    members = []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                raw = f.read()
+        except OSError:
+            continue
+        # The name is in parentheses and may itself contain spaces or parentheses
+        name_end = raw.rfind(b")")
+        fields = raw[name_end + 2:].split()
+        if len(fields) > 2 and fields[0] != b"Z" and int(fields[2]) == pgid:
+            name = raw[raw.find(b"(") + 1:name_end].decode(errors="replace")
+            members.append({"pid": int(entry), "name": name})
+    return members
+
+
+class TreeProcess(subprocess.Popen):
+    """Popen whose kill() takes down the command and everything it started
+
+    On POSIX the command leads a new process group; on Windows it starts suspended and
+    runs only once it is inside a job object, so no child can slip out. Both account for
+    the tree's CPU time and memory, see usage().
+    """
+
+    def __init__(self, args, **kwargs):
+        self.job = None
+        self.rusage = None
+        self.killed = []  # [{"pid", "name"}] taken down by kill()
+        if os.name != "nt":
+            kwargs.setdefault("start_new_session", True)
+            super().__init__(args, **kwargs)
+            return
+        kwargs["creationflags"] = kwargs.get("creationflags", 0) | CREATE_SUSPENDED
+        super().__init__(args, **kwargs)
+        try:
+            job = JobObject()
+            weakref.finalize(self, job.close)
+            job.assign(self._handle)
+            self.job = job
+        except OSError:
+            pass  # e.g. nested jobs before Windows 8: kill() falls back to taskkill /T
+        finally:
+            NTDLL.NtResumeProcess(int(self._handle))
+
+    def kill(self, reason="kill"):
+        """Kill every process of the tree; returns those that were still running"""
+        if self.job is not None:
+            killed = [{"pid": pid, "name": windows_process_name(pid)} for pid in self.job.pids()]
+            self.job.terminate()
+        elif os.name == "nt":
+            killed = [{"pid": self.pid, "name": None}] if self.poll() is None else []
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(self.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            killed = group_members(self.pid)
+            if killed is None:
+                killed = [{"pid": self.pid, "name": None}] if self.poll() is None else []
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except OSError:
+                pass  # the whole group has already exited
+        if killed:
+            self.killed.extend(killed)
+            METRICS.inc("mcp_processes_killed_total", len(killed), reason=reason)
+        return killed
+
+    def usage(self):
+        """CPU seconds and memory of the tree, once the OS reports them
+
+        Job objects give the tree's real peak_memory_bytes. On POSIX there is only
+        max_rss_bytes, an upper bound: see below.
+        """
+        if self.job is not None:
+            return self.job.usage()
+        if self.rusage is None:
+            return {}
+        # ru_maxrss is the largest single process, in KB on Linux and bytes on macOS. The child
+        # starts as a fork of this server and the server's pages count towards it until exec,
+        # so a small command reports roughly the server's own RSS.
+        scale = 1 if sys.platform == "darwin" else 1024
+        return {
+            "cpu_user": round(self.rusage.ru_utime, 3),
+            "cpu_system": round(self.rusage.ru_stime, 3),
+            "max_rss_bytes": self.rusage.ru_maxrss * scale,
+        }
+
+    def report(self):
+        """usage() and the processes kill() took down, to merge into a command's result"""
+        report = {"usage": self.usage()}
+        if self.killed:
+            report["killed"] = self.killed
+        return report
+
+    if os.name != "nt":
+        # Reap with wait4() instead of waitpid() so the child's resource usage is kept
+
+        def _wait4(self, pid, flags):
+            pid, status, rusage = os.wait4(pid, flags)
+            if pid == self.pid:
+                self.rusage = rusage
+            return pid, status
+
+        def _try_wait(self, wait_flags):
+            try:
+                return self._wait4(self.pid, wait_flags)
+            except ChildProcessError:
+                return self.pid, 0
+
+        def _internal_poll(self, _deadstate=None, **kwargs):
+            kwargs["_waitpid"] = self._wait4
+            return super()._internal_poll(_deadstate, **kwargs)
+
+
+def kill_reason(error):
+    """The mcp_processes_killed_total reason for a command abandoned because of error"""
+    if isinstance(error, subprocess.TimeoutExpired):
+        return "timeout"
+    if isinstance(error, (ConnectionError, GeneratorExit)):
+        return "disconnect"
+    return "error"
+
+
+def wait_slice(deadline, gone=None):
+    """Seconds to block before looking at the deadline, and at gone() if given, again"""
+    remaining = max(deadline - time.monotonic(), 0)
+    return min(remaining, DISCONNECT_POLL) if gone is not None else remaining
+
+
+def spawn(kind, *args, **kwargs):
+    """Start a TreeProcess, timing the start for /metrics"""
+    started = time.monotonic()
+    proc = TreeProcess(*args, **kwargs)
+    METRICS.observe("mcp_subprocess_spawn_seconds", time.monotonic() - started, kind=kind)
+    return proc
+
+
+class ProcessRegistry:
+    """Tracks running subprocesses by the X-Request-Id of the request that started them"""
+
+    MAX_CANCELLED = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}  # request id -> set of Popen
+        self.cancelled = OrderedDict()  # ids cancelled, possibly before their process started
+
+    def register(self, request_id, proc):
+        """Track proc; returns False (and kills it) if its request was already cancelled"""
+        with self.lock:
+            if request_id in self.cancelled:
+                proc.kill("cancel")
+                return False
+            self.running.setdefault(request_id, set()).add(proc)
+            return True
+
+    def unregister(self, request_id, proc):
+        with self.lock:
+            procs = self.running.get(request_id)
+            if procs is not None:
+                procs.discard(proc)
+                if not procs:
+                    del self.running[request_id]
+
+    def is_cancelled(self, request_id):
+        with self.lock:
+            return request_id in self.cancelled
+
+    def cancel(self, request_id):
+        """Kill the process trees started for request_id; returns [{"pid", "name"}] of those killed"""
+        with self.lock:
+            self.cancelled[request_id] = True
+            while len(self.cancelled) > self.MAX_CANCELLED:
+                self.cancelled.popitem(last=False)
+            procs = list(self.running.get(request_id, ()))
+        killed = []
+        for proc in procs:
+            try:
+                killed.extend(proc.kill("cancel"))
+            except OSError:
+                pass
+        return killed
+
+
+PROCESSES = ProcessRegistry()
+
+
+def run_command(args, shell=False, timeout=300, request_id=None, gone=None):
+    """Run a command to completion, returning (returncode, stdout, stderr, cancelled, report)
+
+    The process tree is killed on timeout, raising TimeoutExpired with the report attached,
+    and once gone() says the client disconnected, raising ConnectionAbortedError.
+    """
+    proc = spawn("command", args, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    started = time.monotonic()
+    deadline = started + timeout
+    if request_id:
+        PROCESSES.register(request_id, proc)
+    try:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=wait_slice(deadline, gone))
+                break
+            except subprocess.TimeoutExpired:
+                if time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(args, timeout)
+                if gone is not None and gone():
+                    raise ConnectionAbortedError("Client disconnected")
+    except BaseException as e:
+        proc.kill(kill_reason(e))
+        proc.communicate()
+        e.report = proc.report()
+        raise
+    finally:
+        METRICS.observe("mcp_subprocess_run_seconds", time.monotonic() - started, kind="command")
+        if request_id:
+            PROCESSES.unregister(request_id, proc)
+    cancelled = bool(request_id) and PROCESSES.is_cancelled(request_id)
+    return proc.returncode, stdout, stderr, cancelled, proc.report()
+
+
+class CommandStream:
+    """Runs a command and yields (stream, text) as the process produces output"""
+
+    CHUNK = 65536
+
+    def __init__(self, args, shell=False, timeout=300, request_id=None, gone=None):
+        self.args = args
+        self.shell = shell
+        self.timeout = timeout
+        self.request_id = request_id
+        self.gone = gone
+        self.returncode = None
+        self.cancelled = False
+        self.report = {}  # usage and killed processes, see TreeProcess.report()
+
+    @staticmethod
+    def _pump(name, pipe, events):
+        try:
+            while True:
+                data = pipe.read(CommandStream.CHUNK)
+                if not data:
+                    break
+                events.put((name, data))
+        finally:
+            events.put((name, None))
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.timeout
+        # Decode like subprocess text mode, but incrementally so nothing accumulates
+        encoding = locale.getpreferredencoding(False)
+        decoders = {
+            "stdout": codecs.getincrementaldecoder(encoding)(errors="replace"),
+            "stderr": codecs.getincrementaldecoder(encoding)(errors="replace"),
+        }
+        proc = spawn("stream", self.args, shell=self.shell, bufsize=0,
+                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        started = time.monotonic()
+        if self.request_id:
+            PROCESSES.register(self.request_id, proc)
+        events = queue.Queue()
+        for name, pipe in (("stdout", proc.stdout), ("stderr", proc.stderr)):
+            threading.Thread(target=self._pump, args=(name, pipe, events), daemon=True).start()
+        try:
+            open_streams = 2
+            while open_streams:
+                try:
+                    name, data = events.get(timeout=wait_slice(deadline, self.gone))
+                except queue.Empty:
+                    if time.monotonic() >= deadline:
+                        raise subprocess.TimeoutExpired(self.args, self.timeout)
+                    if self.gone is not None and self.gone():
+                        raise ConnectionAbortedError("Client disconnected")
+                    continue
+                if data is None:
+                    open_streams -= 1
+                    text = decoders[name].decode(b"", final=True)
+                else:
+                    text = decoders[name].decode(data)
+                if text:
+                    yield name, text
+            self.returncode = proc.wait(timeout=max(deadline - time.monotonic(), 0))
+        except BaseException as e:
+            # Timed out, or the client went away (a failed write closed this generator)
+            proc.kill(kill_reason(e))
+            raise
+        finally:
+            proc.wait()
+            METRICS.observe("mcp_subprocess_run_seconds", time.monotonic() - started, kind="stream")
+            proc.stdout.close()
+            proc.stderr.close()
+            self.report = proc.report()
+            if self.request_id:
+                PROCESSES.unregister(self.request_id, proc)
+                self.cancelled = PROCESSES.is_cancelled(self.request_id)
+
+
+class OutputShaper:
+    """Cuts command output down to a line range, matching lines and a head+tail byte budget"""
+
+    OPTIONS = ("max_bytes", "lines", "include", "exclude", "collapse", "spill")
+
+    def __init__(self, max_bytes=None, lines=None, include=None, exclude=None, collapse=False, spill=False):
+        if max_bytes is not None and (not isinstance(max_bytes, int) or max_bytes < 1):
+            raise ValueError("max_bytes must be a positive integer")
+        if lines is not None:
+            if (not isinstance(lines, (list, tuple)) or len(lines) != 2
+                    or not all(n is None or isinstance(n, int) for n in lines)):
+                raise ValueError("lines must be [start, end]; 1-based, negative counts from the end")
+        try:
+            self.include = re.compile(include) if include else None
+            self.exclude = re.compile(exclude) if exclude else None
+        except re.error as e:
+            raise ValueError(f"Bad regex: {e}")
+        self.max_bytes = max_bytes
+        self.lines = lines
+        self.collapse = collapse
+        self.spill = spill
+        self.live_partial = {}
+        self.live_sent = {}
+
+    @classmethod
+    def from_request(cls, data):
+        """The shaper for an /exec or /powershell body, or None if it asks for no shaping"""
+        options = {k: data[k] for k in cls.OPTIONS if data.get(k) not in (None, False, "")}
+        return cls(**options) if options else None
+
+    def keep(self, line):
+        if self.include is not None and not self.include.search(line):
+            return False
+        return self.exclude is None or not self.exclude.search(line)
+
+    def live(self, name, text):
+        """Matching whole lines of a streamed chunk, until max_bytes of them were sent"""
+        pieces = (self.live_partial.pop(name, "") + text).splitlines(True)
+        if pieces and not pieces[-1].endswith(("\n", "\r")):
+            self.live_partial[name] = pieces.pop()
+        return self._budget(name, pieces)
+
+    def live_end(self, name):
+        """Whatever live() still holds back for stream name once it has ended"""
+        return self._budget(name, [self.live_partial.pop(name, "")])
+
+    def _budget(self, name, pieces):
+        out = []
+        for line in pieces:
+            if not line or not self.keep(line):
+                continue
+            sent = self.live_sent.get(name, 0)
+            if self.max_bytes is not None and sent >= self.max_bytes:
+                break
+            self.live_sent[name] = sent + len(line)
+            out.append(line)
+        return "".join(out)
+
+    def select(self, lines):
+        """Apply the line range, filters and collapsing; returns the kept lines"""
+        if self.lines is not None:
+            start, end = self.lines
+            total = len(lines)
+            start = 1 if start is None else (total + 1 + start if start < 0 else start)
+            end = total if end is None else (total + 1 + end if end < 0 else end)
+            lines = lines[max(start, 1) - 1:max(end, 0)]
+        if self.include is not None or self.exclude is not None:
+            lines = [line for line in lines if self.keep(line)]
+        if not self.collapse:
+            return lines
+        kept, previous, repeats = [], None, 0
+        for line in lines + [None]:
+            if line is not None and previous is not None and line.rstrip("\r\n") == previous.rstrip("\r\n"):
+                repeats += 1
+                continue
+            if repeats:
+                kept.append(f"[previous line repeated {repeats} more times]\n")
+            if line is not None:
+                kept.append(line)
+            previous, repeats = line, 0
+        return kept
+
+    def truncate(self, text):
+        """Keep the first and last max_bytes/2 bytes of text, preferring line boundaries"""
+        data = text.encode("utf-8")
+        if self.max_bytes is None or len(data) <= self.max_bytes:
+            return text, 0
+        head, tail = data[:self.max_bytes // 2], data[len(data) - (self.max_bytes - self.max_bytes // 2):]
+        cut = head.rfind(b"\n")
+        if cut >= len(head) // 2:
+            head = head[:cut + 1]
+        cut = tail.find(b"\n")
+        if 0 <= cut < len(tail) // 2:
+            tail = tail[cut + 1:]
+        omitted = len(data) - len(head) - len(tail)
+        marker = ("" if head.endswith(b"\n") else "\n") + f"... [{omitted} bytes omitted] ...\n"
+        return head.decode("utf-8", "ignore") + marker + tail.decode("utf-8", "ignore"), omitted
+
+    def write_spill(self, name, text):
+        os.makedirs(OUTPUT_SPILL_DIR, exist_ok=True)
+        cutoff = time.time() - OUTPUT_SPILL_TTL
+        for entry in os.scandir(OUTPUT_SPILL_DIR):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        path = os.path.join(OUTPUT_SPILL_DIR, f"{uuid.uuid4().hex[:12]}.{name}.txt")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        return path
+
+    def apply(self, name, text):
+        """Return (shaped text, stats) for the full output of stream name"""
+        lines = text.splitlines(True)
+        kept = self.select(lines)
+        shaped, omitted = self.truncate("".join(kept))
+        stats = {
+            "bytes": len(text.encode("utf-8")),
+            "lines": len(lines),
+            "selected_lines": len(kept),
+            "omitted_bytes": omitted,
+        }
+        if self.spill and shaped != text:
+            stats["spill"] = self.write_spill(name, text)
+        return shaped, stats
+
+    def result(self, result):
+        """Shape the stdout and stderr of a command result in place"""
+        result["shaped"] = {}
+        for name in ("stdout", "stderr"):
+            result[name], result["shaped"][name] = self.apply(name, result[name] or "")
+        return result
+
+
+def frame_sh(cmd, token):
+    # A subshell keeps cd/variables from leaking to the next caller
+    quoted = "'" + cmd.replace("'", "'\\''") + "'"
+    return (
+        f"( eval {quoted} ) </dev/null\n"
+        f"__mcp_rc=$?\n"
+        f"printf '__MCP_{token}_RC_%d__' \"$__mcp_rc\"\n"
+        f"printf '__MCP_{token}__' >&2\n"
+    )
+
+
+def frame_powershell(cmd, token):
+    # Sent as one line so the interpreter reading stdin runs it as a single statement;
+    # the scriptblock gets its own variable scope and Push/Pop-Location restores the cwd
+    script = base64.b64encode(cmd.encode("utf-8")).decode()
+    return (
+        "$global:LASTEXITCODE = 0; $__mcp_ok = $true; Push-Location; "
+        "try { & ([scriptblock]::Create([Text.Encoding]::UTF8.GetString("
+        f"[Convert]::FromBase64String('{script}')))); $__mcp_ok = $? }} "
+        "catch { $__mcp_ok = $false; [Console]::Error.WriteLine($_.ToString()) } "
+        "finally { Pop-Location }; "
+        "$__mcp_rc = if ($LASTEXITCODE) { $LASTEXITCODE } elseif ($__mcp_ok) { 0 } else { 1 }; "
+        f"[Console]::Out.Write('__MCP_{token}_RC_' + $__mcp_rc + '__'); "
+        f"[Console]::Error.Write('__MCP_{token}__')\n"
+    )
+
+
+def frame_cmd(cmd, token, cwd):
+    # cmd.exe has no subshell: reset the working directory before every command
+    return (
+        f"cd /d \"{cwd}\"\n"
+        f"{cmd}\n"
+        f"echo __MCP_{token}_RC_%ERRORLEVEL%__\n"
+        f"echo __MCP_{token}__ 1>&2\n"
+    )
+
+
+class PersistentShell:
+    """A long-lived interpreter that runs commands framed with unique sentinels"""
+
+    def __init__(self, argv, dialect):
+        self.argv = argv
+        self.dialect = dialect
+        self.uses = 0
+        self.broken = False
+        self.cwd = os.getcwd()
+        self.encoding = locale.getpreferredencoding(False)
+        self.proc = spawn("shell", argv, bufsize=0, stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.events = queue.Queue()
+        for name, pipe in (("stdout", self.proc.stdout), ("stderr", self.proc.stderr)):
+            threading.Thread(target=CommandStream._pump, args=(name, pipe, self.events),
+                             daemon=True).start()
+
+    def frame(self, cmd, token):
+        if self.dialect == "powershell":
+            return frame_powershell(cmd, token).encode("ascii")
+        if self.dialect == "cmd":
+            return frame_cmd(cmd, token, self.cwd).encode(self.encoding, errors="replace")
+        return frame_sh(cmd, token).encode(self.encoding, errors="replace")
+
+    def run(self, cmd, timeout=300, gone=None):
+        """Run cmd and return (returncode, stdout, stderr); the shell is unusable after an error"""
+        self.uses += 1
+        token = uuid.uuid4().hex
+        done = {
+            "stdout": re.compile(rb"__MCP_" + token.encode() + rb"_RC_(-?\d+)__"),
+            "stderr": re.compile(rb"__MCP_" + token.encode() + rb"__"),
+        }
+        output = {"stdout": bytearray(), "stderr": bytearray()}
+        returncode = None
+        deadline = time.monotonic() + timeout
+        try:
+            self.proc.stdin.write(self.frame(cmd, token))
+            self.proc.stdin.flush()
+            while done:
+                try:
+                    name, data = self.events.get(timeout=wait_slice(deadline, gone))
+                except queue.Empty:
+                    if time.monotonic() >= deadline:
+                        raise subprocess.TimeoutExpired(cmd, timeout)
+                    if gone is not None and gone():
+                        raise ConnectionAbortedError("Client disconnected")
+                    continue
+                if data is None:
+                    # The interpreter exited (e.g. the command called exit): report its status
+                    self.broken = True
+                    done.pop(name, None)
+                    if not done:
+                        returncode = self.proc.wait()
+                    continue
+                buf = output[name]
+                buf += data
+                if name in done:
+                    match = done[name].search(buf, max(0, len(buf) - len(data) - 80))
+                    if match:
+                        if name == "stdout":
+                            returncode = int(match.group(1))
+                        if buf[match.end():].strip():
+                            self.broken = True  # stray output after the sentinel
+                        del buf[match.start():]
+                        del done[name]
+        except BaseException as e:
+            # The command may have started children of its own: take the interpreter's tree down
+            self.broken = True
+            self.proc.kill(kill_reason(e))
+            self.close()
+            e.report = {"killed": self.proc.killed} if self.proc.killed else {}
+            raise
+        return (returncode,
+                output["stdout"].decode(self.encoding, errors="replace"),
+                output["stderr"].decode(self.encoding, errors="replace"))
+
+    def alive(self):
+        return not self.broken and self.proc.poll() is None
+
+    def close(self):
+        if self.proc.poll() is None:
+            # Just the interpreter: whatever a command left running in the background stays
+            subprocess.Popen.kill(self.proc)
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class ShellPool:
+    """Warm pool of persistent interpreters for one shell binary"""
+
+    def __init__(self, argv, dialect, size, max_uses=SHELL_MAX_USES):
+        self.argv = argv
+        self.dialect = dialect
+        self.size = size
+        self.max_uses = max_uses
+        self.idle = []
+        self.lock = threading.Lock()
+        self._refill()
+
+    def _spawn(self):
+        shell = PersistentShell(self.argv, self.dialect)
+        # Warm-up command: absorbs any startup banner and proves the framing works
+        shell.run("echo ready", timeout=60)
+        return shell
+
+    def _refill(self):
+        def refill():
+            while True:
+                with self.lock:
+                    if len(self.idle) >= self.size:
+                        return
+                try:
+                    shell = self._spawn()
+                except Exception as e:
+                    print(f"[shell-pool] failed to start {self.argv[0]}: {e}")
+                    return
+                self._checkin(shell, refill=False)
+        threading.Thread(target=refill, daemon=True).start()
+
+    def _checkout(self):
+        with self.lock:
+            while self.idle:
+                shell = self.idle.pop()
+                if shell.alive():
+                    return shell
+                shell.close()
+        return self._spawn()
+
+    def _checkin(self, shell, refill=True):
+        if shell.alive() and shell.uses < self.max_uses:
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(shell)
+                    return
+        shell.close()
+        if refill:
+            self._refill()
+
+    def run(self, cmd, timeout=300, request_id=None, gone=None):
+        """Run cmd on a pooled interpreter, returning (returncode, stdout, stderr, cancelled, report)
+
+        The interpreter's resource usage spans many commands, so the report only lists the
+        processes killed when the command was cancelled.
+        """
+        shell = self._checkout()
+        started = time.monotonic()
+        if request_id:
+            PROCESSES.register(request_id, shell.proc)
+        try:
+            returncode, stdout, stderr = shell.run(cmd, timeout, gone)
+        finally:
+            METRICS.observe("mcp_subprocess_run_seconds", time.monotonic() - started, kind="pooled")
+            if request_id:
+                PROCESSES.unregister(request_id, shell.proc)
+            self._checkin(shell)
+        cancelled = bool(request_id) and PROCESSES.is_cancelled(request_id)
+        return returncode, stdout, stderr, cancelled, {"killed": shell.proc.killed} if shell.proc.killed else {}
+
+
+SHELL_POOLS = {}  # endpoint -> ShellPool, filled by start_shell_pools()
+
+
+def start_shell_pools(size):
+    """Keep `size` warm interpreters each for /exec and /powershell"""
+    if os.name == "nt":
+        SHELL_POOLS["/exec"] = ShellPool([os.environ.get("COMSPEC", "cmd.exe"), "/Q"], "cmd", size)
+    else:
+        SHELL_POOLS["/exec"] = ShellPool(["/bin/sh"], "sh", size)
+    SHELL_POOLS["/powershell"] = ShellPool(
+        [POWERSHELL[0], "-NoProfile", "-NonInteractive", "-ExecutionPolicy", "Bypass", "-Command", "-"],
+        "powershell", size)
+
+
+class RingBuffer:
+    """Keeps the last `capacity` bytes of a stream, addressed by absolute offset"""
+
+    def __init__(self, capacity=JOB_BUFFER_BYTES, spill_path=None):
+        self.capacity = capacity
+        self.data = bytearray()
+        self.start = 0  # absolute offset of data[0]
+        self.lock = threading.Lock()
+        self.spill_path = spill_path
+        # With a spill file every byte is kept on disk and old offsets stay readable
+        self.spill = open(spill_path, "wb") if spill_path else None
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def write(self, chunk):
+        with self.lock:
+            if self.spill is not None:
+                self.spill.write(chunk)
+                self.spill.flush()
+            self.data += chunk
+            if len(self.data) > self.capacity:
+                drop = len(self.data) - self.capacity
+                del self.data[:drop]
+                self.start += drop
+
+    def read(self, offset, max_bytes):
+        """Return (data, next_offset, dropped) where dropped counts bytes lost before data"""
+        with self.lock:
+            offset = max(0, min(offset, self.end))
+            if offset >= self.start:
+                i = offset - self.start
+                return bytes(self.data[i:i + max_bytes]), offset + min(max_bytes, self.end - offset), 0
+            if self.spill_path is None:
+                chunk = bytes(self.data[:max_bytes])
+                return chunk, self.start + len(chunk), self.start - offset
+        with open(self.spill_path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(max_bytes)
+        return chunk, offset + len(chunk), 0
+
+    def close(self):
+        with self.lock:
+            if self.spill is not None:
+                self.spill.close()
+                self.spill = None
+
+
+class Job:
+    """A command running detached from any request"""
+
+    def __init__(self, job_id, cmd, shell="cmd", timeout=None, spill=False):
+        self.id = job_id
+        self.cmd = cmd
+        self.shell = shell
+        self.timeout = timeout
+        self.state = "starting"
+        self.returncode = None
+        self.started = time.time()
+        self.ended = None
+        self.done = threading.Event()
+        spill_dir = None
+        if spill:
+            os.makedirs(JOB_SPILL_DIR, exist_ok=True)
+            spill_dir = JOB_SPILL_DIR
+        self.buffers = {
+            name: RingBuffer(spill_path=os.path.join(spill_dir, f"{job_id}.{name}") if spill_dir else None)
+            for name in ("stdout", "stderr")
+        }
+        if shell == "powershell":
+            args, use_shell = POWERSHELL + [cmd], False
+        else:
+            args, use_shell = cmd, True
+        try:
+            self.proc = spawn("job", args, shell=use_shell, bufsize=0, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except Exception:
+            for buffer in self.buffers.values():
+                buffer.close()
+            raise
+        self.state = "running"
+        self.pumps = [
+            threading.Thread(target=self._pump, args=(self.proc.stdout, self.buffers["stdout"]), daemon=True),
+            threading.Thread(target=self._pump, args=(self.proc.stderr, self.buffers["stderr"]), daemon=True),
+        ]
+        for t in self.pumps:
+            t.start()
+        threading.Thread(target=self._wait, daemon=True).start()
+
+    @staticmethod
+    def _pump(pipe, buffer):
+        try:
+            while True:
+                data = pipe.read(CommandStream.CHUNK)
+                if not data:
+                    break
+                buffer.write(data)
+        finally:
+            pipe.close()
+
+    def _wait(self):
+        try:
+            try:
+                self.returncode = self.proc.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self.state = "timeout"
+                self.proc.kill("timeout")
+                self.returncode = self.proc.wait()
+            METRICS.observe("mcp_subprocess_run_seconds", time.time() - self.started, kind="job")
+            for t in self.pumps:
+                t.join()
+            for buffer in self.buffers.values():
+                buffer.close()
+        finally:
+            # A job must never look "running" forever, whatever went wrong above
+            if self.state == "running":
+                self.state = "exited" if self.returncode is not None else "failed"
+            self.ended = time.time()
+            self.done.set()
+
+    def kill(self):
+        # The shell may be gone while its children still hold the output pipes
+        if not self.done.is_set():
+            self.state = "killed"
+            self.proc.kill()
+
+    def output(self, stdout_offset=0, stderr_offset=0, max_bytes=65536):
+        encoding = locale.getpreferredencoding(False)
+        result = {}
+        for name, offset in (("stdout", stdout_offset), ("stderr", stderr_offset)):
+            chunk, next_offset, dropped = self.buffers[name].read(offset, max_bytes)
+            result[name] = chunk.decode(encoding, errors="replace")
+            result[f"{name}_offset"] = next_offset
+            result[f"{name}_dropped"] = dropped
+        return result
+
+    def status(self):
+        end = self.ended or time.time()
+        status = {
+            "id": self.id,
+            "cmd": self.cmd,
+            "shell": self.shell,
+            "pid": self.proc.pid,
+            "state": self.state,
+            "running": not self.done.is_set(),
+            "returncode": self.returncode,
+            "started": self.started,
+            "ended": self.ended,
+            "runtime": round(end - self.started, 3),
+            "stdout_bytes": self.buffers["stdout"].end,
+            "stderr_bytes": self.buffers["stderr"].end,
+        }
+        spill = {name: b.spill_path for name, b in self.buffers.items() if b.spill_path}
+        if spill:
+            status["spill"] = spill
+        if self.done.is_set():
+            status.update(self.proc.report())
+        return status
+
+
+class JobManager:
+    """Starts, tracks and prunes background jobs"""
+
+    def __init__(self, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, cmd, shell="cmd", timeout=None, spill=False):
+        job = Job(uuid.uuid4().hex[:12], cmd, shell, timeout, spill)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"No such job: {job_id}")
+        return job
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j.done.is_set()]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job.id]
+            for buffer in job.buffers.values():
+                if buffer.spill_path:
+                    try:
+                        os.remove(buffer.spill_path)
+                    except OSError:
+                        pass
+
+
+JOBS = JobManager()
+
+
+COMPRESS_WBITS = {"gzip": 31, "deflate": 15}
+
+
+def int_option(data, key, default, minimum=0):
+    """data[key] as an int of at least minimum (None when absent and default is None)"""
+    value = data.get(key, default)
+    if value is None and default is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"{key} must be an integer >= {minimum}")
+    return value
+
+
+def number_option(data, key, default, minimum=0):
+    """data[key] as a number of at least minimum (None when absent and default is None)"""
+    value = data.get(key, default)
+    if value is None and default is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise ValueError(f"{key} must be a number >= {minimum}")
+    return value
+
+
+def choose_encoding(accept_encoding):
+    """Pick gzip or deflate from an Accept-Encoding header, or None"""
+    offered = {}
+    for item in (accept_encoding or "").lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                pass
+        offered[name.strip()] = q
+    for encoding in ("gzip", "deflate"):
+        if offered.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+class UnsupportedEncodingError(ValueError):
+    """The request body uses a Content-Encoding we cannot undo"""
+
+
+def compress(data, encoding):
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class UploadOffsetError(Exception):
+    """A chunk did not start at or before the end of the data received so far"""
+
+    def __init__(self, offset):
+        super().__init__(f"Chunk is past the end of the upload, resume at offset {offset}")
+        self.offset = offset
+
+
+class UploadVerifyError(Exception):
+    """The committed upload does not match the expected size or hash"""
+
+
+class UploadManager:
+    """Resumable uploads written to <path>.<id>.part and renamed into place on commit"""
+
+    def __init__(self):
+        self.sessions = {}  # upload id -> (destination path, part path, lock)
+        self.lock = threading.Lock()
+
+    def open(self, path, upload_id=None):
+        """Start or resume an upload; returns (upload id, bytes already received)"""
+        if not path:
+            raise ValueError("path is required")
+        upload_id = upload_id or uuid.uuid4().hex
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", upload_id):
+            raise ValueError("upload_id may only contain letters, digits, '-' and '_'")
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        part = f"{path}.{upload_id}.part"
+        # Reopening with the same id picks up an existing part file, even after a restart
+        with open(part, "ab") as f:
+            offset = f.tell()
+        with self.lock:
+            self.sessions[upload_id] = (path, part, threading.Lock())
+        return upload_id, offset
+
+    def _get(self, upload_id):
+        with self.lock:
+            session = self.sessions.get(upload_id)
+        if session is None:
+            raise KeyError(f"No such upload: {upload_id} (open it again to resume)")
+        return session
+
+    def status(self, upload_id):
+        _, part, _ = self._get(upload_id)
+        return os.path.getsize(part)
+
+    def write(self, upload_id, offset, pieces):
+        """Write pieces at offset; returns the new size of the part file"""
+        _, part, lock = self._get(upload_id)
+        with lock:
+            with open(part, "r+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                if offset > size:
+                    raise UploadOffsetError(size)
+                f.seek(offset)
+                for piece in pieces:
+                    f.write(piece)
+                return max(size, f.tell())
+
+    def commit(self, upload_id, sha256=None, size=None):
+        """Verify the part file and atomically rename it over the destination"""
+        path, part, lock = self._get(upload_id)
+        with lock:
+            digest = hashlib.sha256()
+            with open(part, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+                actual = f.tell()
+                os.fsync(f.fileno())
+            if size is not None and actual != size:
+                raise UploadVerifyError(f"Size mismatch: received {actual} bytes, expected {size}")
+            if sha256 and digest.hexdigest() != sha256.lower():
+                # The data is bad; start over rather than resume on top of it
+                remove_quietly(part)
+                with self.lock:
+                    self.sessions.pop(upload_id, None)
+                raise UploadVerifyError(f"sha256 mismatch: received {digest.hexdigest()}, expected {sha256}")
+            os.replace(part, path)
+            with self.lock:
+                self.sessions.pop(upload_id, None)
+        return path, actual, digest.hexdigest()
+
+    def abort(self, upload_id):
+        _, part, lock = self._get(upload_id)
+        with lock:
+            remove_quietly(part)
+            with self.lock:
+                self.sessions.pop(upload_id, None)
+
+
+UPLOADS = UploadManager()
+
+
+class DirectoryListing:
+    """Lists a directory with os.scandir, optionally recursively, filtered, sorted and paged.
+
+    Iterating yields /ls items; afterwards next_cursor is set if more items remain
+    and errors holds subdirectories that could not be read.
+    """
+
+    SORT_KEYS = {
+        "name": lambda item: item["name"].lower(),
+        "size": lambda item: item.get("size", -1),
+        "mtime": lambda item: item.get("mtime", 0),
+        "type": lambda item: (item["type"], item["name"].lower()),
+    }
+
+    def __init__(self, path, recursive=False, max_depth=None, pattern=None, kind=None,
+                 min_size=None, max_size=None, modified_after=None, modified_before=None,
+                 sort=None, cursor=None, limit=None, details=False):
+        self.path = path
+        # Entry names of the top directory: set beforehand from METADATA, or by scan() when it reads it
+        self.names = None
+        self.max_depth = (max_depth if max_depth is not None else float("inf")) if recursive else 0
+        self.pattern = pattern.replace("\\", "/") if pattern else None
+        self.pattern_by_path = bool(pattern) and ("/" in pattern or "\\" in pattern)
+        self.kind = kind
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+        self.sort = sort
+        if sort and sort.lstrip("-") not in self.SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(self.SORT_KEYS)} (prefix - for descending)")
+        self.offset = self.decode_cursor(cursor) if cursor else 0
+        self.limit = limit
+        # Sorting by mtime needs it on every item
+        self.details = details or bool(sort and sort.lstrip("-") == "mtime")
+        self.next_cursor = None
+        self.errors = []
+
+    @staticmethod
+    def encode_cursor(offset):
+        return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"])
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def scan(self):
+        """Yield (relative name, DirEntry) breadth first; DirEntry caches its stat data"""
+        pending = deque([("", self.path, 0)])
+        while pending:
+            prefix, directory, depth = pending.popleft()
+            try:
+                if not prefix and self.names is not None:
+                    entries = [StatEntry(directory, name) for name in self.names]
+                else:
+                    with os.scandir(directory) as it:
+                        entries = list(it)
+                    if not prefix:
+                        self.names = [entry.name for entry in entries]
+            except OSError as e:
+                if not prefix:
+                    raise  # the requested directory itself
+                if len(self.errors) < 100:
+                    self.errors.append({"path": directory, "error": str(e)})
+                continue
+            for entry in entries:
+                name = prefix + entry.name
+                yield name, entry
+                # Symlinked directories are listed but not followed, to avoid cycles
+                if depth < self.max_depth and entry.is_dir(follow_symlinks=False):
+                    pending.append((name + os.sep, entry.path, depth + 1))
+
+    def describe(self, name, entry):
+        """Return the /ls item for entry, or None if the filters reject it"""
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        item = {"name": name, "type": "dir" if is_dir else "file"}
+        if self.kind and item["type"] != self.kind:
+            return None
+        if self.pattern and not fnmatch.fnmatch(name.replace(os.sep, "/") if self.pattern_by_path else entry.name,
+                                                self.pattern):
+            return None
+        try:
+            st = entry.stat()
+        except OSError:
+            st = None
+        if st is not None:
+            item["size"] = st.st_size
+            if self.details:
+                item["mtime"] = st.st_mtime
+        size = item.get("size")
+        if self.min_size is not None and (size is None or size < self.min_size):
+            return None
+        if self.max_size is not None and (size is None or size > self.max_size):
+            return None
+        if self.modified_after is not None or self.modified_before is not None:
+            mtime = st.st_mtime if st is not None else None
+            if mtime is None:
+                return None
+            if self.modified_after is not None and mtime < self.modified_after:
+                return None
+            if self.modified_before is not None and mtime > self.modified_before:
+                return None
+        return item
+
+    def __iter__(self):
+        items = (item for item in (self.describe(n, e) for n, e in self.scan()) if item is not None)
+        if self.sort:
+            key = self.sort.lstrip("-")
+            items = iter(sorted(items, key=self.SORT_KEYS[key], reverse=self.sort.startswith("-")))
+        for _ in range(self.offset):
+            if next(items, None) is None:
+                return
+        count = 0
+        for item in items:
+            if self.limit is not None and count >= self.limit:
+                self.next_cursor = self.encode_cursor(self.offset + count)
+                return
+            count += 1
+            yield item
+
+    def frames(self, batch=500):
+        """NDJSON frames: batches of items, then an end frame"""
+        items = []
+        count = 0
+        for item in self:
+            items.append(item)
+            count += 1
+            if len(items) >= batch:
+                yield {"type": "items", "items": items}
+                items = []
+        if items:
+            yield {"type": "items", "items": items}
+        end = {"type": "end", "success": True, "path": self.path, "count": count}
+        if self.next_cursor:
+            end["next_cursor"] = self.next_cursor
+        if self.errors:
+            end["errors"] = self.errors
+        yield end
+
+
+class StatEntry:
+    """os.DirEntry stand-in for a cached name; stats the file when asked, so sizes and mtimes are current"""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.st = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            return os.lstat(self.path)
+        if self.st is None:
+            self.st = os.stat(self.path)
+        return self.st
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+
+def cache_path(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class MetadataCache:
+    """LRU of directory entry names for /ls, checked against the directory's mtime and a TTL before reuse.
+
+    Only names are kept: rewriting a file doesn't touch its directory's mtime, so sizes
+    and mtimes are read afresh on every listing.
+    """
+
+    def __init__(self, max_entries=METADATA_CACHE_ENTRIES, max_bytes=METADATA_CACHE_BYTES, ttl=METADATA_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (path, validator, stored_at, names, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def validator(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_size)
+
+    def get(self, key, path):
+        try:
+            current = self.validator(path)
+        except OSError:
+            current = None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if current == entry[1] and time.monotonic() - entry[2] < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[3], current
+                self._drop(key)
+            self.misses += 1
+        return None, current
+
+    def put(self, key, path, validator, names):
+        if validator is None or self.max_entries <= 0:
+            return
+        size = len(json.dumps(names))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (cache_path(path), validator, time.monotonic(), names, size)
+            self.size += size
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self._drop(next(iter(self.entries)))
+
+    def invalidate(self, *paths):
+        """Forget listings of the given paths, their parents and anything beneath them"""
+        targets = [cache_path(p) for p in paths if p]
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                cached = entry[0]
+                for target in targets:
+                    if (cached == target or target.startswith(cached.rstrip(os.sep) + os.sep)
+                            or cached.startswith(target.rstrip(os.sep) + os.sep)):
+                        self._drop(key)
+                        break
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[4]
+
+
+METADATA = MetadataCache()
+
+
+def make_etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:24] + '"'
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Compression doesn't change the entity we hash, so weak validators match too
+    return any(tag.strip()[2:] == etag if tag.strip().startswith("W/") else tag.strip() == etag
+               for tag in header.split(","))
+
+
+def decode_text(raw):
+    """Decode file bytes the way reading in text mode would: UTF-8, universal newlines"""
+    return raw.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def match_files(directory, pattern="*", recursive=False):
+    """Yield (relative path, full path) of files under directory matching a glob.
+
+    Patterns containing a path separator match the path relative to directory
+    (with "/" separators), others match the file name.
+    """
+    by_path = "/" in pattern or "\\" in pattern
+    pattern = pattern.replace("\\", "/")
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if not recursive:
+            dirs[:] = []
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, directory).replace(os.sep, "/")
+            if fnmatch.fnmatch(rel if by_path else name, pattern):
+                yield rel, full
+
+
+def read_many(directory, pattern="*", recursive=False, max_files=1000,
+              max_file_bytes=1 << 20, max_total_bytes=32 << 20, binary=False):
+    """Yield a frame per matching file, then an end frame summarising what was left out"""
+    count = 0
+    total = 0
+    skipped = 0
+    for rel, full in match_files(directory, pattern, recursive):
+        if count >= max_files or total >= max_total_bytes:
+            skipped += 1
+            continue
+        try:
+            with open(full, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                raw = f.read(min(max_file_bytes, max_total_bytes - total))
+        except OSError as e:
+            yield {"type": "error", "path": full, "error": str(e)}
+            continue
+        count += 1
+        total += len(raw)
+        frame = {"type": "file", "path": full, "size": size, "truncated": len(raw) < size}
+        if binary:
+            frame["content"] = base64.b64encode(raw).decode()
+            frame["binary"] = True
+        else:
+            frame["content"] = decode_text(raw)
+        yield frame
+    yield {"type": "end", "success": True, "count": count, "bytes": total,
+           "skipped": skipped, "complete": skipped == 0}
+
+
+def run_bounded(func, items, workers, stop=None, tick=None):
+    """Run func over items on a thread pool, yielding (item, future) as each one finishes
+
+    At most 2 * workers items are in flight, so a long directory walk doesn't run
+    ahead of the results. Setting stop, or closing the generator (e.g. when the
+    client disconnects mid-stream), stops submitting work and drops what is queued.
+    With tick, (None, None) is yielded whenever that many seconds pass without a result.
+    """
+    items = iter(items)
+    stop = stop or threading.Event()
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and not stop.is_set() and len(pending) < workers * 2:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                pending[executor.submit(func, item)] = item
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=tick, return_when=FIRST_COMPLETED)
+            if not done:
+                yield None, None
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        stop.set()
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class ContentSearch:
+    """Searches file contents under a path with a pool of worker threads
+
+    Iterating yields frames as files finish: {"type": "matches"} per file with
+    hits, {"type": "error"} per unreadable file, then an {"type": "end"} summary.
+    """
+
+    def __init__(self, path, query, regex=False, ignore_case=False, include=None, exclude=None,
+                 max_depth=None, context=0, max_matches=1000, max_matches_per_file=None,
+                 max_file_bytes=None, workers=SEARCH_WORKERS):
+        if not query or not isinstance(query, str):
+            raise ValueError("query is required")
+        if not isinstance(path, str):
+            raise ValueError("path must be a string")
+        self.path = path
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        pattern = query.encode("utf-8")
+        self.regex = re.compile(pattern if regex else re.escape(pattern), flags)
+        self.include = [include] if isinstance(include, str) else list(include or [])
+        self.exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+        self.max_depth = max_depth
+        self.context = max(context or 0, 0)
+        self.max_matches = max_matches
+        self.max_matches_per_file = max_matches_per_file
+        self.max_file_bytes = max_file_bytes
+        self.workers = max(1, workers)
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.matches = 0
+        self.truncated = False
+
+    @staticmethod
+    def matches_any(name, rel, patterns):
+        return any(fnmatch.fnmatch(rel if "/" in p or "\\" in p else name, p.replace("\\", "/")) for p in patterns)
+
+    def files(self):
+        """Yield the full path of every file to search, skipping excluded directories"""
+        if os.path.isfile(self.path):
+            yield self.path
+            return
+        for root, dirs, files in os.walk(self.path):
+            rel_root = os.path.relpath(root, self.path).replace(os.sep, "/")
+            rel_root = "" if rel_root == "." else rel_root + "/"
+            depth = rel_root.count("/")
+            dirs.sort()
+            if self.max_depth is not None and depth >= self.max_depth:
+                dirs[:] = []
+            dirs[:] = [d for d in dirs if not self.matches_any(d, rel_root + d, self.exclude)]
+            for name in sorted(files):
+                rel = rel_root + name
+                if self.include and not self.matches_any(name, rel, self.include):
+                    continue
+                if self.exclude and self.matches_any(name, rel, self.exclude):
+                    continue
+                yield os.path.join(root, name)
+
+    @staticmethod
+    def line_text(data, start, end, focus=None):
+        if end - start > SEARCH_MAX_LINE:
+            # Long (e.g. minified) lines are cut to a window around the match
+            if focus is not None:
+                start = max(start, focus - SEARCH_MAX_LINE // 2)
+            end = min(end, start + SEARCH_MAX_LINE)
+        return bytes(data[start:end]).rstrip(b"\r").decode("utf-8", "replace")
+
+    def context_lines(self, data, line_start, line_end):
+        before, after = [], []
+        pos = line_start
+        while len(before) < self.context and pos > 0:
+            start = data.rfind(b"\n", 0, pos - 1) + 1
+            before.insert(0, self.line_text(data, start, pos - 1))
+            pos = start
+        pos = line_end
+        while len(after) < self.context and pos + 1 < len(data):
+            end = data.find(b"\n", pos + 1)
+            end = len(data) if end < 0 else end
+            after.append(self.line_text(data, pos + 1, end))
+            pos = end
+        return before, after
+
+    def search_data(self, data):
+        found = []
+        line = 1
+        counted = 0     # newlines before this offset are already counted
+        line_end = -1   # end of the last reported line; later hits on it are folded in
+        for m in self.regex.finditer(data):
+            if self.stop.is_set():
+                break
+            if m.start() <= line_end:
+                continue
+            line_start = data.rfind(b"\n", 0, m.start()) + 1
+            line += data[counted:line_start].count(b"\n")  # mmap has no count()
+            counted = line_start
+            line_end = data.find(b"\n", m.end() if m.end() > m.start() else m.start())
+            line_end = len(data) if line_end < 0 else line_end
+            with self.lock:
+                if self.max_matches is not None and self.matches >= self.max_matches:
+                    self.truncated = True
+                    self.stop.set()
+                    break
+                self.matches += 1
+            match = {"line": line, "column": m.start() - line_start + 1,
+                     "text": self.line_text(data, line_start, line_end, m.start())}
+            if self.context:
+                match["before"], match["after"] = self.context_lines(data, line_start, line_end)
+            found.append(match)
+            if self.max_matches_per_file is not None and len(found) >= self.max_matches_per_file:
+                break
+        return found
+
+    def search_file(self, full):
+        """Return a frame for one file, or None if it has no matches or is binary"""
+        with open(full, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or self.stop.is_set():
+                return None
+            if b"\0" in f.read(SEARCH_SNIFF_BYTES):
+                return {"type": "binary", "path": full}
+            f.seek(0)
+            if self.max_file_bytes is not None and size > self.max_file_bytes:
+                data = f.read(self.max_file_bytes)
+            elif size >= SEARCH_MMAP_BYTES:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+            try:
+                found = self.search_data(data)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+        return {"type": "matches", "path": full, "matches": found} if found else None
+
+    def __iter__(self):
+        scanned = matched = binary = errors = 0
+        for full, future in run_bounded(self.search_file, self.files(), self.workers, self.stop):
+            scanned += 1
+            try:
+                frame = future.result()
+            except Exception as e:
+                errors += 1
+                yield {"type": "error", "path": full, "error": str(e)}
+                continue
+            if frame is None:
+                continue
+            if frame["type"] == "binary":
+                binary += 1
+                continue
+            matched += 1
+            yield frame
+        yield {"type": "end", "success": True, "files_scanned": scanned, "files_matched": matched,
+               "matches": self.matches, "binary_skipped": binary, "errors": errors,
+               "truncated": self.truncated}
+
+
+HASH_ALGORITHMS = sorted(a for a in hashlib.algorithms_guaranteed if not a.startswith("shake_"))
+
+
+class HashCache:
+    """On-disk cache of file digests keyed by path and algorithm, valid while size and mtime match"""
+
+    def __init__(self, path=HASH_CACHE_PATH):
+        self.path = path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.db is None and self.path:
+            try:
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=NORMAL")  # a lost entry is just rehashed
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS hashes (path TEXT, algorithm TEXT, size INTEGER,"
+                    " mtime_ns INTEGER, digest TEXT, PRIMARY KEY (path, algorithm))")
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"Hash cache disabled: {self.path}: {e}")
+                self.path = None
+                self.db = None
+        return self.db
+
+    def get(self, path, algorithms, size, mtime_ns):
+        """Return {algorithm: digest} for the algorithms cached for this version of the file"""
+        with self.lock:
+            if self.connect() is None:
+                return {}
+            rows = self.db.execute(
+                "SELECT algorithm, digest FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, size, mtime_ns)).fetchall()
+        return {algorithm: digest for algorithm, digest in rows if algorithm in algorithms}
+
+    def put(self, path, size, mtime_ns, digests):
+        with self.lock:
+            if self.connect() is None:
+                return
+            self.db.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                [(path, algorithm, size, mtime_ns, digest) for algorithm, digest in digests.items()])
+            self.db.commit()
+
+    def forget(self, path):
+        with self.lock:
+            if self.connect() is None:
+                return
+            self.db.execute("DELETE FROM hashes WHERE path = ?", (path,))
+            self.db.commit()
+
+
+HASHES = HashCache()
+
+
+def hash_file(path, algorithms, use_cache=True):
+    """Hash a file with each algorithm in one pass; returns a /hash file frame"""
+    key = os.path.normcase(os.path.abspath(path))
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            frame = {"type": "file", "path": path, "size": st.st_size, "mtime": st.st_mtime}
+            cached = HASHES.get(key, algorithms, st.st_size, st.st_mtime_ns) if use_cache else {}
+            missing = [a for a in algorithms if a not in cached]
+            if missing:
+                digests = [hashlib.new(a) for a in missing]
+                buffer = bytearray(HASH_CHUNK)
+                view = memoryview(buffer)
+                # hashlib releases the GIL on large updates, so worker threads hash in parallel
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    for digest in digests:
+                        digest.update(view[:n])
+                computed = {a: d.hexdigest() for a, d in zip(missing, digests)}
+                # A file modified again within its mtime resolution would look unchanged, so
+                # very recent files are not cached (the same "racy" rule git uses)
+                if use_cache and time.time() - st.st_mtime > HASH_RACY_SECONDS:
+                    HASHES.put(key, st.st_size, st.st_mtime_ns, computed)
+                cached.update(computed)
+            frame.update((a, cached[a]) for a in algorithms)
+            frame["cached"] = not missing
+            return frame
+    except FileNotFoundError:
+        HASHES.forget(key)
+        raise
+
+
+def hash_files(paths, algorithms, use_cache=True, workers=HASH_WORKERS):
+    """Yield a frame per file (in completion order), then an end frame with totals"""
+    hashed = cached = errors = total = 0
+    for path, future in run_bounded(lambda p: hash_file(p, algorithms, use_cache), paths, workers):
+        try:
+            frame = future.result()
+        except Exception as e:
+            errors += 1
+            yield {"type": "error", "path": path, "error": str(e)}
+            continue
+        if frame["cached"]:
+            cached += 1
+        else:
+            hashed += 1
+            total += frame["size"]
+        yield frame
+    yield {"type": "end", "success": True, "files": hashed + cached, "hashed": hashed, "cached": cached,
+           "bytes_hashed": total, "errors": errors, "algorithms": algorithms}
+
+
+class TreeCopy:
+    """Copies or moves a file or directory tree with a pool of worker threads
+
+    Iterating yields {"type": "progress"} frames every COPY_PROGRESS_INTERVAL
+    seconds, an {"type": "error"} frame per file that failed (the rest carry on),
+    then an {"type": "end"} summary.
+    """
+
+    def __init__(self, src, dst, move=False, incremental=False, merge=False, workers=COPY_WORKERS):
+        if not isinstance(src, str) or not isinstance(dst, str) or not src or not dst:
+            raise ValueError("src and dst are required")
+        if not os.path.exists(src):
+            raise FileNotFoundError(f"Source not found: {src}")
+        if not move and os.path.isdir(src) and os.path.exists(dst) and not (merge or incremental):
+            # Like shutil.copytree: copying into an existing tree has to be asked for
+            raise FileExistsError(f"Destination exists: {dst} (pass merge to copy into it)")
+        if move and os.path.isdir(dst):
+            # shutil.move semantics: moving onto a directory moves into it
+            dst = os.path.join(dst, os.path.basename(src.rstrip("\\/")))
+        elif not move and os.path.isfile(src) and os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        self.src = src
+        self.dst = dst
+        self.move = move
+        self.incremental = incremental
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        self.files = self.copied = self.skipped = self.bytes = 0
+        self.errors = []
+        self.current = None
+
+    def tasks(self):
+        """Yield (source, destination) file pairs, creating destination directories on the way
+
+        os.walk does not descend into symlinked directories, so those are yielded as
+        pairs too and copy_file recreates the link rather than leaving it out.
+        """
+        if os.path.isfile(self.src):
+            parent = os.path.dirname(self.dst)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            yield self.src, self.dst
+            return
+        for root, dirs, files in os.walk(self.src):
+            dirs.sort()
+            target = os.path.join(self.dst, os.path.relpath(root, self.src))
+            try:
+                os.makedirs(target, exist_ok=True)
+            except OSError as e:
+                self.failed(root, e)
+                dirs[:] = []
+                continue
+            links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            if links:
+                dirs[:] = [d for d in dirs if d not in links]
+            for name in sorted(files + links):
+                yield os.path.join(root, name), os.path.join(target, name)
+
+    def failed(self, path, error):
+        with self.lock:
+            self.errors.append({"path": path, "error": str(error)})
+
+    def unchanged(self, st, dst):
+        try:
+            other = os.stat(dst)
+        except OSError:
+            return False
+        return other.st_size == st.st_size and abs(other.st_mtime - st.st_mtime) <= COPY_MTIME_WINDOW
+
+    @staticmethod
+    def remove_link(path):
+        # Windows removes a directory symlink with rmdir, not unlink
+        if os.name == "nt":
+            os.rmdir(path)
+        else:
+            os.remove(path)
+
+    def copy_link(self, src, dst):
+        """Recreate the directory symlink src at dst, pointing where src points"""
+        target = os.readlink(src)
+        if os.path.islink(dst):
+            if self.incremental and os.readlink(dst) == target:
+                if self.move:
+                    self.remove_link(src)
+                with self.lock:
+                    self.skipped += 1
+                return
+            self.remove_link(dst)
+        elif os.path.lexists(dst):
+            raise FileExistsError(f"Destination exists and is not a link: {dst}")
+        os.symlink(target, dst, target_is_directory=True)
+        if self.move:
+            self.remove_link(src)
+        with self.lock:
+            self.copied += 1
+
+    def copy_file(self, pair):
+        src, dst = pair
+        self.current = src
+        if os.path.islink(src) and os.path.isdir(src):
+            self.copy_link(src, dst)
+            return
+        st = os.stat(src)
+        if self.incremental and self.unchanged(st, dst):
+            if self.move:
+                os.remove(src)
+            with self.lock:
+                self.skipped += 1
+            return
+        if self.move:
+            try:
+                os.replace(src, dst)
+                with self.lock:
+                    self.copied += 1
+                    self.bytes += st.st_size
+                return
+            except OSError:
+                pass  # another volume: copy, then delete the source
+        if st.st_size >= COPY_LARGE_BYTES:
+            # Big files go through a large buffer and report bytes as they are written
+            buffer = bytearray(COPY_BUFFER)
+            view = memoryview(buffer)
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                while True:
+                    n = fsrc.readinto(buffer)
+                    if not n:
+                        break
+                    fdst.write(view[:n])
+                    with self.lock:
+                        self.bytes += n
+            shutil.copystat(src, dst)
+        else:
+            shutil.copyfile(src, dst)
+            shutil.copystat(src, dst)
+            with self.lock:
+                self.bytes += st.st_size
+        if self.move:
+            os.remove(src)
+        with self.lock:
+            self.copied += 1
+
+    def progress(self):
+        with self.lock:
+            return {"files": self.files, "copied": self.copied, "skipped": self.skipped,
+                    "bytes": self.bytes, "errors": len(self.errors), "current": self.current}
+
+    def __iter__(self):
+        if self.move and not os.path.exists(self.dst):
+            try:
+                # Same volume: a rename moves the whole tree at once
+                os.rename(self.src, self.dst)
+                yield dict(self.summary(), renamed=True)
+                return
+            except OSError:
+                pass
+        last = time.monotonic()
+        for pair, future in run_bounded(self.copy_file, self.tasks(), self.workers, tick=COPY_PROGRESS_INTERVAL):
+            if future is not None:
+                self.files += 1
+                try:
+                    future.result()
+                except Exception as e:
+                    self.failed(pair[0], e)
+                    yield {"type": "error", "path": pair[0], "error": str(e)}
+            if time.monotonic() - last >= COPY_PROGRESS_INTERVAL:
+                last = time.monotonic()
+                yield dict(self.progress(), type="progress")
+        if self.move and os.path.isdir(self.src):
+            # Remove source directories the move emptied; ones with failed files stay
+            for root, dirs, files in os.walk(self.src, topdown=False):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+        yield self.summary()
+
+    def summary(self):
+        result = self.progress()
+        del result["current"]
+        result.update(type="end", success=not self.errors, src=self.src, dst=self.dst)
+        if self.errors:
+            result["failed"] = self.errors[:COPY_MAX_ERRORS]
+        return result
+
+
+class ChunkWriter:
+    """Write-only file object that sends what it gets as chunks of a streamed reply"""
+
+    def __init__(self, handler, size=ARCHIVE_CHUNK):
+        self.handler = handler
+        self.size = size
+        self.buffer = bytearray()
+        self.written = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.written += len(data)
+        if len(self.buffer) >= self.size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.handler.write_chunk(bytes(self.buffer))
+            self.buffer.clear()
+
+
+class BodyReader:
+    """Read-only file object over a request body generator, for tarfile's stream mode"""
+
+    def __init__(self, pieces):
+        self.pieces = iter(pieces)
+        self.piece = b""
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.piece[self.offset:] + b"".join(self.pieces)
+            self.piece, self.offset = b"", 0
+            return data
+        if self.offset >= len(self.piece):
+            self.piece, self.offset = next(self.pieces, b""), 0
+        data = self.piece[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+
+class TreeArchive:
+    """Packs a directory tree into a tar or zip stream, or extracts one into a directory
+
+    Members are paths relative to the root with "/" separators. include and exclude
+    take globs like /search: a pattern with a slash matches the relative path, others
+    the name; excluded directories are not entered. Only regular files and directories
+    are packed or extracted, with their mtimes.
+    """
+
+    def __init__(self, path, format="tar", compress=True, include=None, exclude=None):
+        if format not in ("tar", "zip"):
+            raise ValueError("format must be tar or zip")
+        self.path = path
+        self.format = format
+        self.compress = compress
+        self.include = [include] if isinstance(include, str) else list(include or [])
+        self.exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.error_count = 0
+        self.errors = []
+
+    @property
+    def content_type(self):
+        if self.format == "zip":
+            return "application/zip"
+        return "application/gzip" if self.compress else "application/x-tar"
+
+    def wanted(self, name, rel):
+        if self.include and not ContentSearch.matches_any(name, rel, self.include):
+            return False
+        return not (self.exclude and ContentSearch.matches_any(name, rel, self.exclude))
+
+    def failed(self, rel, error):
+        self.error_count += 1
+        if len(self.errors) < ARCHIVE_MAX_ERRORS:
+            self.errors.append({"path": rel, "error": str(error)})
+
+    def entries(self):
+        """Yield (full path, member name, is_dir); directories only when no include filter is set"""
+        def walk_error(e):
+            self.failed(os.path.relpath(e.filename, self.path).replace(os.sep, "/"), e)
+
+        for root, dirs, files in os.walk(self.path, onerror=walk_error):
+            rel_root = os.path.relpath(root, self.path).replace(os.sep, "/")
+            rel_root = "" if rel_root == "." else rel_root + "/"
+            dirs.sort()
+            dirs[:] = [d for d in dirs if not ContentSearch.matches_any(d, rel_root + d, self.exclude)]
+            if rel_root and not self.include:
+                yield root, rel_root.rstrip("/"), True
+            for name in sorted(files):
+                if self.wanted(name, rel_root + name):
+                    yield os.path.join(root, name), rel_root + name, False
+
+    def pack(self, out):
+        """Write the archive to out, a write-only file object, as the tree is walked"""
+        if self.format == "zip":
+            archive = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED if self.compress else zipfile.ZIP_STORED,
+                                      strict_timestamps=False)
+        else:
+            archive = tarfile.open(fileobj=out, mode="w|gz" if self.compress else "w|",
+                                   format=tarfile.PAX_FORMAT)
+        with archive:
+            for full, rel, is_dir in self.entries():
+                if is_dir:
+                    if self.format == "zip":
+                        archive.write(full, rel)
+                    else:
+                        archive.add(full, rel, recursive=False)
+                    self.dirs += 1
+                    continue
+                try:
+                    f = open(full, "rb")
+                except OSError as e:
+                    self.failed(rel, e)  # e.g. locked by another process: skip it, nothing was written yet
+                    continue
+                with f:
+                    if self.format == "zip":
+                        info = zipfile.ZipInfo.from_file(full, rel, strict_timestamps=False)
+                        info.compress_type = archive.compression
+                        with archive.open(info, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dest:
+                            shutil.copyfileobj(f, dest, HASH_CHUNK)
+                    else:
+                        info = archive.gettarinfo(arcname=rel, fileobj=f)
+                        archive.addfile(info, f)
+                self.files += 1
+                self.bytes += info.file_size if self.format == "zip" else info.size
+            if self.errors:
+                report = json.dumps({"error_count": self.error_count, "errors": self.errors}, indent=2).encode()
+                if self.format == "zip":
+                    archive.writestr(ARCHIVE_ERRORS_NAME, report)
+                else:
+                    info = tarfile.TarInfo(ARCHIVE_ERRORS_NAME)
+                    info.size, info.mtime = len(report), time.time()
+                    archive.addfile(info, io.BytesIO(report))
+        out.flush()
+
+    def target(self, name):
+        """(full path, member name) to extract name to, or None if it would land outside the root"""
+        parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+        if not parts or name.startswith(("/", "\\")) or any(p == ".." or ":" in p for p in parts):
+            return None
+        return os.path.join(self.path, *parts), "/".join(parts)
+
+    def extract(self, name, is_dir, mtime, source, dir_times):
+        if is_dir and name.replace("\\", "/").strip("/") in ("", "."):
+            return  # the root itself, as in archives made with tar -C dir .
+        target = self.target(name)
+        if target is None:
+            self.failed(name, "Path escapes the destination")
+            return
+        full, rel = target
+        if not self.wanted(rel.rsplit("/", 1)[-1], rel):
+            return
+        if is_dir:
+            os.makedirs(full, exist_ok=True)
+            dir_times.append((full, mtime))
+            self.dirs += 1
+            return
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        # Each file appears whole or not at all
+        temp = f"{full}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with source() as src, open(temp, "wb") as dst:
+                shutil.copyfileobj(src, dst, HASH_CHUNK)
+                size = dst.tell()
+            os.utime(temp, (mtime, mtime))
+            os.replace(temp, full)
+        except OSError as e:
+            remove_quietly(temp)
+            if isinstance(e, ConnectionError):
+                raise  # the body stopped coming: no later member can be read either
+            self.failed(rel, e)
+            return
+        except BaseException:
+            remove_quietly(temp)
+            raise
+        self.files += 1
+        self.bytes += size
+
+    def unpack(self, pieces):
+        """Extract an archive arriving as an iterable of byte strings; tar streams, zip is spooled"""
+        os.makedirs(self.path, exist_ok=True)
+        dir_times = []
+        try:
+            if self.format == "zip":
+                # The zip directory is at the end, so the body is spooled to disk first
+                with tempfile.TemporaryFile() as spool:
+                    for piece in pieces:
+                        spool.write(piece)
+                    spool.seek(0)
+                    with zipfile.ZipFile(spool) as archive:
+                        for info in archive.infolist():
+                            mtime = time.mktime(info.date_time + (0, 0, -1))
+                            self.extract(info.filename, info.is_dir(), mtime,
+                                         lambda info=info: archive.open(info), dir_times)
+            else:
+                with tarfile.open(fileobj=BodyReader(pieces), mode="r|*") as archive:
+                    for member in archive:
+                        if member.isfile() or member.isdir():
+                            self.extract(member.name, member.isdir(), member.mtime,
+                                         lambda member=member: archive.extractfile(member), dir_times)
+                        else:
+                            self.failed(member.name, "Not a regular file or directory")
+        finally:
+            # Deepest first, so setting a parent's mtime is not undone by its children
+            for full, mtime in sorted(dir_times, key=lambda item: -item[0].count(os.sep)):
+                try:
+                    os.utime(full, (mtime, mtime))
+                except OSError:
+                    pass
+
+    def summary(self):
+        return {
+            "path": self.path,
+            "format": self.format,
+            "files": self.files,
+            "dirs": self.dirs,
+            "bytes": self.bytes,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+class RateLimiter:
+    """Token bucket shared by all downloads; a rate of 0 means unlimited"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate) - n
+            self.last = now
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+DOWNLOAD_SLOTS = threading.BoundedSemaphore(DOWNLOAD_CONNECTIONS)
+DOWNLOAD_LIMIT = RateLimiter(DOWNLOAD_RATE)
+
+
+class DownloadChanged(Exception):
+    """The remote file changed between segments, so the partial download is useless"""
+
+
+class Download:
+    """Fetches one URL into dst via dst.part, in parallel Range segments when the server allows
+
+    Progress is checkpointed to the dst.part.json sidecar, so a later request for
+    the same URL and dst resumes each segment where it stopped.
+    """
+
+    def __init__(self, url, dst, sha256=None, segments=DOWNLOAD_SEGMENTS, stop=None):
+        if not url or not dst or not isinstance(url, str) or not isinstance(dst, str):
+            raise ValueError("url and dst are required")
+        if sha256 is not None and not isinstance(sha256, str):
+            raise ValueError("sha256 must be a hex string")
+        self.url = url
+        self.dst = dst
+        self.sha256 = sha256.lower() if sha256 else None
+        self.segments = max(1, segments)
+        self.stop = stop or threading.Event()
+        self.part = dst + ".part"
+        self.state_path = dst + ".part.json"
+        self.size = None
+        self.validator = None
+        self.ranges = []  # [start, end, bytes done, bytes flushed and checkpointed]
+        self.resumed = 0
+        self.ranged = False
+        self.errors = []
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()  # segments checkpoint through one sidecar
+        self.result = None
+
+    def progress(self):
+        with self.lock:
+            done = sum(r[2] for r in self.ranges)
+        return {"url": self.url, "dst": self.dst, "bytes": done, "size": self.size}
+
+    def open(self, start=0, end=None):
+        headers = {"User-Agent": "windows-mcp-server"}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+            if self.validator:
+                # If the file changed, the server answers 200 with the new file instead
+                headers["If-Range"] = self.validator
+        request = urllib.request.Request(self.url, headers=headers)
+        return urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+
+    def probe(self):
+        """Ask for the first byte; returns None if ranges work, else the full-body response to stream"""
+        try:
+            response = self.open(0, 1)
+        except urllib.error.HTTPError as e:
+            if e.code != 416:  # empty files can't satisfy any range
+                raise
+            e.close()
+            return self.open()
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        if response.status != 206:
+            return response
+        response.close()
+        if not total.isdigit():
+            return self.open()  # length unknown, so segments can't be planned
+        self.size = int(total)
+        etag = response.headers.get("ETag")
+        self.validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+        self.ranged = True
+        return None
+
+    def save_state(self):
+        with self.lock:
+            state = {"url": self.url, "size": self.size, "validator": self.validator,
+                     "ranges": [[r[0], r[1], r[3]] for r in self.ranges]}
+        with self.state_lock:
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+
+    def plan(self):
+        """Resume from the sidecar if it describes this file, else split it into fresh segments"""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if (state["url"] == self.url and state["size"] == self.size and state["validator"] == self.validator
+                    and os.path.getsize(self.part) == self.size):
+                self.ranges = [[start, end, done, done] for start, end, done in state["ranges"]]
+                self.resumed = sum(r[2] for r in self.ranges)
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        count = min(self.segments, max(1, -(-self.size // DOWNLOAD_MIN_SEGMENT)))
+        step = -(-self.size // count)
+        self.ranges = [[start, min(start + step, self.size), 0, 0] for start in range(0, self.size, step)]
+        with open(self.part, "wb") as f:
+            f.truncate(self.size)
+        self.save_state()
+
+    def fetch_range(self, r):
+        """Download one segment into the part file, retrying from where it stopped"""
+        failures = 0
+        while r[0] + r[2] < r[1]:
+            if self.stop.is_set():
+                raise ConnectionAbortedError("Cancelled")
+            before = r[2]
+            try:
+                with DOWNLOAD_SLOTS, self.open(r[0] + r[2], r[1]) as response:
+                    if response.status != 206:
+                        raise DownloadChanged("Server ignored the range request; the file changed during download")
+                    with open(self.part, "r+b") as f:
+                        f.seek(r[0] + r[2])
+                        saved = time.monotonic()
+                        while r[0] + r[2] < r[1] and not self.stop.is_set():
+                            chunk = response.read(min(DOWNLOAD_CHUNK, r[1] - r[0] - r[2]))
+                            if not chunk:
+                                raise ConnectionResetError("Connection closed before the segment was complete")
+                            DOWNLOAD_LIMIT.consume(len(chunk))
+                            f.write(chunk)
+                            with self.lock:
+                                r[2] += len(chunk)
+                            if time.monotonic() - saved >= 1:
+                                f.flush()
+                                r[3] = r[2]
+                                self.save_state()
+                                saved = time.monotonic()
+                        f.flush()
+                        r[3] = r[2]
+            except DownloadChanged:
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                if isinstance(e, urllib.error.HTTPError) and e.code < 500 and e.code != 429:
+                    raise
+                failures = 0 if r[2] > before else failures + 1
+                if failures > DOWNLOAD_RETRIES:
+                    raise
+                time.sleep(min(2 ** failures, 30))
+            finally:
+                self.save_state()
+
+    def stream(self, response):
+        """Fallback for servers without Range support: one connection, no resume"""
+        with response:
+            length = response.headers.get("Content-Length")
+            self.size = int(length) if length and length.isdigit() else None
+            self.ranges = [[0, self.size, 0, 0]]
+            with open(self.part, "wb") as f:
+                while not self.stop.is_set():
+                    chunk = response.read(DOWNLOAD_CHUNK)
+                    if not chunk:
+                        break
+                    DOWNLOAD_LIMIT.consume(len(chunk))
+                    f.write(chunk)
+                    with self.lock:
+                        self.ranges[0][2] += len(chunk)
+        if self.stop.is_set():
+            raise ConnectionAbortedError("Cancelled")
+        if self.size is not None and self.ranges[0][2] != self.size:
+            raise ConnectionResetError(f"Got {self.ranges[0][2]} of {self.size} bytes")
+        self.size = self.ranges[0][2]
+
+    def run(self):
+        try:
+            self.result = self.download()
+        except Exception as e:
+            if isinstance(e, (DownloadChanged, ValueError)):
+                remove_quietly(self.part)
+                remove_quietly(self.state_path)
+            self.result = dict(self.progress(), success=False, error=str(e))
+
+    def download(self):
+        if self.sha256 and os.path.isfile(self.dst) and file_digest(self.dst) == self.sha256:
+            return {"success": True, "url": self.url, "dst": self.dst, "size": os.path.getsize(self.dst),
+                    "sha256": self.sha256, "unchanged": True}
+        parent = os.path.dirname(self.dst)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with DOWNLOAD_SLOTS:
+            response = self.probe()
+            if response is not None:
+                # No ranges: the probe's own response is the download, so it keeps the slot
+                self.stream(response)
+        if response is None:
+            self.plan()
+            threads = [threading.Thread(target=self.fetch_segment, args=(r,), daemon=True)
+                       for r in self.ranges if r[0] + r[2] < r[1]]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if self.errors:
+                raise self.errors[0]
+        digest = file_digest(self.part)
+        if self.sha256 and digest != self.sha256:
+            raise ValueError(f"sha256 mismatch: expected {self.sha256}, got {digest}")
+        os.replace(self.part, self.dst)
+        remove_quietly(self.state_path)
+        METADATA.invalidate(self.dst)
+        return {"success": True, "url": self.url, "dst": self.dst, "size": self.size, "sha256": digest,
+                "segments": len(self.ranges), "ranged": self.ranged, "resumed_bytes": self.resumed}
+
+    def fetch_segment(self, r):
+        try:
+            self.fetch_range(r)
+        except Exception as e:
+            self.errors.append(e)
+            self.stop.set()  # no point finishing the other segments
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_downloads(downloads):
+    """Run downloads concurrently, yielding progress frames and then an end frame with each result"""
+    threads = [threading.Thread(target=d.run, daemon=True) for d in downloads]
+    for t in threads:
+        t.start()
+    try:
+        alive = threads
+        while alive:
+            alive[0].join(COPY_PROGRESS_INTERVAL)
+            alive = [t for t in threads if t.is_alive()]
+            if not alive:
+                break
+            items = [d.progress() for d in downloads]
+            yield {"type": "progress", "downloads": items,
+                   "bytes": sum(item["bytes"] for item in items),
+                   "size": sum(item["size"] or 0 for item in items)}
+    finally:
+        # Stops the transfers if the client disconnects mid-stream; parts are kept for resuming
+        for d in downloads:
+            if d.result is None:
+                d.stop.set()
+    results = [d.result for d in downloads]
+    yield {"type": "end", "success": all(r["success"] for r in results), "results": results}
+
+
+def parse_range(header, size):
+    """Parse a single-range "bytes=a-b" header into [start, end); None if absent, False if unsatisfiable"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        return False
+    return start, end
+
+
+# Delta sync helpers, kept identical to the copy in bridge.py; tests/test_delta.py checks both
+def delta_block_size(size):
+    """Block size for delta transfers of a size-byte file: about its square root, like rsync"""
+    block = DELTA_MIN_BLOCK
+    while block < DELTA_MAX_BLOCK and block * block < size:
+        block <<= 1
+    return block
+
+
+def block_digest(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def file_signature(f, block_size):
+    """Return (size, sha256, blocks) of an open binary file; blocks are [adler32, blake2b] pairs"""
+    digest = hashlib.sha256()
+    blocks = []
+    size = 0
+    for block in iter(lambda: f.read(block_size), b""):
+        digest.update(block)
+        size += len(block)
+        blocks.append([zlib.adler32(block), block_digest(block)])
+    return size, digest.hexdigest(), blocks
+
+
+def compute_delta(data, block_size, blocks, base_size, max_literal):
+    """Describe data as blocks copied from a base file plus literal bytes
+
+    data is bytes or an mmap; blocks and base_size come from the base file's
+    signature. Returns (ops, literal_bytes) where ops are ["copy", first_block,
+    count] and ["data", base64] in order, or None if more than max_literal bytes
+    would have to be sent.
+    """
+    tail = None
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        if index == len(blocks) - 1 and base_size % block_size:
+            tail = (base_size % block_size, strong, index)
+        else:
+            table.setdefault(weak, {})[strong] = index
+    ops = []
+    literal = 0
+
+    def emit_data(start, end):
+        if end > start:
+            ops.append(["data", base64.b64encode(data[start:end]).decode()])
+
+    def emit_copy(index):
+        if ops and ops[-1][0] == "copy" and ops[-1][1] + ops[-1][2] == index:
+            ops[-1][2] += 1
+        else:
+            ops.append(["copy", index, 1])
+
+    n = len(data)
+    pos = start = 0
+    weak = None
+    while pos + block_size <= n:
+        if weak is None:
+            weak = zlib.adler32(data[pos:pos + block_size])
+        candidates = table.get(weak)
+        if candidates:
+            index = candidates.get(block_digest(data[pos:pos + block_size]))
+            if index is not None:
+                literal += pos - start
+                emit_data(start, pos)
+                emit_copy(index)
+                pos = start = pos + block_size
+                weak = None
+                continue
+        if pos + block_size == n:
+            break
+        if literal + pos - start >= max_literal:
+            return None
+        # Slide the adler32 window one byte: drop data[pos], add data[pos + block_size]
+        out, new = data[pos], data[pos + block_size]
+        a = ((weak & 0xffff) - out + new) % 65521
+        b = ((weak >> 16) - block_size * out + a - 1) % 65521
+        weak = a | b << 16
+        pos += 1
+    end = n
+    if tail is not None and n - tail[0] >= start and block_digest(data[n - tail[0]:]) == tail[1]:
+        end = n - tail[0]
+    literal += end - start
+    if literal > max_literal:
+        return None
+    emit_data(start, end)
+    if end < n:
+        emit_copy(tail[2])
+    return ops, literal
+
+
+def apply_delta(base, ops, block_size, out):
+    """Write the file described by ops to out, copying blocks from the open base file; returns (size, sha256)"""
+    digest = hashlib.sha256()
+    size = 0
+    for op in ops:
+        if op[0] == "copy":
+            base.seek(op[1] * block_size)
+            remaining = op[2] * block_size
+            while remaining > 0:
+                chunk = base.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        elif op[0] == "data":
+            chunk = base64.b64decode(op[1])
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+        else:
+            raise ValueError(f"Unknown delta op: {op[0]}")
+    return size, digest.hexdigest()
+
+
+def map_file(f):
+    """Read-only view of an open file for compute_delta; empty files can't be mapped"""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class CountingWriter:
+    """Wraps a handler's wfile, counting the bytes written for /metrics"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
 
 
 class Handler(BaseHTTPRequestHandler):
-    def send_json(self, data, status=200):
+    # HTTP/1.1 keeps connections open between requests; every response must carry
+    # a Content-Length (or be chunked) so the client knows where it ends
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; without TCP_NODELAY a reused
+    # connection stalls ~40ms per request on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def handle_one_request(self):
+        self.in_flight = False
+        try:
+            super().handle_one_request()
+        except Exception as e:
+            if self.in_flight:
+                METRICS.inc("mcp_errors_total", endpoint=self.metrics_endpoint(), type=type(e).__name__)
+            raise
+        finally:
+            if self.in_flight:
+                self.record_request()
+
+    def parse_request(self):
+        # Called once the request line has arrived, so idle keep-alive time is not counted
+        self.started = time.monotonic()
+        self.response_code = None
+        self.bytes_in = 0
+        self.wfile.written = 0
+        if not super().parse_request():
+            return False
+        self.in_flight = True
+        METRICS.inc("mcp_requests_in_flight")
+        return True
+
+    def send_response(self, code, message=None):
+        self.response_code = code
+        super().send_response(code, message)
+
+    def metrics_endpoint(self):
+        return METRICS.endpoint(self.path.partition("?")[0], self.response_code)
+
+    def record_request(self):
+        """Count the finished request on /metrics"""
+        endpoint = self.metrics_endpoint()
+        METRICS.inc("mcp_requests_in_flight", -1)
+        METRICS.inc("mcp_requests_total", endpoint=endpoint, method=self.command, status=self.response_code or 0)
+        METRICS.observe("mcp_request_duration_seconds", time.monotonic() - self.started, endpoint=endpoint)
+        METRICS.inc("mcp_request_bytes_total", self.bytes_in, endpoint=endpoint)
+        METRICS.inc("mcp_response_bytes_total", self.wfile.written, endpoint=endpoint)
+
+    def send_json(self, data, status=200, headers=None, cacheable=False):
+        encode_started = time.monotonic()
+        body = json.dumps(data).encode()
+        if status >= 400:
+            # Called from an except block the handled exception names the error; otherwise the status does
+            error = sys.exc_info()[1]
+            METRICS.inc("mcp_errors_total", endpoint=METRICS.endpoint(self.path.partition("?")[0], status),
+                        type=type(error).__name__ if error is not None else f"HTTP{status}")
+        if cacheable:
+            etag = make_etag(body)
+            headers = dict(headers or {}, ETag=etag, **{"Cache-Control": "no-cache"})
+            if status == 200 and etag_matches(self.headers.get("If-None-Match"), etag):
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+        encoding = choose_encoding(self.headers.get("Accept-Encoding")) if len(body) >= COMPRESS_MIN_BYTES else None
+        if encoding:
+            body = compress(body, encoding)
+        now = time.monotonic()
+        METRICS.observe("mcp_encode_duration_seconds", now - encode_started,
+                        endpoint=METRICS.endpoint(self.path.partition("?")[0], status))
+        # Lets the bridge tell time spent here from time spent on the network
+        headers = dict(headers or {}, **{"Server-Timing": f"app;dur={(now - self.started) * 1000:.1f}"})
         self.send_response(status)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
         self.send_header("Access-Control-Allow-Origin", "*")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
 
     def do_GET(self):
-        if self.path == "/health":
+        path, _, query = self.path.partition("?")
+        if path == "/health":
             self.send_json({
                 "status": "ok",
                 "hostname": os.environ.get("COMPUTERNAME", "unknown"),
                 "user": os.environ.get("USERNAME", "unknown")
             })
-        elif self.path == "/info":
+        elif path == "/metrics":
+            self.send_metrics()
+        elif path == "/mux":
+            self.handle_mux()
+        elif path == "/info":
             self.send_json({
                 "hostname": os.environ.get("COMPUTERNAME", "unknown"),
                 "user": os.environ.get("USERNAME", "unknown"),
                 "cwd": os.getcwd(),
                 "platform": sys.platform
-            })
+            }, cacheable=True)
+        elif path == "/raw":
+            self.with_limit(path, self.send_raw_file, urllib.parse.parse_qs(query).get("path", [""])[0])
         else:
             self.send_json({"error": "Not found"}, 404)
 
+    def handle_mux(self):
+        """Switch this connection to the multiplexed frame protocol (see MuxSession)"""
+        if self.headers.get("Upgrade", "").lower() != MUX_PROTOCOL:
+            self.send_json({"success": False, "error": f"GET /mux needs Upgrade: {MUX_PROTOCOL}"}, 426,
+                           {"Upgrade": MUX_PROTOCOL})
+            return
+        try:
+            peer_window = max(int(self.headers.get("Mux-Window", MUX_WINDOW)), 1)
+        except ValueError:
+            peer_window = MUX_WINDOW
+        self.send_response(101)
+        self.send_header("Upgrade", MUX_PROTOCOL)
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Mux-Window", str(MUX_WINDOW))
+        self.end_headers()
+        # The session holds this worker until the bridge disconnects; idle streams are normal
+        self.connection.settimeout(None)
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        MuxSession(self, peer_window).run()
+        self.close_connection = True
+
+    def send_metrics(self):
+        """Counters and histograms in the Prometheus text exposition format"""
+        METRICS.set("mcp_requests_queued", self.server.pending.qsize())
+        body = METRICS.render().encode()
+        encoding = choose_encoding(self.headers.get("Accept-Encoding"))
+        if encoding:
+            body = compress(body, encoding)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        path, _, query = self.path.partition("?")
+        if path == "/raw":
+            self.with_limit(path, self.send_raw_file, urllib.parse.parse_qs(query).get("path", [""])[0], True)
+        else:
+            self.send_json({"error": "Not found"}, 404)
+
+    def send_raw_file(self, path, head=False):
+        """Stream a file as application/octet-stream, honouring a single Range: bytes=... header"""
+        try:
+            f = open(path, "rb")
+        except OSError as e:
+            self.send_json({"success": False, "error": str(e)}, 404 if isinstance(e, FileNotFoundError) else 500)
+            return
+        try:
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                span = parse_range(self.headers.get("Range"), size)
+                if span is False:
+                    self.send_json({"success": False, "error": "Range not satisfiable", "size": size}, 416,
+                                   {"Content-Range": f"bytes */{size}"})
+                    return
+                start, end = span or (0, size)
+                self.send_response(206 if span else 200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(end - start))
+                self.send_header("Accept-Ranges", "bytes")
+                if span:
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+                self.end_headers()
+                if not head and end > start:
+                    # sendfile() is zero-copy where the OS supports it and a read/send loop elsewhere
+                    self.connection.sendfile(f, start, end - start)
+                    self.wfile.written += end - start
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            self.close_connection = True
+
     def do_POST(self):
+        path, _, query = self.path.partition("?")
+        if path == "/upload/chunk":
+            # Raw (optionally compressed) bytes, not JSON
+            self.with_limit(path, self.handle_upload_chunk, urllib.parse.parse_qs(query), body_unread=True)
+            return
+        if path == "/unpack":
+            # A raw tar or zip body, extracted as it arrives
+            self.with_limit(path, self.handle_unpack, urllib.parse.parse_qs(query), body_unread=True)
+            return
+
         try:
-            length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(length).decode() if length > 0 else "{}"
-            data = json.loads(body)
+            body = b"".join(self.read_body_decoded())
+        except UnsupportedEncodingError as e:
+            self.reject_body(str(e), 415)
+            return
+        except zlib.error as e:
+            self.reject_body(f"Cannot decode {self.headers.get('Content-Encoding')} body: {e}")
+            return
+        except Exception as e:
+            self.reject_body(f"Bad request body: {e}")
+            return
+        try:
+            data = json.loads(body.decode() or "{}")
+        except ValueError as e:
+            self.reject_body(f"Invalid JSON: {e}")
+            return
+
+        self.with_limit(path, self.handle_post, data)
+
+    def reject_body(self, error, code=400):
+        # The body may not have been consumed, so the connection can't be reused
+        self.close_connection = True
+        self.send_json({"error": error}, code, {"Connection": "close"})
+
+    def with_limit(self, endpoint, handler, *args, body_unread=False):
+        """Run handler under the endpoint's concurrency cap, or answer 503 busy
+
+        Pass body_unread when handler reads the request body itself: a busy reply then
+        closes the connection, so the body is not parsed as the next request.
+        """
+        limiter = self.server.limiter
+        if not limiter.acquire(endpoint):
+            METRICS.inc("mcp_limit_rejected_total", endpoint=endpoint)
+            headers = {"Retry-After": "1"}
+            if body_unread:
+                self.close_connection = True
+                headers["Connection"] = "close"
+            self.send_json({
+                "success": False,
+                "busy": True,
+                "error": f"Server busy: {endpoint} is limited to {limiter.limits[endpoint]} concurrent requests"
+            }, 503, headers)
+            return
+        try:
+            handler(*args)
+        finally:
+            limiter.release(endpoint)
+
+    def read_body(self, size=1 << 20):
+        """Yield the raw request body in pieces, for Content-Length or chunked bodies"""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                chunk_len = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if chunk_len == 0:
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass  # trailers
+                    return
+                while chunk_len:
+                    piece = self.rfile.read(min(size, chunk_len))
+                    if not piece:
+                        raise ConnectionError("Request body ended early")
+                    chunk_len -= len(piece)
+                    self.bytes_in += len(piece)
+                    yield piece
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining:
+                piece = self.rfile.read(min(size, remaining))
+                if not piece:
+                    raise ConnectionError("Request body ended early")
+                remaining -= len(piece)
+                self.bytes_in += len(piece)
+                yield piece
+
+    def read_body_decoded(self):
+        """Like read_body, undoing a gzip or deflate Content-Encoding"""
+        encoding = self.headers.get("Content-Encoding", "identity").lower()
+        if encoding in ("", "identity"):
+            yield from self.read_body()
+            return
+        if encoding not in ("gzip", "deflate"):
+            raise UnsupportedEncodingError(f"Unsupported Content-Encoding: {encoding}; use gzip or deflate")
+        decompressor = zlib.decompressobj(wbits=47)  # 32 + 15: accept zlib or gzip headers
+        for piece in self.read_body():
+            out = decompressor.decompress(piece)
+            if out:
+                yield out
+        out = decompressor.flush()
+        if out:
+            yield out
+
+    def begin_stream(self, content_type="application/x-ndjson", compress=True):
+        """Start a chunked response; follow with send_frame (or write_chunk) and end_stream"""
+        encoding = choose_encoding(self.headers.get("Accept-Encoding")) if compress else None
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.stream_seq = 0
+        # One compressor for the whole body, sync-flushed after every frame so the
+        # client can decode each frame as soon as it arrives
+        self.stream_compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS[encoding]) \
+            if encoding else None
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def send_frame(self, frame):
+        """Send one NDJSON frame, numbered with a sequence number"""
+        frame["seq"] = self.stream_seq
+        self.stream_seq += 1
+        line = json.dumps(frame).encode() + b"\n"
+        if self.stream_compressor:
+            line = self.stream_compressor.compress(line) + self.stream_compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.write_chunk(line)
+
+    def end_stream(self):
+        if self.stream_compressor:
+            self.write_chunk(self.stream_compressor.flush())
+        self.wfile.write(b"0\r\n\r\n")
+
+    def abort_stream(self):
+        # Closing without the last chunk tells the client the body is incomplete
+        self.close_connection = True
+
+    def send_archive(self, archive):
+        """Stream archive.pack() as the reply body; archives are compressed already, or on purpose not"""
+        self.begin_stream(archive.content_type, compress=False)
+        try:
+            archive.pack(ChunkWriter(self))
+            self.end_stream()
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            self.close_connection = True
+        except Exception as e:
+            self.log_error("pack %s failed: %s", archive.path, e)
+            self.abort_stream()
+
+    def handle_unpack(self, query):
+        try:
+            archive = TreeArchive(
+                query.get("path", [""])[0],
+                query.get("format", ["tar"])[0],
+                include=query.get("include"),
+                exclude=query.get("exclude")
+            )
+        except ValueError as e:
+            self.close_connection = True
+            self.send_json({"success": False, "error": str(e)}, 400, {"Connection": "close"})
+            return
+        try:
+            archive.unpack(self.read_body_decoded())
+            summary = archive.summary()
+            self.send_json(dict(summary, success=not summary["error_count"]))
+        except UnsupportedEncodingError as e:
+            self.close_connection = True
+            self.send_json(dict(archive.summary(), success=False, error=str(e)), 415, {"Connection": "close"})
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error) as e:
+            # The rest of the body was not read; drop the connection rather than parse it as a request
+            self.close_connection = True
+            self.send_json(dict(archive.summary(), success=False, error=f"Bad archive: {e}"), 400,
+                           {"Connection": "close"})
         except Exception as e:
-            self.send_json({"error": f"Invalid JSON: {e}"}, 400)
+            self.close_connection = True
+            self.send_json(dict(archive.summary(), success=False, error=str(e)), 500, {"Connection": "close"})
+        finally:
+            METADATA.invalidate(archive.path)
+
+    def stream_frames(self, frames):
+        """Send an iterable of frames as an NDJSON stream; stops quietly if the client leaves"""
+        self.begin_stream()
+        try:
+            try:
+                for frame in frames:
+                    self.send_frame(frame)
+            except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                raise
+            except Exception as e:
+                # Headers are already sent, so the failure becomes the last frame
+                self.send_frame({"type": "error", "success": False, "error": str(e)})
+            self.end_stream()
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            self.close_connection = True
+
+    def stream_command_result(self, args, shell, timeout, shaper=None):
+        command = CommandStream(args, shell, timeout, self.headers.get("X-Request-Id"), self.client_gone)
+        output = iter(command)
+        full = {"stdout": [], "stderr": []}
+        self.begin_stream()
+        try:
+            for stream, text in output:
+                if shaper is not None:
+                    # Only matching lines go out live; the exit frame carries the shaped result
+                    full[stream].append(text)
+                    text = shaper.live(stream, text)
+                    if not text:
+                        continue
+                self.send_frame({"type": "output", "stream": stream, "data": text})
+            if shaper is not None:
+                for stream in full:
+                    text = shaper.live_end(stream)
+                    if text:
+                        self.send_frame({"type": "output", "stream": stream, "data": text})
+            if command.cancelled:
+                frame = {"success": False, "cancelled": True, "error": "Cancelled by client"}
+            else:
+                frame = {"success": command.returncode == 0, "returncode": command.returncode}
+                if shaper is not None:
+                    frame = shaper.result(dict(frame, stdout="".join(full["stdout"]),
+                                               stderr="".join(full["stderr"])))
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            # Client went away; closing the generator kills the process
+            output.close()
+            self.close_connection = True
             return
+        except subprocess.TimeoutExpired:
+            frame = {"success": False, "error": f"Timeout after {timeout}s"}
+        except Exception as e:
+            frame = {"success": False, "error": str(e)}
+        frame.update(command.report)
+        self.send_frame(dict(frame, type="exit"))
+        self.end_stream()
+
+    def client_gone(self):
+        """True once the client has closed its connection; polled while a command runs"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def shell_pool(self, data):
+        """The warm interpreter pool for this endpoint, unless disabled or opted out of"""
+        if not data.get("pooled", True):
+            return None
+        return SHELL_POOLS.get(self.path)
+
+    def send_command_result(self, args, shell, timeout, pool=None, shaper=None):
+        try:
+            request_id = self.headers.get("X-Request-Id")
+            if pool is not None:
+                returncode, stdout, stderr, cancelled, report = pool.run(
+                    args if shell else args[-1], timeout, request_id, self.client_gone)
+            else:
+                returncode, stdout, stderr, cancelled, report = run_command(
+                    args, shell, timeout, request_id, self.client_gone)
+            if cancelled:
+                self.send_json(dict({"success": False, "cancelled": True, "error": "Cancelled by client"}, **report))
+                return
+            result = {
+                "success": returncode == 0,
+                "stdout": stdout,
+                "stderr": stderr,
+                "returncode": returncode
+            }
+            if shaper is not None:
+                shaper.result(result)
+            result.update(report)
+            self.send_json(result)
+        except subprocess.TimeoutExpired as e:
+            self.send_json(dict({"success": False, "error": f"Timeout after {timeout}s"},
+                                **getattr(e, "report", {})), 408)
+        except ConnectionAbortedError:
+            # The client hung up, so its command was killed and nobody waits for a reply
+            self.close_connection = True
+        except Exception as e:
+            self.send_json({"success": False, "error": str(e)}, 500)
+
+    def handle_upload_chunk(self, query):
+        try:
+            upload_id = query.get("id", [""])[0]
+            offset = int(query.get("offset", ["0"])[0])
+            size = UPLOADS.write(upload_id, offset, self.read_body_decoded())
+            self.send_json({"success": True, "upload_id": upload_id, "offset": size})
+        except KeyError as e:
+            self.close_connection = True
+            self.send_json({"success": False, "error": e.args[0]}, 404, {"Connection": "close"})
+        except UploadOffsetError as e:
+            # The body was not read; drop the connection rather than parse it as a request
+            self.close_connection = True
+            self.send_json({"success": False, "error": str(e), "offset": e.offset}, 409, {"Connection": "close"})
+        except UnsupportedEncodingError as e:
+            self.close_connection = True
+            self.send_json({"success": False, "error": str(e)}, 415, {"Connection": "close"})
+        except Exception as e:
+            self.close_connection = True
+            self.send_json({"success": False, "error": str(e)}, 500, {"Connection": "close"})
+
+    def handle_upload(self, action, data):
+        try:
+            if action == "open":
+                upload_id, offset = UPLOADS.open(data.get("path", ""), data.get("upload_id"))
+                self.send_json({"success": True, "upload_id": upload_id, "offset": offset})
+            elif action == "status":
+                self.send_json({"success": True, "upload_id": data.get("upload_id", ""),
+                                "offset": UPLOADS.status(data.get("upload_id", ""))})
+            elif action == "commit":
+                path, size, digest = UPLOADS.commit(data.get("upload_id", ""), data.get("sha256"), data.get("size"))
+                METADATA.invalidate(path)
+                self.send_json({"success": True, "path": path, "size": size, "sha256": digest})
+            elif action == "abort":
+                UPLOADS.abort(data.get("upload_id", ""))
+                self.send_json({"success": True, "upload_id": data.get("upload_id", "")})
+            else:
+                self.send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
+        except KeyError as e:
+            self.send_json({"success": False, "error": e.args[0]}, 404)
+        except UploadVerifyError as e:
+            self.send_json({"success": False, "error": str(e)}, 409)
+        except Exception as e:
+            self.send_json({"success": False, "error": str(e)}, 500)
+
+    def handle_delta(self, action, data):
+        path = data.get("path", "")
+        try:
+            if action == "signature":
+                if not os.path.isfile(path):
+                    self.send_json({"success": True, "path": path, "exists": False})
+                    return
+                with open(path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    block_size = data.get("block_size") or delta_block_size(st.st_size)
+                    size, digest, blocks = file_signature(f, block_size)
+                result = {"success": True, "path": path, "exists": True, "size": size, "sha256": digest,
+                          "mtime_ns": st.st_mtime_ns, "block_size": block_size}
+                # The caller already has this content, so it needs no blocks
+                result["unchanged"] = data.get("size") == size and data.get("sha256") == digest
+                if not result["unchanged"]:
+                    result["blocks"] = blocks
+                self.send_json(result)
+            elif action == "apply":
+                st = os.stat(path)
+                if (data.get("base_size", st.st_size) != st.st_size
+                        or data.get("base_mtime_ns", st.st_mtime_ns) != st.st_mtime_ns):
+                    self.send_json({"success": False, "path": path,
+                                    "error": "File changed since its signature was taken"}, 409)
+                    return
+                block_size = data.get("block_size")
+                if not block_size:
+                    raise ValueError("block_size is required")
+                tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                try:
+                    with open(path, "rb") as base, open(tmp, "wb") as out:
+                        size, digest = apply_delta(base, data.get("ops", []), block_size, out)
+                    if data.get("size", size) != size or data.get("sha256", digest) != digest:
+                        remove_quietly(tmp)
+                        self.send_json({"success": False, "path": path, "size": size, "sha256": digest,
+                                        "error": "Rebuilt file does not match the expected size/sha256"}, 409)
+                        return
+                    shutil.copymode(path, tmp)
+                    os.replace(tmp, path)
+                except BaseException:
+                    remove_quietly(tmp)
+                    raise
+                METADATA.invalidate(path)
+                self.send_json({"success": True, "path": path, "size": size, "sha256": digest})
+            elif action == "compute":
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256()
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+                    size = f.tell()
+                    result = {"success": True, "path": path, "size": size, "sha256": digest.hexdigest()}
+                    result["unchanged"] = data.get("size") == size and data.get("sha256") == result["sha256"]
+                    if not result["unchanged"]:
+                        view = map_file(f)
+                        try:
+                            delta = compute_delta(view, data.get("block_size") or delta_block_size(size),
+                                                  data.get("blocks", []), data.get("size", 0),
+                                                  min(DELTA_MAX_LITERAL, size * 3 // 4))
+                        finally:
+                            if isinstance(view, mmap.mmap):
+                                view.close()
+                        # Without a delta the caller fetches the whole file instead
+                        result["delta"] = delta is not None
+                        if delta is not None:
+                            result["ops"], result["literal_bytes"] = delta
+                self.send_json(result)
+            else:
+                self.send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
+        except FileNotFoundError as e:
+            self.send_json({"success": False, "error": str(e)}, 404)
+        except ValueError as e:
+            self.send_json({"success": False, "error": str(e)}, 400)
+        except Exception as e:
+            self.send_json({"success": False, "error": str(e)}, 500)
+
+    def handle_jobs(self, action, data):
+        try:
+            if action == "start":
+                job = JOBS.start(data.get("cmd", ""), data.get("shell", "cmd"),
+                                 number_option(data, "timeout", None), data.get("spill", False))
+                self.send_json(dict(job.status(), success=True))
+            elif action == "list":
+                self.send_json({"success": True, "jobs": [job.status() for job in JOBS.list()]})
+            elif action in ("status", "output", "wait", "kill"):
+                job = JOBS.get(data.get("id", ""))
+                if action == "output":
+                    result = job.output(int_option(data, "stdout_offset", 0), int_option(data, "stderr_offset", 0),
+                                        int_option(data, "max_bytes", 65536, 1))
+                    result["running"] = not job.done.is_set()
+                    self.send_json(dict(result, success=True, id=job.id))
+                    return
+                if action == "wait":
+                    job.done.wait(number_option(data, "timeout", 30))
+                elif action == "kill":
+                    job.kill()
+                    job.done.wait(5)
+                self.send_json(dict(job.status(), success=True))
+            else:
+                self.send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
+        except KeyError as e:
+            self.send_json({"success": False, "error": e.args[0]}, 404)
+        except ValueError as e:
+            self.send_json({"success": False, "error": str(e)}, 400)
+        except Exception as e:
+            self.send_json({"success": False, "error": str(e)}, 500)
 
+    def handle_post(self, data):
         # Execute shell command (cmd.exe)
         if self.path == "/exec":
             cmd = data.get("cmd", "")
             timeout = data.get("timeout", 300)
             try:
-                r = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
-                self.send_json({
-                    "success": r.returncode == 0,
-                    "stdout": r.stdout,
-                    "stderr": r.stderr,
-                    "returncode": r.returncode
-                })
-            except subprocess.TimeoutExpired:
-                self.send_json({"success": False, "error": f"Timeout after {timeout}s"}, 408)
-            except Exception as e:
-                self.send_json({"success": False, "error": str(e)}, 500)
+                shaper = OutputShaper.from_request(data)
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            if data.get("stream"):
+                self.stream_command_result(cmd, True, timeout, shaper)
+            else:
+                self.send_command_result(cmd, True, timeout, self.shell_pool(data), shaper)
 
         # Execute PowerShell command
         elif self.path == "/powershell":
             cmd = data.get("cmd", "")
             timeout = data.get("timeout", 300)
             try:
-                r = subprocess.run(
-                    ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", cmd],
-                    capture_output=True, text=True, timeout=timeout
-                )
-                self.send_json({
-                    "success": r.returncode == 0,
-                    "stdout": r.stdout,
-                    "stderr": r.stderr,
-                    "returncode": r.returncode
-                })
-            except subprocess.TimeoutExpired:
-                self.send_json({"success": False, "error": f"Timeout after {timeout}s"}, 408)
-            except Exception as e:
-                self.send_json({"success": False, "error": str(e)}, 500)
+                shaper = OutputShaper.from_request(data)
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            if data.get("stream"):
+                self.stream_command_result(POWERSHELL + [cmd], False, timeout, shaper)
+            else:
+                self.send_command_result(POWERSHELL + [cmd], False, timeout, self.shell_pool(data), shaper)
+
+        # Background jobs
+        elif self.path.startswith("/jobs/"):
+            self.handle_jobs(self.path[len("/jobs/"):], data)
 
-        # Read file
+        # Cancel the work started by another request
+        elif self.path == "/cancel":
+            request_id = data.get("request_id", "")
+            killed = PROCESSES.cancel(request_id)
+            self.send_json({
+                "success": True,
+                "request_id": request_id,
+                "killed": len(killed),
+                "processes": killed
+            })
+
+        # Read file (optionally a byte range of it)
         elif self.path == "/read":
             path = data.get("path", "")
             try:
+                offset = int_option(data, "offset", 0)
+                length = int_option(data, "length", None)
+                max_bytes = min(int_option(data, "max_bytes", READ_MAX_BYTES), READ_MAX_BYTES)
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            try:
+                with open(path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    offset = min(offset, size)
+                    count = size - offset if length is None else min(length, size - offset)
+                    if count > max_bytes:
+                        self.send_json({
+                            "success": False,
+                            "path": path,
+                            "size": size,
+                            "error": f"{count} bytes requested, limit is {max_bytes}; "
+                                     f"page with offset/length or fetch GET /raw"
+                        }, 413)
+                        return
+                    f.seek(offset)
+                    raw = f.read(count)
+                result = {"path": path, "offset": offset, "length": len(raw), "size": size,
+                          "eof": offset + len(raw) >= size}
                 if data.get("binary"):
-                    with open(path, "rb") as f:
-                        content = base64.b64encode(f.read()).decode()
-                    self.send_json({"success": True, "content": content, "path": path, "binary": True})
+                    content = base64.b64encode(raw).decode()
+                    self.send_json(dict(result, success=True, content=content, binary=True), cacheable=True)
                 else:
-                    with open(path, "r", encoding="utf-8", errors="replace") as f:
-                        content = f.read()
-                    self.send_json({"success": True, "content": content, "path": path})
+                    self.send_json(dict(result, success=True, content=decode_text(raw)), cacheable=True)
             except Exception as e:
                 self.send_json({"success": False, "error": str(e)}, 500)
 
-        # Write file
+        # Read every file in a directory matching a glob, in one response
+        elif self.path == "/readmany":
+            directory = data.get("directory", ".")
+            try:
+                # read_many is a generator, so bad limits would only surface mid-reply
+                frames = read_many(
+                    directory,
+                    data.get("pattern", "*"),
+                    data.get("recursive", False),
+                    int_option(data, "max_files", 1000),
+                    int_option(data, "max_file_bytes", 1 << 20),
+                    int_option(data, "max_total_bytes", 32 << 20),
+                    data.get("binary", False)
+                )
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            if not isinstance(directory, str) or not os.path.isdir(directory):
+                self.send_json({"success": False, "error": f"Not a directory: {directory}"}, 404)
+            elif data.get("stream"):
+                self.stream_frames(frames)
+            else:
+                files, errors, truncated = {}, {}, []
+                try:
+                    for frame in frames:
+                        if frame["type"] == "file":
+                            files[frame["path"]] = frame["content"]
+                            if frame["truncated"]:
+                                truncated.append(frame["path"])
+                        elif frame["type"] == "error":
+                            errors[frame["path"]] = frame["error"]
+                        else:
+                            end = frame
+                except Exception as e:
+                    self.send_json({"success": False, "error": str(e)}, 500)
+                    return
+                end.pop("type")
+                self.send_json(dict(end, directory=directory, files=files, errors=errors,
+                                    truncated=truncated, binary=data.get("binary", False)))
+
+        # Run a list of operations in one request
+        elif self.path == "/batch":
+            ops = data.get("ops", [])
+            if not isinstance(ops, list) or len(ops) > BATCH_MAX_OPS:
+                self.send_json({"success": False, "error": f"ops must be a list of at most {BATCH_MAX_OPS}"}, 400)
+                return
+            self.send_json(run_batch(
+                self,
+                ops,
+                data.get("stop_on_error", True),
+                data.get("parallel", False),
+                data.get("max_workers", 8)
+            ))
+
+        # Write file (via a temp file, so a failed write never leaves a partial file)
         elif self.path == "/write":
             path = data.get("path", "")
             content = data.get("content", "")
@@ -113,49 +3696,161 @@ class Handler(BaseHTTPRequestHandler):
                 if parent:
                     os.makedirs(parent, exist_ok=True)
 
-                if data.get("binary"):
-                    with open(path, "wb") as f:
-                        f.write(base64.b64decode(content))
-                else:
-                    with open(path, "w", encoding="utf-8") as f:
-                        f.write(content)
+                tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                try:
+                    if data.get("binary"):
+                        with open(tmp, "wb") as f:
+                            f.write(base64.b64decode(content))
+                    else:
+                        with open(tmp, "w", encoding="utf-8") as f:
+                            f.write(content)
+                    os.replace(tmp, path)
+                except BaseException:
+                    remove_quietly(tmp)
+                    raise
+                METADATA.invalidate(path)
                 self.send_json({"success": True, "path": path})
             except Exception as e:
                 self.send_json({"success": False, "error": str(e)}, 500)
 
+        # Chunked, resumable uploads
+        elif self.path.startswith("/upload/"):
+            self.handle_upload(self.path[len("/upload/"):], data)
+
+        # Block signatures and deltas, so changed files move only their changed blocks
+        elif self.path.startswith("/delta/"):
+            self.handle_delta(self.path[len("/delta/"):], data)
+
         # List directory
         elif self.path == "/ls":
             path = data.get("path", ".")
             try:
-                items = []
-                for name in os.listdir(path):
-                    full_path = os.path.join(path, name)
-                    item = {
-                        "name": name,
-                        "type": "dir" if os.path.isdir(full_path) else "file"
-                    }
-                    try:
-                        item["size"] = os.path.getsize(full_path)
-                    except:
-                        pass
-                    items.append(item)
-                self.send_json({"success": True, "path": path, "items": items})
+                listing = DirectoryListing(
+                    path,
+                    recursive=data.get("recursive", False),
+                    max_depth=data.get("max_depth"),
+                    pattern=data.get("pattern"),
+                    kind=data.get("type"),
+                    min_size=data.get("min_size"),
+                    max_size=data.get("max_size"),
+                    modified_after=data.get("modified_after"),
+                    modified_before=data.get("modified_before"),
+                    sort=data.get("sort"),
+                    cursor=data.get("cursor"),
+                    limit=data.get("limit"),
+                    details=data.get("details", False)
+                )
+                if data.get("stream"):
+                    self.stream_frames(listing.frames())
+                    return
+                # Recursive listings can change below the top directory without touching its mtime
+                key = None if listing.max_depth else cache_path(path)
+                listing.names, validator = METADATA.get(key, path) if key else (None, None)
+                cached = listing.names is not None
+                result = {"success": True, "path": path, "items": list(listing)}
+                if listing.next_cursor:
+                    result["next_cursor"] = listing.next_cursor
+                if listing.errors:
+                    result["errors"] = listing.errors
+                if key and not cached:
+                    METADATA.put(key, path, validator, listing.names)
+                self.send_json(result, cacheable=True)
             except Exception as e:
                 self.send_json({"success": False, "error": str(e)}, 500)
 
-        # Download file from URL
+        # Search file contents under a directory
+        elif self.path == "/search":
+            try:
+                search = ContentSearch(
+                    data.get("path", "."),
+                    data.get("query", ""),
+                    regex=data.get("regex", False),
+                    ignore_case=data.get("ignore_case", False),
+                    include=data.get("include"),
+                    exclude=data.get("exclude"),
+                    max_depth=int_option(data, "max_depth", None),
+                    context=int_option(data, "context", 0),
+                    max_matches=int_option(data, "max_matches", 1000),
+                    max_matches_per_file=int_option(data, "max_matches_per_file", None),
+                    max_file_bytes=int_option(data, "max_file_bytes", None),
+                    workers=int_option(data, "workers", SEARCH_WORKERS)
+                )
+            except (ValueError, TypeError, re.error) as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            if not os.path.exists(search.path):
+                self.send_json({"success": False, "error": f"Path not found: {search.path}"}, 404)
+            elif data.get("stream"):
+                self.stream_frames(search)
+            else:
+                matches, errors = [], {}
+                for frame in search:
+                    if frame["type"] == "matches":
+                        matches.extend(dict(match, path=frame["path"]) for match in frame["matches"])
+                    elif frame["type"] == "error":
+                        errors[frame["path"]] = frame["error"]
+                    else:
+                        result = {k: v for k, v in frame.items() if k != "type"}
+                matches.sort(key=lambda match: (match["path"], match["line"]))
+                self.send_json(dict(result, path=search.path, results=matches, errors=errors))
+
+        # Hash many files, or every file under a directory
+        elif self.path == "/hash":
+            algorithms = data.get("algorithms") or ["sha256"]
+            if isinstance(algorithms, str):
+                algorithms = [algorithms]
+            unknown = [a for a in algorithms if a not in HASH_ALGORITHMS]
+            if unknown:
+                self.send_json({"success": False, "error": f"Unsupported algorithm(s) {', '.join(unknown)}; "
+                                                           f"choose from {', '.join(HASH_ALGORITHMS)}"}, 400)
+                return
+            paths = list(data.get("paths") or [])
+            if data.get("path"):
+                if not os.path.isdir(data["path"]):
+                    self.send_json({"success": False, "error": f"Not a directory: {data['path']}"}, 404)
+                    return
+                matched = match_files(data["path"], data.get("pattern", "*"), data.get("recursive", True))
+                paths = itertools.chain(paths, (full for _, full in matched))
+            frames = hash_files(paths, algorithms, data.get("use_cache", True),
+                                data.get("workers", HASH_WORKERS))
+            if data.get("stream"):
+                self.stream_frames(frames)
+                return
+            files, errors = [], {}
+            for frame in frames:
+                if frame["type"] == "file":
+                    files.append({k: v for k, v in frame.items() if k != "type"})
+                elif frame["type"] == "error":
+                    errors[frame["path"]] = frame["error"]
+                else:
+                    result = {k: v for k, v in frame.items() if k != "type"}
+            files.sort(key=lambda item: item["path"])
+            self.send_json(dict(result, results=files, errors=errors))
+
+        # Download files from URLs, in parallel segments with resume
         elif self.path == "/download":
-            url = data.get("url", "")
-            dst = data.get("dst", "")
+            specs = data.get("downloads") or [{"url": data.get("url", ""), "dst": data.get("dst", ""),
+                                               "sha256": data.get("sha256")}]
             try:
-                import urllib.request
-                parent = os.path.dirname(dst)
-                if parent:
-                    os.makedirs(parent, exist_ok=True)
-                urllib.request.urlretrieve(url, dst)
-                self.send_json({"success": True, "dst": dst, "size": os.path.getsize(dst)})
-            except Exception as e:
-                self.send_json({"success": False, "error": str(e)}, 500)
+                if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+                    raise ValueError("downloads must be a list of {url, dst, sha256} objects")
+                segments = int_option(data, "segments", DOWNLOAD_SEGMENTS, 1)
+                downloads = [Download(spec.get("url", ""), spec.get("dst", ""), spec.get("sha256"), segments)
+                             for spec in specs]
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            frames = run_downloads(downloads)
+            if data.get("stream"):
+                self.stream_frames(frames)
+                return
+            for frame in frames:
+                pass
+            if "downloads" in data:
+                self.send_json({"success": frame["success"], "results": frame["results"]})
+            else:
+                result = frame["results"][0]
+                self.send_json(result, 200 if result["success"] else 500)
 
         # Delete file/directory
         elif self.path == "/delete":
@@ -165,32 +3860,63 @@ class Handler(BaseHTTPRequestHandler):
                     shutil.rmtree(path)
                 else:
                     os.remove(path)
+                METADATA.invalidate(path)
                 self.send_json({"success": True, "path": path})
             except Exception as e:
                 self.send_json({"success": False, "error": str(e)}, 500)
 
-        # Copy file/directory
-        elif self.path == "/copy":
-            src = data.get("src", "")
-            dst = data.get("dst", "")
+        # Copy or move a file/directory tree
+        elif self.path in ("/copy", "/move"):
             try:
-                if os.path.isdir(src):
-                    shutil.copytree(src, dst)
-                else:
-                    shutil.copy2(src, dst)
-                self.send_json({"success": True, "src": src, "dst": dst})
+                transfer = TreeCopy(
+                    data.get("src", ""),
+                    data.get("dst", ""),
+                    move=self.path == "/move",
+                    incremental=data.get("incremental", False),
+                    merge=data.get("merge", False),
+                    workers=int_option(data, "workers", COPY_WORKERS)
+                )
+            except FileNotFoundError as e:
+                self.send_json({"success": False, "error": str(e)}, 404)
+                return
+            except FileExistsError as e:
+                self.send_json({"success": False, "error": str(e)}, 409)
+                return
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
             except Exception as e:
                 self.send_json({"success": False, "error": str(e)}, 500)
-
-        # Move file/directory
-        elif self.path == "/move":
-            src = data.get("src", "")
-            dst = data.get("dst", "")
+                return
             try:
-                shutil.move(src, dst)
-                self.send_json({"success": True, "src": src, "dst": dst})
+                if data.get("stream"):
+                    self.stream_frames(transfer)
+                    return
+                for frame in transfer:
+                    pass
+                self.send_json({k: v for k, v in frame.items() if k != "type"})
             except Exception as e:
                 self.send_json({"success": False, "error": str(e)}, 500)
+            finally:
+                METADATA.invalidate(transfer.src, transfer.dst)
+
+        # Stream a directory tree out as a tar or zip archive
+        elif self.path == "/pack":
+            try:
+                archive = TreeArchive(
+                    data.get("path", ""),
+                    data.get("format", "tar"),
+                    compress=data.get("compress", True),
+                    include=data.get("include"),
+                    exclude=data.get("exclude")
+                )
+            except ValueError as e:
+                self.send_json({"success": False, "error": str(e)}, 400)
+                return
+            if not os.path.isdir(archive.path):
+                self.send_json({"success": False, "error": f"Not a directory: {archive.path}"}, 404)
+            else:
+                self.send_archive(archive)
 
         # Check if path exists
         elif self.path == "/exists":
@@ -201,40 +3927,522 @@ class Handler(BaseHTTPRequestHandler):
                 "isfile": os.path.isfile(path),
                 "isdir": os.path.isdir(path),
                 "path": path
-            })
+            }, cacheable=True)
 
         else:
             self.send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
 
     def log_message(self, format, *args):
-        print(f"[{self.log_date_time_string()}] {args[0]} {args[1]} {args[2]}")
+        if format.startswith("Request timed out"):
+            return  # idle keep-alive connection expiring, not an error
+        if len(args) == 3:
+            print(f"[{self.log_date_time_string()}] {args[0]} {args[1]} {args[2]}")
+        else:
+            print(f"[{self.log_date_time_string()}] {format % args}")
+
+
+class CapturedRequest(Handler):
+    """Runs one endpoint in-process and keeps its JSON reply instead of writing to a socket"""
+
+    def __init__(self, parent, path):
+        # BaseHTTPRequestHandler.__init__ would start serving a socket, so it is skipped
+        self.server = parent.server
+        self.headers = parent.headers
+        self.client_address = parent.client_address
+        self.parent = parent
+        self.path = path
+        self.status = None
+        self.result = None
+
+    def send_json(self, data, status=200, headers=None, cacheable=False):
+        self.status = status
+        self.result = data
+
+    def client_gone(self):
+        return self.parent.client_gone()
+
+
+def run_batch_op(parent, index, op):
+    """Run one /batch operation and describe its outcome"""
+    if not isinstance(op, dict):
+        return {"index": index, "success": False, "error": "Operation must be an object"}
+    path = "/" + str(op.get("op", "")).lstrip("/")
+    args = dict(op.get("args") or {})
+    args.pop("stream", None)  # replies have to fit in the batch response
+    request = CapturedRequest(parent, path)
+    if path in BATCH_GET_OPS:
+        request.do_GET()
+    elif path in BATCH_EXCLUDED_OPS or path.startswith("/upload/chunk"):
+        request.send_json({"success": False, "error": f"{path} cannot be used in a batch"}, 400)
+    else:
+        request.with_limit(path, request.handle_post, args)
+    result = request.result or {}
+    ok = request.status is not None and request.status < 400 and result.get("success", True) is not False
+    return {"index": index, "op": path, "status": request.status, "success": ok, "result": result}
+
+
+def run_batch(parent, ops, stop_on_error=True, parallel=False, max_workers=8):
+    """Run /batch operations in order, or concurrently when they are independent"""
+    results = [None] * len(ops)
+    failed = threading.Event()
+    if parallel:
+        def run(index):
+            if stop_on_error and failed.is_set():
+                return
+            results[index] = run_batch_op(parent, index, ops[index])
+            if not results[index]["success"]:
+                failed.set()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ops) or 1))) as executor:
+            list(executor.map(run, range(len(ops))))
+    else:
+        for index, op in enumerate(ops):
+            results[index] = run_batch_op(parent, index, op)
+            if stop_on_error and not results[index]["success"]:
+                break
+    for index, result in enumerate(results):
+        if result is None:
+            op = ops[index].get("op", "") if isinstance(ops[index], dict) else ""
+            results[index] = {"index": index, "op": "/" + str(op).lstrip("/"), "skipped": True, "success": False}
+    failures = sum(1 for r in results if not r["success"] and not r.get("skipped"))
+    skipped = sum(1 for r in results if r.get("skipped"))
+    return {
+        "success": failures == 0 and skipped == 0,
+        "completed": len(ops) - skipped,
+        "failed": failures,
+        "skipped": skipped,
+        "results": results
+    }
+
+
+# Multiplexed transport: after GET /mux with "Upgrade: mcp-mux/1" is answered 101, the
+# connection carries frames of MUX_HEADER (payload length, type, flags, stream id) + payload.
+# The client opens a stream with OPEN {"method", "path", "headers"} and sends any body as
+# DATA frames; the server answers REPLY {"status", "reason", "headers"} followed by DATA
+# frames of the body (raw bytes, NDJSON lines for streamed endpoints). END marks the last
+# frame in each direction. DATA is flow-controlled per stream: a side may have at most the
+# peer's Mux-Window bytes unacknowledged, and WINDOW frames (a 4-byte increment) grant more
+# as the receiver consumes them. RESET abandons a stream; PING is echoed back.
+MUX_HEADER = struct.Struct(">IBBI")
+MUX_OPEN, MUX_REPLY, MUX_DATA, MUX_WINDOW_UPDATE, MUX_RESET, MUX_PING = range(1, 7)
+MUX_END = 1
+MUX_FRAME_LIMIT = 16 << 20  # frames bigger than this are a protocol error
+MUX_INCREMENT = struct.Struct(">I")
+
+
+def read_frame(rfile):
+    """Read one frame as (type, flags, stream id, payload), or None at end of input"""
+    header = rfile.read(MUX_HEADER.size)
+    if len(header) < MUX_HEADER.size:
+        return None
+    length, kind, flags, stream_id = MUX_HEADER.unpack(header)
+    if length > MUX_FRAME_LIMIT:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MUX_FRAME_LIMIT} byte limit")
+    payload = rfile.read(length) if length else b""
+    if len(payload) < length:
+        raise ConnectionError("Connection closed inside a frame")
+    return kind, flags, stream_id, payload
+
+
+class MuxWindow:
+    """Bytes a stream may still send before the peer grants more"""
+
+    def __init__(self, size):
+        self.size = size
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def take(self, wanted):
+        with self.cond:
+            while self.size <= 0 and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                raise ConnectionAbortedError("Stream reset")
+            taken = min(wanted, self.size)
+            self.size -= taken
+            return taken
+
+    def grant(self, size):
+        with self.cond:
+            self.size += size
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class MuxStream:
+    """One request on a mux connection: its incoming body and a flow-controlled writer for the reply"""
+
+    def __init__(self, session, stream_id):
+        self.session = session
+        self.id = stream_id
+        self.request_id = None
+        self.inbound = queue.Queue()  # body pieces; None at the end, an exception if reset
+        self.buffered = 0  # body bytes queued in inbound; the window we granted bounds it
+        self.received_end = False
+        self.lock = threading.Lock()
+        self.window = MuxWindow(session.peer_window)
+        self.consumed = 0  # body bytes read but not yet granted back to the client
+        self.pending = b""  # REPLY frame, held back to go out with the first DATA frame
+        self.last_write = False  # the next write completes the reply, so it carries END
+        self.written = 0
+        self.ended = False
+
+    def feed(self, data, end):
+        if data:
+            with self.lock:
+                self.buffered += len(data)
+                if self.buffered > MUX_WINDOW:
+                    raise ValueError(f"Stream {self.id} sent more than its window")
+            self.inbound.put(data)
+        if end:
+            self.received_end = True
+            self.inbound.put(None)
+
+    def body(self):
+        """Yield the request body as it arrives, granting the client more window as it is consumed"""
+        while True:
+            piece = self.inbound.get()
+            if piece is None:
+                return
+            if isinstance(piece, Exception):
+                raise piece
+            with self.lock:
+                self.buffered -= len(piece)
+            # Grants are batched; a quarter of the window keeps the client from stalling
+            self.consumed += len(piece)
+            if self.consumed >= MUX_WINDOW // 4:
+                self.session.send(MUX_WINDOW_UPDATE, self.id, MUX_INCREMENT.pack(self.consumed))
+                self.consumed = 0
+            yield piece
+
+    def reply(self, status, reason, headers):
+        payload = json.dumps({"status": status, "reason": reason, "headers": headers}).encode()
+        self.pending = MUX_HEADER.pack(len(payload), MUX_REPLY, 0, self.id) + payload
+
+    def send_data(self, data):
+        view = memoryview(data)
+        while view:
+            count = self.window.take(min(len(view), MUX_MAX_FRAME))
+            end = self.last_write and count == len(view)
+            self.session.send(MUX_DATA, self.id, view[:count], MUX_END if end else 0, self.pending)
+            self.pending = b""
+            self.ended = self.ended or end
+            view = view[count:]
+
+    # File-like and socket-like enough to stand in for a handler's wfile and connection
+
+    def write(self, data):
+        self.send_data(data)
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def closed(self):
+        return self.window.closed
+
+    def sendfile(self, f, offset, count):
+        f.seek(offset)
+        while count:
+            chunk = f.read(min(count, MUX_MAX_FRAME))
+            if not chunk:
+                break
+            self.send_data(chunk)
+            count -= len(chunk)
+
+    def finish(self):
+        if not self.ended and not self.window.closed:
+            self.ended = True
+            self.session.send(MUX_DATA, self.id, b"", MUX_END, self.pending)
+
+    def reset(self):
+        self.window.close()
+        self.inbound.put(ConnectionAbortedError("Stream reset by client"))
+        if self.request_id:
+            PROCESSES.cancel(self.request_id)
+
+
+class MuxSession:
+    """An upgraded connection carrying many concurrent requests, each on its own stream"""
+
+    def __init__(self, handler, peer_window=MUX_WINDOW):
+        self.handler = handler
+        self.peer_window = peer_window
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=MUX_MAX_STREAMS, thread_name_prefix="mux")
+
+    def send(self, kind, stream_id, payload=b"", flags=0, before=b""):
+        """Write one frame, after the already-framed bytes in before, as a single write"""
+        header = MUX_HEADER.pack(len(payload), kind, flags, stream_id)
+        with self.write_lock:
+            if self.closed:
+                raise ConnectionAbortedError("Connection closed")
+            self.handler.wfile.write(before + header + bytes(payload))
+
+    def run(self):
+        try:
+            while True:
+                frame = read_frame(self.handler.rfile)
+                if frame is None:
+                    break
+                kind, flags, stream_id, payload = frame
+                with self.lock:
+                    stream = self.streams.get(stream_id)
+                if kind == MUX_OPEN and stream is None:
+                    with self.lock:
+                        full = len(self.streams) >= MUX_MAX_STREAMS + MUX_MAX_QUEUED
+                    if full:
+                        self.refuse(stream_id, flags & MUX_END)
+                        continue
+                    stream = MuxStream(self, stream_id)
+                    with self.lock:
+                        self.streams[stream_id] = stream
+                    stream.feed(b"", flags & MUX_END)
+                    self.executor.submit(self.serve, stream, json.loads(payload))
+                elif kind == MUX_PING:
+                    self.send(MUX_PING, 0, payload, MUX_END)
+                elif stream is None:
+                    continue  # frames racing a stream that already finished
+                elif kind == MUX_DATA:
+                    stream.feed(payload, flags & MUX_END)
+                elif kind == MUX_WINDOW_UPDATE:
+                    stream.window.grant(MUX_INCREMENT.unpack(payload)[0])
+                elif kind == MUX_RESET:
+                    stream.reset()
+        except (OSError, ValueError):
+            pass  # the bridge went away or broke the protocol; drop the connection
+        finally:
+            with self.write_lock:
+                self.closed = True
+            with self.lock:
+                streams = list(self.streams.values())
+            for stream in streams:
+                stream.reset()
+            self.executor.shutdown(wait=False)
+
+    def refuse(self, stream_id, end):
+        """Answer a stream over the connection's cap with 503 busy, as PooledHTTPServer does with a full queue"""
+        METRICS.inc("mcp_mux_rejected_total")
+        body = json.dumps({
+            "success": False,
+            "busy": True,
+            "error": f"Server busy: {MUX_MAX_STREAMS + MUX_MAX_QUEUED} requests already open on this connection"
+        }).encode()
+        reply = json.dumps({"status": 503, "reason": "Service Unavailable", "headers": {
+            "Content-Type": "application/json", "Content-Length": str(len(body)), "Retry-After": "1"
+        }}).encode()
+        self.send(MUX_DATA, stream_id, body, MUX_END, MUX_HEADER.pack(len(reply), MUX_REPLY, 0, stream_id) + reply)
+        if not end:
+            self.send(MUX_RESET, stream_id)  # its body is not wanted
+
+    def serve(self, stream, request):
+        try:
+            with self.handler.server.stream_slots:
+                if stream.window.closed:
+                    raise ConnectionAbortedError("Stream reset while waiting for a worker")
+                MuxRequest(self, stream, request).run()
+            stream.finish()
+            if not stream.received_end and not stream.window.closed:
+                # Answered before the whole body arrived (busy, bad request): stop the client sending it
+                self.send(MUX_RESET, stream.id)
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            pass
+        except Exception as e:
+            print(f"[mux] stream {stream.id} failed: {e}")
+            try:
+                self.send(MUX_RESET, stream.id)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.streams.pop(stream.id, None)
+
+
+class MuxRequest(Handler):
+    """Runs one endpoint for a mux stream, writing its reply as REPLY and DATA frames"""
+
+    def __init__(self, session, stream, request):
+        # Like CapturedRequest, BaseHTTPRequestHandler.__init__ is skipped: there is no socket of our own
+        parent = session.handler
+        self.server = parent.server
+        self.client_address = parent.client_address
+        self.command = str(request.get("method", "GET")).upper()
+        self.path = str(request.get("path", "/"))
+        self.request_version = "HTTP/1.1"
+        self.requestline = f"{self.command} {self.path} {MUX_PROTOCOL}"
+        self.headers = http.client.HTTPMessage()
+        for name, value in (request.get("headers") or {}).items():
+            self.headers[name] = str(value)
+        stream.request_id = self.headers.get("X-Request-Id")
+        self.stream = stream
+        self.wfile = self.connection = stream
+        self.close_connection = False
+        self.started = time.monotonic()
+        self.response_code = None
+        self.reply_headers = {}
+        self.bytes_in = 0
+
+    def run(self):
+        METRICS.inc("mcp_requests_in_flight")
+        try:
+            if self.command == "GET":
+                self.do_GET()
+            elif self.command == "HEAD":
+                self.do_HEAD()
+            elif self.command == "POST":
+                self.do_POST()
+            else:
+                self.send_json({"error": f"Unsupported method: {self.command}"}, 405)
+        finally:
+            self.record_request()
+
+    def handle_mux(self):
+        self.send_json({"success": False, "error": "Already on a mux connection"}, 400)
+
+    def abort_stream(self):
+        # A reply that simply stops would end with END; RESET marks it cut short
+        self.stream.ended = True
+        self.stream.session.send(MUX_RESET, self.stream.id)
+
+    def client_gone(self):
+        # Reset streams and dropped connections close the window
+        return self.stream.closed
+
+    def send_json(self, data, status=200, headers=None, cacheable=False):
+        # A JSON body is the whole reply: its last frame can carry END
+        self.stream.last_write = True
+        super().send_json(data, status, headers, cacheable)
+
+    def send_response(self, code, message=None):
+        self.log_request(code)
+        self.response_code = code
+        self.reply_reason = message or self.responses.get(code, ("",))[0]
+        self.reply_headers = {}
+
+    def send_header(self, keyword, value):
+        # Framing replaces chunked encoding, and the connection is not this request's to close
+        if keyword.lower() not in ("transfer-encoding", "connection"):
+            self.reply_headers[keyword] = str(value)
+
+    def end_headers(self):
+        self.stream.reply(self.response_code, self.reply_reason, self.reply_headers)
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(data)
+
+    def end_stream(self):
+        if self.stream_compressor:
+            self.write_chunk(self.stream_compressor.flush())
+
+    def read_body(self, size=1 << 20):
+        for piece in self.stream.body():
+            self.bytes_in += len(piece)
+            yield piece
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Windows God-Mode MCP Server")
+    parser.add_argument("port", nargs="?", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker threads")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Connections waiting for a worker before replying busy")
+    parser.add_argument("--shell-pool", type=int, default=SHELL_POOL_SIZE, metavar="N",
+                        help="Keep N warm interpreters each for /exec and /powershell")
+    parser.add_argument("--powershell", default=POWERSHELL[0],
+                        help="PowerShell binary, e.g. pwsh")
+    parser.add_argument("--hash-cache", default=HASH_CACHE_PATH, metavar="PATH",
+                        help="SQLite file caching /hash results ('' disables)")
+    parser.add_argument("--download-connections", type=int, default=DOWNLOAD_CONNECTIONS, metavar="N",
+                        help="Connections open at once across all /download requests")
+    parser.add_argument("--download-rate", type=int, default=DOWNLOAD_RATE, metavar="BYTES",
+                        help="Bandwidth cap in bytes/s across all /download requests (0 = unlimited)")
+    parser.add_argument("--limit", action="append", default=[], metavar="ENDPOINT=N",
+                        help="Per-endpoint concurrency cap, e.g. --limit /exec=4 (0 = unlimited)")
+    args = parser.parse_args()
+    limits = dict(ENDPOINT_LIMITS)
+    for item in args.limit:
+        endpoint, _, n = item.partition("=")
+        if not n.isdigit():
+            parser.error(f"Invalid --limit {item!r}, expected ENDPOINT=N")
+        if int(n) > 0:
+            limits[endpoint] = int(n)
+        else:
+            limits.pop(endpoint, None)
+    args.limits = limits
+    return args
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    PORT = args.port
+    POWERSHELL[0] = args.powershell
+    HASHES.path = args.hash_cache
+    DOWNLOAD_SLOTS = threading.BoundedSemaphore(max(1, args.download_connections))
+    DOWNLOAD_LIMIT.rate = args.download_rate
+    if args.shell_pool > 0:
+        start_shell_pools(args.shell_pool)
     print("=" * 60)
     print("  Windows God-Mode MCP Server")
     print(f"  Listening on {HOST}:{PORT}")
     print("=" * 60)
     print(f"  Hostname: {os.environ.get('COMPUTERNAME', 'unknown')}")
     print(f"  User: {os.environ.get('USERNAME', 'unknown')}")
+    print(f"  Workers: {args.workers}, queue: {args.queue_size}, shell pool: {args.shell_pool}")
+    print(f"  Limits: {', '.join(f'{k}={v}' for k, v in sorted(args.limits.items())) or 'none'}")
     print("=" * 60)
     print("\nEndpoints:")
     print("  GET  /health          - Server health check")
     print("  GET  /info            - System information")
+    print("  GET  /metrics         - Prometheus metrics (requests, latency, bytes, subprocesses)")
+    print("  GET  /mux             - Upgrade to the multiplexed frame transport")
     print("  POST /exec            - Execute shell command")
     print("  POST /powershell      - Execute PowerShell command")
-    print("  POST /read            - Read file")
+    print("  POST /read            - Read file (optionally a byte range)")
+    print("  GET  /raw?path=...    - Stream file bytes, supports Range")
+    print("  POST /readmany        - Read all files matching a glob")
     print("  POST /write           - Write file")
-    print("  POST /ls              - List directory")
-    print("  POST /download        - Download file from URL")
+    print("  POST /upload/open     - Start or resume a chunked upload")
+    print("  POST /upload/chunk    - Upload raw bytes at ?id=...&offset=...")
+    print("  POST /upload/status   - Bytes received so far")
+    print("  POST /upload/commit   - Verify sha256 and move into place")
+    print("  POST /upload/abort    - Discard an upload")
+    print("  POST /delta/signature - Block signature of a file (or unchanged)")
+    print("  POST /delta/apply     - Rebuild a file from copy/data ops")
+    print("  POST /delta/compute   - Delta of a file against a signature")
+    print("  POST /ls              - List directory (recursive, filtered, paged)")
+    print("  POST /search          - Search file contents (literal or regex)")
+    print("  POST /hash            - Hash many files, cached by size and mtime")
+    print("  POST /download        - Download URLs (segmented, resumable, verified)")
     print("  POST /delete          - Delete file/directory")
-    print("  POST /copy            - Copy file/directory")
+    print("  POST /copy            - Copy file/directory (parallel, incremental)")
     print("  POST /move            - Move file/directory")
+    print("  POST /pack            - Stream a directory tree as tar, tar.gz or zip")
+    print("  POST /unpack?path=... - Extract a streamed tar or zip into a directory")
     print("  POST /exists          - Check if path exists")
+    print("  POST /batch           - Run several operations in one request")
+    print("  POST /cancel          - Cancel work started by a request id")
+    print("  POST /jobs/start      - Start a background job")
+    print("  POST /jobs/status     - Job status")
+    print("  POST /jobs/output     - Read job output from an offset")
+    print("  POST /jobs/wait       - Wait for a job to finish")
+    print("  POST /jobs/list       - List jobs")
+    print("  POST /jobs/kill       - Kill a job")
     print("=" * 60)
     print("\nPress Ctrl+C to stop\n")
 
     try:
-        HTTPServer((HOST, PORT), Handler).serve_forever()
+        PooledHTTPServer(
+            (HOST, PORT), Handler,
+            workers=args.workers, queue_size=args.queue_size, limits=args.limits
+        ).serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down...")
@@ -0,0 +1,111 @@
+"""
+/copy onto an existing directory: refused like shutil.copytree unless merge (or
+incremental) is asked for, in which case the trees are merged. Symlinked directories,
+which os.walk does not enter, are recreated as links.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def run(transfer):
+    for frame in transfer:
+        pass
+    return frame
+
+
+class TreeCopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dst = os.path.join(self.tmp, "dst")
+        write(os.path.join(self.src, "a.txt"), "new a")
+        write(os.path.join(self.src, "sub", "b.txt"), "new b")
+        write(os.path.join(self.dst, "a.txt"), "old a")
+        write(os.path.join(self.dst, "keep.txt"), "keep")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_existing_destination_is_refused(self):
+        with self.assertRaises(FileExistsError):
+            server.TreeCopy(self.src, self.dst)
+        self.assertEqual(read(os.path.join(self.dst, "a.txt")), "old a")
+        self.assertFalse(os.path.exists(os.path.join(self.dst, "sub")))
+
+    def test_new_destination_is_copied(self):
+        target = os.path.join(self.tmp, "fresh")
+        summary = run(server.TreeCopy(self.src, target))
+        self.assertTrue(summary["success"])
+        self.assertEqual(read(os.path.join(target, "a.txt")), "new a")
+        self.assertEqual(read(os.path.join(target, "sub", "b.txt")), "new b")
+
+    def test_merge_copies_into_existing_destination(self):
+        summary = run(server.TreeCopy(self.src, self.dst, merge=True))
+        self.assertTrue(summary["success"])
+        self.assertEqual(summary["copied"], 2)
+        self.assertEqual(read(os.path.join(self.dst, "a.txt")), "new a")
+        self.assertEqual(read(os.path.join(self.dst, "sub", "b.txt")), "new b")
+        self.assertEqual(read(os.path.join(self.dst, "keep.txt")), "keep")
+
+    def test_incremental_implies_merge(self):
+        summary = run(server.TreeCopy(self.src, self.dst, incremental=True))
+        self.assertTrue(summary["success"])
+        self.assertEqual(read(os.path.join(self.dst, "sub", "b.txt")), "new b")
+
+    def test_file_onto_existing_file_is_overwritten(self):
+        dst = os.path.join(self.dst, "a.txt")
+        summary = run(server.TreeCopy(os.path.join(self.src, "a.txt"), dst))
+        self.assertTrue(summary["success"])
+        self.assertEqual(read(dst), "new a")
+
+    def symlink_tree(self):
+        """Add src/link -> the real directory src/sub, or skip where symlinks need privileges"""
+        try:
+            os.symlink("sub", os.path.join(self.src, "link"), target_is_directory=True)
+        except (OSError, NotImplementedError) as e:
+            self.skipTest(f"cannot create symlinks: {e}")
+
+    def test_directory_symlink_is_recreated(self):
+        self.symlink_tree()
+        target = os.path.join(self.tmp, "fresh")
+        summary = run(server.TreeCopy(self.src, target))
+        self.assertTrue(summary["success"])
+        link = os.path.join(target, "link")
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.readlink(link), "sub")
+        self.assertEqual(read(os.path.join(link, "b.txt")), "new b")
+
+    def test_move_across_volumes_moves_directory_symlink(self):
+        self.symlink_tree()
+        target = os.path.join(self.tmp, "moved")
+        move = server.TreeCopy(self.src, target, move=True)
+        os.makedirs(target)  # an existing destination skips the whole-tree rename, as across volumes
+        move.dst = target
+        summary = run(move)
+        self.assertTrue(summary["success"])
+        self.assertTrue(os.path.islink(os.path.join(target, "link")))
+        self.assertFalse(os.path.lexists(self.src))
+
+
+if __name__ == "__main__":
+    unittest.main()
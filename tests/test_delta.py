@@ -0,0 +1,88 @@
+"""
+The rsync-style delta code is duplicated in server.py and bridge.py so each stays a
+single deployable file. These tests keep the two copies in step: a signature from one
+side, a delta computed by the other and the file rebuilt by the first must round-trip.
+"""
+
+import hashlib
+import inspect
+import io
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bridge  # noqa: E402
+import server  # noqa: E402
+
+SHARED = ("delta_block_size", "block_digest", "file_signature", "compute_delta", "apply_delta", "map_file")
+
+
+def randbytes(rng, n):
+    return rng.getrandbits(8 * n).to_bytes(n, "little") if n else b""
+
+
+def variants(rng):
+    """(name, base, new) pairs covering inserts, deletes, unaligned tails and empty files"""
+    base = randbytes(rng, 300_000)
+    block = bridge.delta_block_size(len(base))
+    yield "identical", base, base
+    yield "insert", base, base[:1000] + b"inserted" + base[1000:]
+    yield "delete", base, base[:5000] + base[5000 + block // 2:]
+    yield "overwrite", base, base[:block * 3] + randbytes(rng, block) + base[block * 4:]
+    yield "tail", base, base[:-7] + b"changed"
+    yield "append", base, base + randbytes(rng, block + 3)
+    yield "truncate", base, base[:len(base) // 3]
+    yield "unrelated", base, randbytes(rng, 50_000)
+    yield "empty base", b"", randbytes(rng, 10_000)
+    yield "empty new", base, b""
+
+
+def rebuild(signer, computer, base, new):
+    """Sign base with signer, describe new against it with computer, rebuild with signer"""
+    block_size = signer.delta_block_size(len(base))
+    size, _, blocks = signer.file_signature(io.BytesIO(base), block_size)
+    ops, literal = computer.compute_delta(new, block_size, blocks, size, len(new) + 1)
+    out = io.BytesIO()
+    rebuilt_size, sha256 = signer.apply_delta(io.BytesIO(base), ops, block_size, out)
+    return out.getvalue(), rebuilt_size, sha256, literal
+
+
+class DeltaTest(unittest.TestCase):
+
+    def test_copies_match(self):
+        for name in SHARED:
+            with self.subTest(name=name):
+                self.assertEqual(inspect.getsource(getattr(server, name)), inspect.getsource(getattr(bridge, name)))
+
+    def test_constants_match(self):
+        for name in ("DELTA_MIN_BLOCK", "DELTA_MAX_BLOCK"):
+            self.assertEqual(getattr(server, name), getattr(bridge, name))
+
+    def test_round_trip(self):
+        rng = random.Random(14)
+        directions = (("bridge signs, server computes", bridge, server),
+                      ("server signs, bridge computes", server, bridge))
+        for case, base, new in variants(rng):
+            for direction, signer, computer in directions:
+                with self.subTest(case=case, direction=direction):
+                    rebuilt, size, sha256, literal = rebuild(signer, computer, base, new)
+                    self.assertEqual(rebuilt, new)
+                    self.assertEqual(size, len(new))
+                    self.assertEqual(sha256, hashlib.sha256(new).hexdigest())
+                    if case == "identical":
+                        self.assertEqual(literal, 0)
+
+    def test_gives_up_above_max_literal(self):
+        base = randbytes(random.Random(1), 100_000)
+        new = randbytes(random.Random(2), 100_000)
+        block_size = server.delta_block_size(len(base))
+        size, _, blocks = server.file_signature(io.BytesIO(base), block_size)
+        self.assertIsNone(bridge.compute_delta(new, block_size, blocks, size, 1000))
+        self.assertIsNone(server.compute_delta(new, block_size, blocks, size, 1000))
+
+
+if __name__ == "__main__":
+    unittest.main()